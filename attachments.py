@@ -0,0 +1,219 @@
+"""
+    Photos & documents attached to faults by their reporter
+
+    Files are downloaded from Telegram in chunks into a local content-addressed store: every file is saved under the
+    SHA-256 of its contents, so the same photo sent twice is stored once, and memory stays bounded whatever the file size.
+    A file Telegram already handed to the bot under the same file_unique_id is not downloaded again.
+
+    The fault store keeps which files are attached to which fault, together with the file_id Telegram gave every file.
+    Recipients are sent the attachments by file_id, Telegram serves the file it already holds, so the bot uploads nothing
+    however many recipients there are.
+"""
+
+# Import statements
+import os
+import hashlib
+import tempfile
+import threading
+import urllib.request
+
+# Kinds of attachments, named after the Bot API method sending them
+PHOTO = "photo"
+DOCUMENT = "document"
+
+# Bytes read from Telegram or the store at a time
+CHUNK_SIZE = 64 * 1024
+
+# Max bytes of a file the Bot API lets bots download
+DEFAULT_MAX_SIZE = 20 * 1024 * 1024
+
+# Tables of the attachments, created in the fault store
+ATTACHMENT_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS attachments (id INTEGER PRIMARY KEY AUTOINCREMENT, fault_id INTEGER NOT NULL, kind TEXT NOT NULL, "
+    "file_id TEXT NOT NULL, file_unique_id TEXT NOT NULL, digest TEXT NOT NULL, size INTEGER NOT NULL, file_name TEXT)",
+    "CREATE INDEX IF NOT EXISTS idx_attachments_fault_id ON attachments (fault_id)",
+    "CREATE INDEX IF NOT EXISTS idx_attachments_file_unique_id ON attachments (file_unique_id)",
+)
+
+
+class Attachment:
+    """
+    A file attached to a fault, kept in the draft of the fault while it is being reported
+    """
+    __slots__ = ("kind", "file_id", "file_unique_id", "digest", "size", "file_name")
+
+    def __init__(self, kind, file_id, file_unique_id, digest, size, file_name=None):
+        self.kind = kind
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.digest = digest
+        self.size = size
+        self.file_name = file_name
+
+    def _fields(self):
+        return self.kind, self.file_id, self.file_unique_id, self.digest, self.size, self.file_name
+
+    def __reduce__(self):
+        # Pickled as a plain tuple of the fields, like fault_draft.FaultDraft
+        return Attachment, self._fields()
+
+    def __eq__(self, other):
+        return isinstance(other, Attachment) and self._fields() == other._fields()
+
+    def __repr__(self):
+        return f"Attachment(kind={self.kind!r}, digest={self.digest[:12]!r}, size={self.size})"
+
+
+class AttachmentTooLarge(ValueError):
+    """
+    Raised when a file is larger than the max size of an attachment
+    """
+
+
+def download(url, chunk_size=CHUNK_SIZE, timeout=30):
+    """
+    Yields the contents of a file at a URL a chunk at a time
+    """
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class AttachmentStore:
+    """
+    Content-addressed store of attachments in a directory, indexed in the fault store
+    """
+    def __init__(self, store, directory, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param store: type: fault_store.SQLiteFaultStore
+        Store holding the faults, the attachments of every fault are saved in it
+
+        :param directory: type: str
+        Directory the files are kept in, as {digest[:2]}/{digest}
+
+        :param max_size: type: int
+        Max bytes of an attachment
+        """
+        self.store = store
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+        with store.transaction() as connection:
+            for statement in ATTACHMENT_SCHEMA:
+                connection.execute(statement)
+
+        self._lock = threading.Lock()
+
+    def path(self, digest):
+        """
+        Returns the filename of a file in the store
+        """
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def __contains__(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, chunks):
+        """
+        Saves a file into the store, a chunk at a time
+
+        :param chunks: type: iterable
+        Contents of the file as bytes
+
+        :return: type: tuple
+        SHA-256 hex digest & size in bytes of the file
+
+        :raises AttachmentTooLarge: if the file is larger than max_size, nothing is saved
+        """
+        digest = hashlib.sha256()
+        size = 0
+        # Written next to the store, so that it can be moved into place without copying
+        file = tempfile.NamedTemporaryFile(dir=self.directory, prefix=".upload_", delete=False)
+        try:
+            with file:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise AttachmentTooLarge(f"Attachment is larger than {self.max_size // (1024 * 1024)} MB")
+                    digest.update(chunk)
+                    file.write(chunk)
+
+            digest = digest.hexdigest()
+            path = self.path(digest)
+            with self._lock:
+                if os.path.exists(path):
+                    # Same contents saved before
+                    os.remove(file.name)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(file.name, path)
+        except BaseException:
+            if os.path.exists(file.name):
+                os.remove(file.name)
+            raise
+
+        return digest, size
+
+    def iter_chunks(self, digest, chunk_size=CHUNK_SIZE):
+        """
+        Yields the contents of a file in the store a chunk at a time
+        """
+        with open(self.path(digest), "rb") as file:
+            while True:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def save(self, url, kind, file_id, file_unique_id, file_name=None):
+        """
+        Downloads a file sent to the bot into the store, unless the same file was saved before
+
+        :param url: type: str or callable
+        URL of the file, or a callable returning it so that it is only looked up when the file has to be downloaded
+
+        :param kind: type: str
+        PHOTO or DOCUMENT
+
+        :param file_id: type: str
+        Identifier Telegram gave the file, used to send it on
+
+        :param file_unique_id: type: str
+        Identifier of the file that stays the same across bots & time
+
+        :param file_name: type: str or None
+        Original filename of a document
+
+        :return: type: Attachment
+        The saved file
+
+        :raises AttachmentTooLarge: if the file is larger than max_size
+        :raises OSError: if the file cannot be downloaded or saved
+        """
+        rows = self.store.execute("SELECT digest, size FROM attachments WHERE file_unique_id = ? LIMIT 1", (file_unique_id,))
+        if rows and rows[0]["digest"] in self:
+            digest, size = rows[0]["digest"], rows[0]["size"]
+        else:
+            digest, size = self.put(download(url() if callable(url) else url))
+        return Attachment(kind, file_id, file_unique_id, digest, size, file_name)
+
+    def attach(self, connection, fault_id, attachments):
+        """
+        Saves the attachments of a fault, inside the transaction of the caller saving the fault
+        """
+        connection.executemany("INSERT INTO attachments (fault_id, kind, file_id, file_unique_id, digest, size, file_name) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               [(fault_id, attachment.kind, attachment.file_id, attachment.file_unique_id, attachment.digest,
+                                 attachment.size, attachment.file_name) for attachment in attachments])
+
+    def get_attachments(self, fault_id):
+        """
+        Returns the attachments of a fault in the order they were sent
+        """
+        rows = self.store.execute("SELECT kind, file_id, file_unique_id, digest, size, file_name FROM attachments "
+                                  "WHERE fault_id = ? ORDER BY id", (fault_id,))
+        return [Attachment(*row) for row in rows]
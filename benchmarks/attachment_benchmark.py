@@ -0,0 +1,147 @@
+"""
+    Benchmark of the attachments of faults
+
+    1. Store - Saves generated files of 1 to 20 MB into the content-addressed store in chunks, measuring the peak memory
+       with tracemalloc against reading the whole file into memory first, then saves every file again to check it is
+       stored once
+    2. Fan-out - Runs the bot against a local stand-in for the Bot API, submits a fault with a photo attached for a
+       growing recipient list and measures the bytes the bot uploaded & downloaded, against uploading the photo again to
+       every recipient
+
+    Usage:
+    python benchmarks/attachment_benchmark.py --photo-size 2000000
+"""
+
+# Import statements
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+from fault_store import SQLiteFaultStore
+from attachments import AttachmentStore, CHUNK_SIZE
+
+# Chat id of the reporter, recipients come after it
+REPORTER_ID = 1
+FIRST_RECIPIENT_ID = 1000
+
+
+def generate(size, seed):
+    """
+    Yields the contents of a generated file a chunk at a time
+    """
+    block = os.urandom(CHUNK_SIZE // 2) + bytes([seed % 256]) * (CHUNK_SIZE // 2)
+    for start in range(0, size, CHUNK_SIZE):
+        yield block[:min(CHUNK_SIZE, size - start)]
+
+
+def measure(function):
+    """
+    Returns the result, seconds taken & peak memory in MB of a function call
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def benchmark_store(workdir):
+    store = SQLiteFaultStore(os.path.join(workdir, "faults.db"))
+    attachments = AttachmentStore(store, os.path.join(workdir, "attachments"), max_size=64 * 1024 * 1024)
+
+    print(f"{'size':>8}{'chunked':>12}{'peak':>10}{'whole file':>14}{'peak':>10}")
+    sizes = (1, 5, 20)
+    for size in sizes:
+        chunks = list(generate(size * 1024 * 1024, size))
+        (digest, _), chunked_time, chunked_peak = measure(lambda: attachments.put(iter(chunks)))
+        _, whole_time, whole_peak = measure(lambda: attachments.put([b"".join(chunks)]))
+        print(f"{size:>6}MB{chunked_time * 1000:>10.1f}ms{chunked_peak:>8.2f}MB{whole_time * 1000:>12.1f}ms{whole_peak:>8.2f}MB")
+
+    files = sum(len(names) for _, _, names in os.walk(attachments.directory))
+    print(f"Saved {len(sizes)} files twice each, {files} files in the store")
+    store.close()
+
+
+def submit_fault(api, photo):
+    """
+    Reports a fault with a photo attached, as the reporter would
+    """
+    for text, replies in (("/start", 1), ("Leaking tap", 1), ("Water is leaking from the tap", 1), ("Blk 3 level 2", 2), (None, 1), ("Yes", 2)):
+        start = api.message_count(REPORTER_ID)
+        if text is None:
+            api.push_file(REPORTER_ID, "Reporter", photo)
+        else:
+            api.push_message(REPORTER_ID, "Reporter", text)
+        api.wait_messages(REPORTER_ID, start, replies, timeout=60)
+
+
+def benchmark_fan_out(workdir, photo_size, recipient_counts):
+    api = FakeBotAPI()
+    api.start()
+    os.chdir(workdir)
+    recipients = [FIRST_RECIPIENT_ID + index for index in range(max(recipient_counts))]
+    os.environ.update({
+        "bot_token": "123456:ATTACHMENTSATTACHMENTSATTACHMENTSA",
+        "recipient_list": ",".join(str(chat_id) for chat_id in recipients),
+        "bot_api_url": api.base_url,
+        "log_level": os.getenv("log_level", "WARNING"),
+    })
+
+    import run
+    run.create_app()
+    run.add_handlers()
+    run.outbox.start()
+    run.updater.start_polling(poll_interval=0, timeout=1)
+
+    print(f"{'recipients':>10}{'uploaded':>12}{'downloaded':>12}{'re-uploading':>14}")
+    try:
+        for count in recipient_counts:
+            run.recipient_router.everyone = recipients[:count]
+            run.recipient_list = recipients[:count]
+            received, downloaded = api.bytes_received, api.bytes_downloaded
+            counts = {chat_id: api.message_count(chat_id) for chat_id in recipients[:count]}
+
+            submit_fault(api, os.urandom(photo_size))
+            for chat_id in recipients[:count]:
+                api.wait_messages(chat_id, counts[chat_id], 3, timeout=60)
+
+            uploaded = api.bytes_received - received
+            print(f"{count:>10}{uploaded / 1024:>10.1f}KB{(api.bytes_downloaded - downloaded) / 1024:>10.1f}KB"
+                  f"{(uploaded + photo_size * count) / 1024:>12.1f}KB")
+    finally:
+        run.updater.stop()
+        run.outbox.stop()
+        run.fan_out.shutdown()
+        run.recipient_directory.shutdown()
+        run.persistence.close()
+        run.fault_store.close()
+        api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the attachments of faults")
+    parser.add_argument("--photo-size", type=int, default=2000000, help="Bytes of the photo attached to the faults")
+    parser.add_argument("--recipients", type=int, nargs="+", default=[1, 10, 50], help="Recipient list sizes")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="attachment_benchmark_")
+    try:
+        benchmark_store(workdir)
+        print()
+        benchmark_fan_out(workdir, args.photo_size, args.recipients)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
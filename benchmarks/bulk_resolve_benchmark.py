@@ -0,0 +1,104 @@
+"""
+    Benchmark of resolving a batch of faults, one /resolved command per fault against a single bulk /resolved
+
+    Runs the bot against a local stand-in for the Telegram Bot API, saves the given number of active faults, then has a
+    recipient resolve half of them with one command each and the other half with a single /resolved {first}-{last}.
+    Measures the time until every recipient was notified and the Bot API calls made along the way.
+
+    Usage:
+    python benchmarks/bulk_resolve_benchmark.py --faults 40 --recipients 10 --latency 0.02
+"""
+
+# Import statements
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+
+# Chat id of the first recipient, the one resolving the faults
+CLERK_ID = 1000
+
+
+def resolve(api, run, commands, recipients, timeout):
+    """
+    Sends the commands from the first recipient and waits until the outbox is drained
+
+    :return: type: tuple
+    Seconds taken, sendMessage calls & getChat calls made
+    """
+    calls = dict(api.calls)
+    start = time.perf_counter()
+    for command in commands:
+        api.push_message(CLERK_ID, "Clerk", command)
+
+    # Every recipient is notified at least once
+    counts = {chat_id: api.message_count(chat_id) for chat_id in recipients}
+    for chat_id in recipients:
+        api.wait_messages(chat_id, counts[chat_id], 1, timeout=timeout)
+    deadline = time.perf_counter() + timeout
+    while (run.outbox.pending_count() or run.updater.dispatcher.update_queue.qsize()) and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, *(api.calls.get(method, 0) - calls.get(method, 0) for method in ("sendMessage", "getChat"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of resolving a batch of faults")
+    parser.add_argument("--faults", type=int, default=40, help="Faults resolved by each approach")
+    parser.add_argument("--recipients", type=int, default=10, help="Recipients in the recipient list")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds every Bot API call is delayed by")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Max seconds to wait for the notifications")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.latency)
+    api.start()
+    recipients = [CLERK_ID + index for index in range(args.recipients)]
+    workdir = tempfile.mkdtemp(prefix="bulk_resolve_benchmark_")
+    os.chdir(workdir)
+    os.environ.update({
+        "bot_token": "123456:BULKRESOLVEBULKRESOLVEBULKRESOLVEBU",
+        "recipient_list": ",".join(str(chat_id) for chat_id in recipients),
+        "bot_api_url": api.base_url,
+        "log_level": os.getenv("log_level", "WARNING"),
+    })
+
+    import run
+    run.create_app()
+    run.add_handlers()
+    run.outbox.start()
+    run.updater.start_polling(poll_interval=0, timeout=1)
+
+    for fault_id in range(1, 2 * args.faults + 1):
+        run.fault_store.add_fault(fault_id, "Leaking tap", "Water is leaking from the tap", f"Block {fault_id % 40}",
+                                  1, "Reporter", None, None, time.time())
+
+    try:
+        results = {
+            "one per fault": resolve(api, run, [f"/resolved {fault_id}" for fault_id in range(1, args.faults + 1)],
+                                     recipients, args.timeout),
+            "bulk": resolve(api, run, [f"/resolved {args.faults + 1}-{2 * args.faults}"], recipients, args.timeout),
+        }
+    finally:
+        run.updater.stop()
+        run.outbox.stop()
+        run.fan_out.shutdown()
+        run.recipient_directory.shutdown()
+        run.persistence.close()
+        run.fault_store.close()
+        api.stop()
+
+    print(f"Faults: {args.faults}, recipients: {args.recipients}, API latency: {args.latency * 1000:.0f}ms")
+    print(f"{'':<16}{'elapsed':>10}{'sendMessage':>13}{'getChat':>9}")
+    for name, (elapsed, sent, chats) in results.items():
+        print(f"{name:<16}{elapsed:>9.2f}s{sent:>13}{chats:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+    Demo of the bot running as several processes against a local stand-in for the Telegram Bot API
+
+    Starts shard_count processes of run.py sharing one fault store, then:
+        1. Reporters spread over every shard submit faults at the same time
+        2. The leader is killed (SIGKILL) while faults keep being submitted, another shard takes over the lease
+        3. The killed shard is restarted and handles the updates that were waiting for it
+
+    Checks that every reporter got through and that recipients were notified of every fault. Notifications are sent at
+    least once: those in flight when the leader is killed are sent again by the next leader, and reported as duplicates.
+
+    Usage:
+    python benchmarks/cluster_demo.py --shards 3 --users 6 --faults 2
+"""
+
+# Import statements
+import os
+import sys
+import time
+import signal
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+from load_test import Timings, SimulatedUser, REPORTER_STEPS, classify_messages, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Chat id of the recipient
+CLERK_ID = 1000
+
+
+def start_shard(workdir, environment, shard):
+    """
+    Starts a shard of the bot in its own working directory
+
+    :return: type: subprocess.Popen
+    The shard process
+    """
+    shard_dir = os.path.join(workdir, f"shard{shard}")
+    os.makedirs(shard_dir, exist_ok=True)
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, "run.py")], cwd=shard_dir,
+                            env=dict(environment, shard_index=str(shard)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def leader_shard(fault_db):
+    """
+    Returns the index of the shard holding the leader lease, None if no shard holds it
+    """
+    connection = sqlite3.connect(fault_db, timeout=30)
+    try:
+        row = connection.execute("SELECT holder FROM leases WHERE name = 'leader' AND expires_at > ?", (time.time(),)).fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        connection.close()
+    return int(row[0].rsplit(":", 1)[1]) if row else None
+
+
+def submit_faults(users, faults, submitted):
+    def report(user):
+        for _ in range(faults):
+            number = user.user_id * 1000 + len(submitted)
+            replies = [user.send(step, text(number), count) for step, text, count in REPORTER_STEPS]
+            if len(replies[-1]) == REPORTER_STEPS[-1][2]:
+                submitted.append(user.user_id)
+
+    threads = [threading.Thread(target=report, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Demo of the bot running as several processes")
+    parser.add_argument("--shards", type=int, default=3, help="Number of processes")
+    parser.add_argument("--users", type=int, default=6, help="Reporters, spread over the shards by their chat id")
+    parser.add_argument("--faults", type=int, default=2, help="Faults submitted by every reporter in each phase")
+    parser.add_argument("--lease-ttl", type=float, default=3.0, help="leader_lease_ttl of the shards")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds a user waits for a reply")
+    args = parser.parse_args()
+    if args.shards < 2:
+        parser.error("at least 2 shards are needed to fail over")
+
+    api = FakeBotAPI(classify=classify_messages())
+    api.start()
+
+    workdir = tempfile.mkdtemp(prefix="cluster_demo_")
+    fault_db = os.path.join(workdir, "faults.db")
+    environment = dict(os.environ, bot_token="123456:CLUSTERDEMOCLUSTERDEMOCLUSTERDEMOCLU", recipient_list=str(CLERK_ID),
+                       bot_api_url=api.base_url, fault_db=fault_db, archive_dir=os.path.join(workdir, "archive"),
+                       attachment_dir=os.path.join(workdir, "attachments"), shard_count=str(args.shards), leader_lease_ttl=str(args.lease_ttl), log_level="INFO")
+    shards = {shard: start_shard(workdir, environment, shard) for shard in range(args.shards)}
+
+    timings = Timings()
+    users = [SimulatedUser(api, 1 + index, timings, args.timeout) for index in range(args.users)]
+    submitted = []
+    try:
+        # Phase 1, every shard handles its own reporters
+        start = time.perf_counter()
+        submit_faults(users, args.faults, submitted)
+        leader = leader_shard(fault_db)
+        print(f"Phase 1: {len(submitted)} faults submitted in {time.perf_counter() - start:.2f}s, leader: shard {leader}")
+
+        # Phase 2, the leader dies, reporters of the other shards keep submitting
+        shards[leader].send_signal(signal.SIGKILL)
+        shards[leader].wait()
+        killed_at = time.perf_counter()
+        survivors = [user for user in users if user.user_id % args.shards != leader]
+        submit_faults(survivors, args.faults, submitted)
+        new_leader = leader_shard(fault_db)
+        print(f"Phase 2: killed shard {leader}, shard {new_leader} took over, "
+              f"{len(submitted)} faults submitted {time.perf_counter() - killed_at:.2f}s after the kill")
+
+        # Phase 3, the killed shard comes back and picks up its chats
+        shards[leader] = start_shard(workdir, environment, leader)
+        stranded = [user for user in users if user.user_id % args.shards == leader]
+        start = time.perf_counter()
+        submit_faults(stranded, args.faults, submitted)
+        print(f"Phase 3: restarted shard {leader}, {len(submitted)} faults submitted in {time.perf_counter() - start:.2f}s")
+
+        # Every fault has to reach the recipient at least once
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline:
+            notices, _ = api.wait_messages(CLERK_ID, 0, 10 ** 6, timeout=0,
+                                           predicate=lambda message: message.text == "New fault has been submitted!")
+            if len(notices) >= len(submitted):
+                break
+            time.sleep(0.5)
+        time.sleep(2)
+        notices, _ = api.wait_messages(CLERK_ID, 0, 10 ** 6, timeout=0,
+                                       predicate=lambda message: message.text == "New fault has been submitted!")
+    finally:
+        for process in shards.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in shards.values():
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        api.stop()
+
+    expected = args.users * args.faults * 2
+    print(f"Faults submitted: {len(submitted)}/{expected}, notifications received: {len(notices)}, "
+          f"duplicates: {max(0, len(notices) - len(submitted))}, timeouts: {sum(user.errors for user in users)}")
+    steps = dict(timings.items()).get("step (all)", [0])
+    print(f"Step latency p50: {percentile(steps, 0.5) * 1000:.1f}ms, p95: {percentile(steps, 0.95) * 1000:.1f}ms, max: {steps[-1] * 1000:.1f}ms")
+    print("OK" if len(submitted) == expected and len(notices) >= len(submitted) else "FAILED")
+
+
+if __name__ == '__main__':
+    main()
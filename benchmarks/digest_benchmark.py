@@ -0,0 +1,126 @@
+"""
+    Benchmark of the digest mode during a burst of faults
+
+    Sends the notifications of a burst of new faults, two messages each, to every recipient through the outbox and a
+    local stand-in for the Telegram Bot API, once sending every notification right away and once holding them for
+    digests. Every chat is limited to the rate Telegram allows. Measures:
+        1. messages - sendMessage calls made & messages saved by packing the notifications
+        2. drained - Time from the first fault until every recipient was sent every fault
+        3. latency - Median & max time from a fault being saved until a recipient was sent it, for urgent faults too
+
+    Usage:
+    python benchmarks/digest_benchmark.py --faults 20 --recipients 5 --window 5
+"""
+
+# Import statements
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+from fault_store import SQLiteFaultStore
+from outbox import Outbox
+from fanout import FanOut
+from digest import DigestPolicy
+from metrics import BotMetrics
+
+# Chat id of the first recipient
+RECIPIENT_ID = 1000
+
+# Type of the faults that are never held for a digest
+URGENT_TYPE = "Fire alarm"
+
+
+def burst(api, args, digest):
+    """
+    Saves the notifications of the burst of faults & waits until the outbox is drained
+
+    :return: type: tuple
+    Seconds until drained, sendMessage calls, seconds until every (fault, recipient) was sent the fault, by urgency
+    """
+    import telegram
+
+    store = SQLiteFaultStore(os.path.join(tempfile.mkdtemp(prefix="digest_benchmark_"), "faults.db"))
+    fan_out = FanOut(telegram.Bot("123456:DIGESTDIGESTDIGESTDIGESTDIGESTDIGES", base_url=api.base_url), per_chat_rate=args.per_chat_rate)
+    outbox = Outbox(store, lambda chat_ids, messages, description: fan_out.send(chat_ids, messages), poll_interval=0.05, digest=digest)
+    outbox.start()
+
+    recipients = [RECIPIENT_ID + index for index in range(args.recipients)]
+    saved_at = {}
+    start = time.perf_counter()
+    for fault_id in range(1, args.faults + 1):
+        type_of_fault = URGENT_TYPE if fault_id % args.urgent_every == 0 else "Leaking tap"
+        messages = [dict(text="New fault has been submitted!"),
+                    dict(text=f"*Fault ID:* {fault_id}\n*Type:* {type_of_fault}\n*Description:* Water everywhere\n*Location:* Blk 12 Lvl 3",
+                         parse_mode="MarkdownV2")]
+        with store.transaction() as connection:
+            outbox.enqueue(connection, recipients, messages, "fault details", fault_id=fault_id,
+                           urgent=digest is not None and digest.is_urgent(type_of_fault))
+        saved_at[fault_id] = (time.perf_counter(), type_of_fault == URGENT_TYPE)
+        time.sleep(args.spread / args.faults)
+
+    deadline = time.perf_counter() + args.timeout
+    while outbox.pending_count() and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    outbox.stop()
+    fan_out.shutdown()
+    store.close()
+
+    latencies = {False: [], True: []}
+    for chat_id in recipients:
+        messages, _ = api.wait_messages(chat_id, 0, api.message_count(chat_id), timeout=0)
+        for fault_id, (saved, urgent) in saved_at.items():
+            marker = f"*Fault ID:* {fault_id}\n"
+            latencies[urgent].extend(message.sent_at - saved for message in messages if marker in message.text)
+    return elapsed, api.calls.get("sendMessage", 0), latencies
+
+
+def describe(latencies):
+    if not latencies:
+        return "-"
+    return f"{statistics.median(latencies):.2f}s median, {max(latencies):.2f}s max"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the digest mode during a burst of faults")
+    parser.add_argument("--faults", type=int, default=20, help="Faults in the burst")
+    parser.add_argument("--recipients", type=int, default=5, help="Recipients notified of every fault")
+    parser.add_argument("--spread", type=float, default=5.0, help="Seconds the faults of the burst are saved over")
+    parser.add_argument("--window", type=float, default=5.0, help="Seconds notifications are held for a digest")
+    parser.add_argument("--urgent-every", type=int, default=10, help="Every n-th fault is of an urgent type")
+    parser.add_argument("--per-chat-rate", type=float, default=1.0, help="Max messages per second for a single chat")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds every Bot API call is delayed by")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Max seconds to wait for the outbox to be drained")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("right away", "digest"):
+        digest = None
+        if mode == "digest":
+            digest = DigestPolicy(args.window, urgent_types=[URGENT_TYPE.split()[0]])
+            bot_metrics = BotMetrics()
+            bot_metrics.instrument_digest(digest)
+
+        api = FakeBotAPI(latency=args.latency)
+        api.start()
+        results[mode] = burst(api, args, digest)
+        api.stop()
+
+    saved = bot_metrics.digest_saved.labels().value
+    print(f"Burst of {args.faults} faults ({args.faults // args.urgent_every} urgent) over {args.spread}s to {args.recipients} recipients, "
+          f"{args.per_chat_rate} messages per second per chat, digest window: {args.window}s")
+    for mode, (elapsed, messages, latencies) in results.items():
+        print(f"{mode:<12} {messages:>5} messages  drained in {elapsed:>6.2f}s  "
+              f"latency: {describe(latencies[False])}, urgent: {describe(latencies[True])}")
+    print(f"Messages saved by the digests: {saved:.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+    Benchmark of the user_data persisted for reporters mid-conversation
+
+    Compares the user_data kept by earlier versions of the bot, the fields of the fault along with the telegram.Message
+    of the fault summary, against a FaultDraft. Measures the pickled size of a single reporter's user_data as
+    persistence saves it, and the time taken to save the state of 1k & 10k reporters mid-conversation with
+    PicklePersistence, as every change did before the persistence journal.
+
+    Usage:
+    python benchmarks/draft_benchmark.py
+"""
+
+# Import statements
+import os
+import sys
+import time
+import pickle
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telegram
+from telegram.ext import PicklePersistence
+from fault_draft import FaultDraft, DRAFT_KEY
+
+BOT = telegram.Bot("123456:BENCHMARKBENCHMARKBENCHMARKBENCHMARK")
+
+TYPE = "Leaking tap"
+DESCRIPTION = "Water is leaking from the tap in the toilet, the floor is wet " * 3
+LOCATION = "Block 12, level 3, toilet next to the lift"
+
+
+def summary_message(user_id):
+    """
+    Returns the fault summary as Telegram returns it from sendMessage
+    """
+    text = f"Type of fault: {TYPE}\nDescription: {DESCRIPTION}\nLocation: {LOCATION}"
+    entities = [{"type": "bold", "offset": offset, "length": length}
+                for offset, length in [(0, 14), (len(TYPE) + 16, 12), (len(TYPE) + len(DESCRIPTION) + 30, 9)]]
+    return telegram.Message.de_json({
+        "message_id": 1000 + user_id, "date": 1622000000, "text": text, "entities": entities,
+        "chat": {"id": user_id, "type": "private", "first_name": "Reporter", "username": f"reporter{user_id}"},
+        "from": {"id": 123456, "is_bot": True, "first_name": "Fault bot", "username": "fault_bot"},
+    }, BOT)
+
+
+def legacy_user_data(user_id):
+    return {"type_of_fault": TYPE, "description_of_fault": DESCRIPTION, "location_of_fault": LOCATION,
+            "fault_summary": summary_message(user_id)}
+
+
+def draft_user_data(user_id):
+    return {DRAFT_KEY: FaultDraft(TYPE, DESCRIPTION, LOCATION, summarized_at=1622000000.0)}
+
+
+def save_time(make_user_data, size):
+    """
+    Returns the seconds taken by PicklePersistence to save the state of the given number of reporters, and its size
+    """
+    workdir = tempfile.mkdtemp(prefix="draft_benchmark_")
+    persistence = PicklePersistence(filename=os.path.join(workdir, "data"))
+    persistence.set_bot(BOT)
+    persistence.get_user_data()
+    for user_id in range(size):
+        persistence.user_data[user_id] = persistence.replace_bot(make_user_data(user_id))
+
+    start = time.perf_counter()
+    persistence.dump_singlefile()
+    elapsed = time.perf_counter() - start
+    file_size = os.path.getsize(os.path.join(workdir, "data"))
+    shutil.rmtree(workdir)
+    return elapsed, file_size
+
+
+def main():
+    for name, make_user_data in [("legacy", legacy_user_data), ("draft", draft_user_data)]:
+        user_data = PicklePersistence.replace_bot(make_user_data(1))
+        print(f"{name}: {len(pickle.dumps(user_data))} bytes per reporter")
+
+    print(f"{'reporters':>10}{'legacy':>12}{'draft':>12}{'legacy size':>14}{'draft size':>14}")
+    for size in (1000, 10000):
+        legacy_time, legacy_size = save_time(legacy_user_data, size)
+        draft_time, draft_size = save_time(draft_user_data, size)
+        print(f"{size:>10}{legacy_time * 1000:>10.1f}ms{draft_time * 1000:>10.1f}ms"
+              f"{legacy_size / 1024:>12.0f}KB{draft_size / 1024:>12.0f}KB")
+
+
+if __name__ == '__main__':
+    main()
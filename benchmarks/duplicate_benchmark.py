@@ -0,0 +1,145 @@
+"""
+    Benchmark of the near-duplicate detection of faults being reported
+
+    Fills a temporary fault store with generated active faults, then measures:
+        1. index - Indexing every active fault, as done on start, and the memory the index takes
+        2. lookup - Finding the likely duplicates of a fault being reported, against comparing it with every active fault
+        3. recall - Share of reports of an existing fault, reworded the way another reporter would, that find it, and
+           share of reports of new faults that are wrongly matched to an existing one
+        4. add & remove - Indexing a fault as it is reported & dropping it as it is resolved
+
+    Usage:
+    python benchmarks/duplicate_benchmark.py --faults 50000
+"""
+
+# Import statements
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fault_store import SQLiteFaultStore, Fault, ACTIVE
+from duplicates import DuplicateIndex, DEFAULT_BANDS, DEFAULT_LOCATION_ROWS, DEFAULT_TEXT_ROWS, DEFAULT_THRESHOLD
+
+# Things that break, how they break & where
+THINGS = ["light", "tap", "pipe", "aircon", "door", "window", "lift", "toilet", "fan", "socket", "ceiling", "sink", "heater",
+          "railing", "gate", "lock", "shower", "drain", "projector", "chair"]
+DEFECTS = {
+    "broken": ["is broken", "does not work", "stopped working", "is faulty"],
+    "leaking": ["is leaking water", "has a leak", "is dripping", "leaks onto the floor"],
+    "noisy": ["is making a loud noise", "rattles", "is very noisy", "makes a buzzing sound"],
+    "stuck": ["is stuck", "cannot be opened", "is jammed", "will not close"],
+    "dirty": ["is very dirty", "is stained", "smells bad", "has not been cleaned"],
+}
+DETAILS = ["since this morning", "for two days", "near the entrance", "next to the stairs", "at the corner", "after the rain",
+           "every few minutes", "on and off", "please fix asap", "it is dangerous", "students complained", "again"]
+# Ways of writing the same place, some leave the room out
+LOCATIONS = ["Blk {block} Lvl {level} Rm {room}", "Block {block} Level {level} Room {room}", "Blk {block} #{level:02d}-{room:02d}",
+             "#{level:02d}-{room:02d}, block {block}", "Block {block} level {level}"]
+
+
+def report(rng, fault=None):
+    """
+    Returns the type, description & location of a new fault, or of the given fault reworded by another reporter
+
+    :param fault: type: tuple or None
+    (thing, defect, block, level, room) of the fault reported
+    """
+    if fault is None:
+        fault = (rng.choice(THINGS), rng.choice(list(DEFECTS)), rng.randint(1, 999), rng.randint(1, 20), rng.randint(1, 99))
+    thing, defect, block, level, room = fault
+    description = f"The {thing} {rng.choice(DEFECTS[defect])} {' '.join(rng.sample(DETAILS, rng.randint(0, 2)))}".strip()
+    return fault, (f"{defect.capitalize()} {thing}", description, rng.choice(LOCATIONS).format(block=block, level=level, room=room))
+
+
+def timed(function, runs):
+    """
+    Returns the median seconds taken by a function
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the near-duplicate detection of faults being reported")
+    parser.add_argument("--faults", type=int, default=50000, help="Active faults in the fault store")
+    parser.add_argument("--lookups", type=int, default=500, help="Reports looked up, half of them reworded existing faults")
+    parser.add_argument("--bands", type=int, default=DEFAULT_BANDS, help="Bands of the signatures")
+    parser.add_argument("--location-rows", type=int, default=DEFAULT_LOCATION_ROWS, help="Location values in every band")
+    parser.add_argument("--text-rows", type=int, default=DEFAULT_TEXT_ROWS, help="Type & description values in every band")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Min estimated similarity of a likely duplicate")
+    args = parser.parse_args()
+
+    rng = random.Random(args.faults)
+    store = SQLiteFaultStore(os.path.join(tempfile.mkdtemp(prefix="duplicate_benchmark_"), "faults.db"))
+    faults = [report(rng) for _ in range(args.faults)]
+    store.add_faults(Fault(fault_id, *fields, 1, "Reporter", None, None, time.time(), None, ACTIVE, 0)
+                     for fault_id, (_, fields) in enumerate(faults, start=1))
+
+    def build():
+        return DuplicateIndex(store, threshold=args.threshold, bands=args.bands, location_rows=args.location_rows, text_rows=args.text_rows)
+
+    index = build()
+    start = time.perf_counter()
+    index.sync()
+    elapsed = time.perf_counter() - start
+
+    # Memory of the index, measured on another one as tracemalloc slows indexing down
+    tracemalloc.start()
+    traced = build()
+    traced.sync()
+    memory = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+    del traced
+
+    # Reports of existing faults, reworded, and of new faults
+    duplicates = [(fault_id, report(rng, faults[fault_id - 1][0])[1]) for fault_id in rng.sample(range(1, args.faults + 1), args.lookups // 2)]
+    existing = {fault for fault, _ in faults}
+    fresh = []
+    while len(fresh) < args.lookups - len(duplicates):
+        fault, fields = report(rng)
+        if fault not in existing:
+            fresh.append(fields)
+
+    found = sum(1 for fault_id, fields in duplicates if fault_id in [fault.id for fault, _ in index.find(*fields, limit=3)])
+    wrong = sum(1 for fields in fresh if index.find(*fields))
+    candidates = index.candidates / index.lookups
+
+    queries = [fields for _, fields in duplicates] + fresh
+    lookup = timed(lambda: index.find(*rng.choice(queries)), args.lookups)
+    signatures = list(index._signatures.values())
+
+    def scan():
+        query = index.signature(*rng.choice(queries))
+        return [score for score in (index.similarity(query, other) for other in signatures) if score >= args.threshold]
+
+    naive = timed(scan, max(3, args.lookups // 100))
+
+    _, fields = report(rng)
+    add = timed(lambda: index.add(args.faults + 1, *fields), 1)
+    remove = timed(lambda: index.remove([args.faults + 1]), 1)
+    store.close()
+
+    print(f"Active faults: {args.faults}, {args.bands} bands of {args.location_rows} location & {args.text_rows} type & description values, "
+          f"threshold: {args.threshold}")
+    print(f"index         {elapsed:>10.2f}s   ({memory:.1f}MB)")
+    print(f"lookup        {lookup * 1000:>10.2f}ms  ({candidates:.0f} candidates compared, "
+          f"comparing every active fault {naive * 1000:.0f}ms, {naive / lookup:.0f}x)")
+    print(f"recall        {found / len(duplicates) * 100:>10.1f}%   (reworded reports finding the fault they duplicate)")
+    print(f"false matches {wrong / len(fresh) * 100:>10.1f}%   (reports of new faults matched to an existing one)")
+    print(f"add           {add * 1000:>10.3f}ms")
+    print(f"remove        {remove * 1000:>10.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
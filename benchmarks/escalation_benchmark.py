@@ -0,0 +1,97 @@
+"""
+    Benchmark of the escalation of faults left active for too long
+
+    Fills a temporary fault store with active faults reported over the last few hours, then measures:
+        1. rebuild - Building the heap of timers from the fault store, as done on start
+        2. idle tick - A tick with no fault due, the heap against a scan of every active fault
+        3. busy tick - A tick a minute later, escalating the faults that became due in the meantime
+        4. cancel - Cancelling the timers of a batch of resolved faults
+
+    Usage:
+    python benchmarks/escalation_benchmark.py --faults 100000
+"""
+
+# Import statements
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fault_store import SQLiteFaultStore, Fault, ACTIVE
+from escalation import EscalationScheduler, parse_sla_tiers
+
+SLA_TIERS = "14400=recipients,86400=escalation,259200=escalation"
+
+
+def naive_tick(store, tiers, now):
+    """
+    Finds the faults due for escalation by checking every active fault
+    """
+    rows = store.execute("SELECT faults.id, faults.created_at, COALESCE(escalations.tier, 0) FROM faults "
+                         "LEFT JOIN escalations ON escalations.fault_id = faults.id WHERE faults.status = ?", (ACTIVE,))
+    return [fault_id for fault_id, created_at, tier in rows if tier < len(tiers) and created_at + tiers[tier].after <= now]
+
+
+def timed(function, runs):
+    """
+    Returns the median seconds taken by a function
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the escalation of faults left active for too long")
+    parser.add_argument("--faults", type=int, default=100000, help="Active faults in the fault store")
+    parser.add_argument("--runs", type=int, default=20, help="Runs of every measurement")
+    args = parser.parse_args()
+
+    store = SQLiteFaultStore(os.path.join(tempfile.mkdtemp(prefix="escalation_benchmark_"), "faults.db"))
+    tiers = parse_sla_tiers(SLA_TIERS)
+    # Reported over the 4 hours before now, so the first tier becomes due for a steady trickle of faults
+    now = time.time()
+    random.seed(args.faults)
+    store.add_faults(Fault(fault_id, "Leaking tap", "Water is leaking from the tap", f"Block {fault_id % 40}", 1, "Reporter", None, None,
+                           now - random.uniform(0, tiers[0].after), None, ACTIVE, 0) for fault_id in range(1, args.faults + 1))
+
+    escalated = []
+    scheduler = EscalationScheduler(store, tiers, lambda connection, fault, tier: escalated.append(fault.id), max_batch=args.faults)
+
+    rebuild = timed(scheduler.rebuild, 3)
+    scheduler.tick(now)
+    idle = timed(lambda: scheduler.tick(now), args.runs)
+    naive = timed(lambda: naive_tick(store, tiers, now), max(3, args.runs // 5))
+
+    busy = []
+    for minute in range(1, args.runs + 1):
+        count = len(escalated)
+        start = time.perf_counter()
+        scheduler.tick(now + minute * 60)
+        busy.append((time.perf_counter() - start, len(escalated) - count))
+
+    fault_ids = random.sample(range(1, args.faults + 1), 1000)
+    start = time.perf_counter()
+    scheduler.cancel(fault_ids)
+    cancel = time.perf_counter() - start
+    store.close()
+
+    per_tick = statistics.median(count for _, count in busy)
+    print(f"Active faults: {args.faults}, SLA tiers: {SLA_TIERS}")
+    print(f"rebuild       {rebuild * 1000:>10.1f}ms")
+    print(f"idle tick     {idle * 1000:>10.3f}ms  (scan of every active fault {naive * 1000:.1f}ms, {naive / idle:.0f}x)")
+    print(f"busy tick     {statistics.median(elapsed for elapsed, _ in busy) * 1000:>10.1f}ms  ({per_tick:.0f} faults escalated per tick, "
+          f"{statistics.median(elapsed / count for elapsed, count in busy if count) * 1000000:.1f}us per fault)")
+    print(f"cancel 1000   {cancel * 1000:>10.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+    Benchmark of the bulk export & import of the fault history
+
+    Fills a temporary fault store with generated faults, then exports them in every format and imports every export
+    into an empty fault store. Peak memory is measured with tracemalloc, it stays flat however many faults there are.
+
+    Usage:
+    python benchmarks/export_benchmark.py --faults 1000000
+"""
+
+# Import statements
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import itertools
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fault_store import SQLiteFaultStore, Fault, ACTIVE, RESOLVED
+from fault_export import FORMATS, export_faults, import_faults
+
+WORDS = "leaking tap broken light door aircon lift toilet socket window ceiling fan wet floor crack bunk locker".split()
+
+
+def make_faults(count):
+    """
+    Yields generated faults of a realistic length, a tenth of them still active
+    """
+    random.seed(count)
+    created_at = 1609459200.0
+    for fault_id in range(1, count + 1):
+        created_at += random.randint(1, 600)
+        resolved = random.random() > 0.1
+        yield Fault(fault_id, " ".join(random.choices(WORDS, k=3)), " ".join(random.choices(WORDS, k=random.randint(5, 40))),
+                    f"Block {random.randint(1, 40)} level {random.randint(1, 5)}", random.randint(10 ** 8, 10 ** 10),
+                    random.choice(WORDS).capitalize(), None, random.choice([None, random.choice(WORDS)]), created_at,
+                    created_at + random.randint(600, 86400) if resolved else None, RESOLVED if resolved else ACTIVE, int(resolved))
+
+
+def measure(function):
+    """
+    Returns the result, seconds taken & peak memory in MB of a function call
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the bulk export & import of the fault history")
+    parser.add_argument("--faults", type=int, default=100000, help="Number of faults in the fault store")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="export_benchmark_")
+    store = SQLiteFaultStore(os.path.join(workdir, "faults.db"))
+    faults = make_faults(args.faults)
+    while True:
+        batch = list(itertools.islice(faults, 10000))
+        if not batch:
+            break
+        store.add_faults(batch)
+    print(f"Faults: {store.count_faults()}")
+
+    print(f"{'format':>10}{'size':>12}{'export':>10}{'peak':>10}{'import':>10}{'peak':>10}")
+    for format in FORMATS:
+        filename = os.path.join(workdir, f"faults.{format}")
+        with open(filename, "wb") as file:
+            exported, export_time, export_peak = measure(lambda: export_faults(store, file, format))
+
+        target = SQLiteFaultStore(os.path.join(workdir, f"import_{format}.db"))
+        with open(filename, "rb") as file:
+            (read, saved), import_time, import_peak = measure(lambda: import_faults(target, file, format))
+        assert exported == read == saved == target.count_faults() == args.faults, (format, exported, read, saved)
+        target.close()
+
+        print(f"{format:>10}{os.path.getsize(filename) / 1024 / 1024:>10.1f}MB{export_time:>9.2f}s{export_peak:>8.1f}MB"
+              f"{import_time:>9.2f}s{import_peak:>8.1f}MB")
+
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
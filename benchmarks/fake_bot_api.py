@@ -0,0 +1,316 @@
+"""
+    Local stand-in for the Telegram Bot API, used by the load test
+
+    Implements the methods the bot calls (getMe, getUpdates, sendMessage, sendPhoto, sendDocument, getFile, getChat,
+    editMessageText, answerCallbackQuery, deleteWebhook & setWebhook) and file downloads over plain HTTP, with
+    configurable latency and error injection. Simulated users push updates into the server and wait for the messages the
+    bot sends to their chat.
+"""
+
+# Import statements
+import json
+import time
+import socket
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class SentMessage:
+    """
+    A message sent by the bot, as recorded by the server
+    """
+    __slots__ = ("chat_id", "text", "sent_at", "payload", "kind")
+
+    def __init__(self, chat_id, text, sent_at, payload):
+        self.chat_id = chat_id
+        self.text = text
+        self.sent_at = sent_at
+        self.payload = payload
+        # Set by the classify callback of the server
+        self.kind = None
+
+
+class FakeBotAPI:
+    """
+    Bot API server holding the pending updates and the messages sent by the bot
+    """
+    def __init__(self, latency=0.0, error_rate=0.0, retry_after=1, port=0, seed=None, classify=None):
+        """
+        :param latency: type: float
+        Seconds every API call is delayed by
+
+        :param error_rate: type: float
+        Share of sendMessage calls answered with flood control (429) instead of being sent
+
+        :param retry_after: type: int
+        Seconds the bot is told to wait when flood control is injected
+
+        :param port: type: int
+        Port to listen on, 0 for any free port
+
+        :param seed: type: int or None
+        Seed of the error injection
+
+        :param classify: type: callable or None
+        Called with every SentMessage in the order they are sent, returns the kind of the message
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.classify = classify
+        self.injected_errors = 0
+        self.calls = {}
+        # Bytes of the request bodies of the API calls, i.e. uploaded by the bot, and of the files downloaded by the bot
+        self.bytes_received = 0
+        self.bytes_downloaded = 0
+
+        self._random = random.Random(seed)
+        self._condition = threading.Condition()
+        self._pending = []
+        self._update_id = 0
+        self._message_id = 0
+        self._delivered_at = {}
+        self._messages = {}
+        self._files = {}
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """
+        Base URL to hand to telegram.Bot, the token is appended to it
+        """
+        return f"http://127.0.0.1:{self._server.server_address[1]}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake_bot_api", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._condition.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Simulated users
+    def push_message(self, user_id, first_name, text):
+        """
+        Queues a private text message from a user, to be returned by the next getUpdates
+
+        :return: type: int
+        Id of the update carrying the message
+        """
+        message = {"text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._push(user_id, first_name, message)
+
+    def push_file(self, user_id, first_name, content, kind="photo", file_name=None):
+        """
+        Queues a private message from a user holding a photo or document, the bot can download its content through getFile
+
+        :return: type: int
+        Id of the update carrying the message
+        """
+        file_unique_id = hashlib.sha1(content).hexdigest()[:16]
+        with self._condition:
+            file_id = f"file{len(self._files) + 1}_{file_unique_id}"
+            self._files[file_id] = content
+        media = {"file_id": file_id, "file_unique_id": file_unique_id, "file_size": len(content)}
+        if kind == "photo":
+            return self._push(user_id, first_name, {"photo": [dict(media, width=1280, height=960)]})
+        return self._push(user_id, first_name, {"document": dict(media, file_name=file_name or "document.pdf")})
+
+    def _push(self, user_id, first_name, content):
+        with self._condition:
+            self._update_id += 1
+            self._message_id += 1
+            message = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": first_name},
+                "from": {"id": user_id, "is_bot": False, "first_name": first_name},
+            }
+            message.update(content)
+            self._pending.append({"update_id": self._update_id, "message": message})
+            self._condition.notify_all()
+            return self._update_id
+
+    def delivered_at(self, update_id, timeout=30):
+        """
+        Waits until an update was returned to the bot by getUpdates
+
+        :return: type: float or None
+        time.perf_counter() at delivery, None on timeout
+        """
+        deadline = time.perf_counter() + timeout
+        with self._condition:
+            while update_id not in self._delivered_at:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            return self._delivered_at[update_id]
+
+    def wait_messages(self, chat_id, start, count, timeout=30, predicate=None):
+        """
+        Waits until the bot sent a number of messages to a chat
+
+        :param chat_id: type: int
+        Chat the messages are sent to
+
+        :param start: type: int
+        Index of the first message of the chat to consider
+
+        :param count: type: int
+        Number of messages to wait for
+
+        :param timeout: type: float
+        Max seconds to wait
+
+        :param predicate: type: callable or None
+        Only count the messages for which it returns True
+
+        :return: type: tuple
+        (List of the matching messages, index after the last message considered), fewer than count messages on timeout
+        """
+        deadline = time.perf_counter() + timeout
+        with self._condition:
+            while True:
+                messages = self._messages.get(chat_id, [])
+                matching = []
+                index = start
+                while index < len(messages) and len(matching) < count:
+                    if predicate is None or predicate(messages[index]):
+                        matching.append(messages[index])
+                    index += 1
+                remaining = deadline - time.perf_counter()
+                if len(matching) >= count or remaining <= 0:
+                    return matching, index
+                self._condition.wait(remaining)
+
+    def message_count(self, chat_id):
+        with self._condition:
+            return len(self._messages.get(chat_id, []))
+
+    # Bot API methods
+    def _call(self, method, data):
+        """
+        Answers a single Bot API call
+
+        :return: type: dict
+        Response body
+        """
+        with self._condition:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "getUpdates":
+            return {"ok": True, "result": self._get_updates(int(data.get("offset") or 0), float(data.get("timeout") or 0))}
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == "getMe":
+            return {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Fault bot", "username": "fault_bot"}}
+        if method in ("deleteWebhook", "setWebhook", "answerCallbackQuery"):
+            return {"ok": True, "result": True}
+        if method == "getChat":
+            chat_id = int(data["chat_id"])
+            return {"ok": True, "result": {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}}
+        if method == "getFile":
+            with self._condition:
+                content = self._files.get(data.get("file_id"))
+            if content is None:
+                return {"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"}
+            return {"ok": True, "result": {"file_id": data["file_id"], "file_unique_id": data["file_id"].split("_")[-1],
+                                           "file_size": len(content), "file_path": f"files/{data['file_id']}"}}
+        if method in ("sendPhoto", "sendDocument"):
+            # Sent on by file_id, the text of the message is its caption
+            return {"ok": True, "result": self._send_message(int(data["chat_id"]), data.get("caption", ""), data)}
+        if method in ("sendMessage", "editMessageText"):
+            if method == "sendMessage" and self.error_rate and self._random.random() < self.error_rate:
+                with self._condition:
+                    self.injected_errors += 1
+                return {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {self.retry_after}",
+                        "parameters": {"retry_after": self.retry_after}}
+            return {"ok": True, "result": self._send_message(int(data["chat_id"]), data.get("text", ""), data)}
+
+        return {"ok": False, "error_code": 404, "description": "Not Found: method not found"}
+
+    def _get_updates(self, offset, timeout):
+        deadline = time.perf_counter() + timeout
+        with self._condition:
+            # Confirmed updates are dropped, like the real API does
+            self._pending = [update for update in self._pending if update["update_id"] >= offset]
+            while not self._pending and time.perf_counter() < deadline:
+                self._condition.wait(deadline - time.perf_counter())
+
+            now = time.perf_counter()
+            for update in self._pending:
+                self._delivered_at.setdefault(update["update_id"], now)
+            self._condition.notify_all()
+            return list(self._pending)
+
+    def _send_message(self, chat_id, text, payload):
+        with self._condition:
+            self._message_id += 1
+            message = SentMessage(chat_id, text, time.perf_counter(), payload)
+            messages = self._messages.setdefault(chat_id, [])
+            if self.classify is not None:
+                message.kind = self.classify(message)
+            messages.append(message)
+            self._condition.notify_all()
+            return {"message_id": self._message_id, "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers & body are written separately, don't let Nagle's algorithm hold back the body
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_GET(self):
+                # File downloads, /file/bot{token}/files/{file_id}
+                with api._condition:
+                    content = api._files.get(self.path.rsplit("/", 1)[-1])
+                    api.bytes_downloaded += len(content or b"")
+                self.send_response(200 if content is not None else 404)
+                self.send_header("Content-Length", str(len(content or b"")))
+                self.end_headers()
+                try:
+                    self.wfile.write(content or b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with api._condition:
+                    api.bytes_received += len(body)
+                data = json.loads(body) if body else {}
+                result = api._call(self.path.rsplit("/", 1)[-1], data)
+                response = json.dumps(result).encode("utf-8")
+
+                # Errors are answered with their error code as HTTP status, like the real API does
+                self.send_response(200 if result["ok"] else result["error_code"])
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                try:
+                    self.wfile.write(response)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The bot went away mid-call, e.g. a shard killed by the cluster demo
+                    self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
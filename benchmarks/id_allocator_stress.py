@@ -0,0 +1,113 @@
+"""
+    Stress test of the fault id allocator, concurrent confirms must never share a fault id
+
+    Every worker opens the same temporary fault store, like the shards of run.py do, and has many threads each allocating
+    ids with a FaultIdAllocator and saving a fault under every id, like send_details_to_maintenance_clerks does. The
+    main process runs its threads with a block size of 1, the worker processes with fault_id_block_size above 1.
+
+    Checks that every id was handed out once, that no fault failed to be saved (e.g. IntegrityError on a duplicate id)
+    and that every fault is in the store. Exits with status 1 otherwise.
+
+    Usage:
+    python benchmarks/id_allocator_stress.py --processes 4 --threads 16 --faults 50 --block-size 10
+"""
+
+# Import statements
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fault_store import SQLiteFaultStore
+from id_allocator import FaultIdAllocator
+
+
+def confirm_faults(filename, block_size, threads, faults):
+    """
+    Allocates ids & saves faults from several threads sharing one store & allocator
+
+    :return: type: tuple
+    (List of the ids allocated, list of the errors raised)
+    """
+    store = SQLiteFaultStore(filename)
+    allocator = FaultIdAllocator(store, block_size=block_size)
+    barrier = threading.Barrier(threads)
+    ids = []
+    errors = []
+
+    def confirm():
+        barrier.wait()
+        for _ in range(faults):
+            try:
+                fault_id = allocator.next_id()
+                store.add_fault(fault_id, "Leaking tap", "Water is leaking from the tap", "Block 1", 1, "Reporter", None, None, time.time())
+                ids.append(fault_id)
+            except Exception as error:
+                errors.append(repr(error))
+
+    workers = [threading.Thread(target=confirm) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    store.close()
+    return ids, errors
+
+
+def confirm_faults_in_process(filename, block_size, threads, faults, results):
+    results.put(confirm_faults(filename, block_size, threads, faults))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test of the fault id allocator")
+    parser.add_argument("--processes", type=int, default=4, help="Worker processes sharing the fault store")
+    parser.add_argument("--threads", type=int, default=16, help="Threads confirming faults in every process")
+    parser.add_argument("--faults", type=int, default=50, help="Faults confirmed by every thread")
+    parser.add_argument("--block-size", type=int, default=10, help="fault_id_block_size of the worker processes")
+    args = parser.parse_args()
+
+    filename = os.path.join(tempfile.mkdtemp(prefix="id_allocator_stress_"), "faults.db")
+    # Created once up front, so the processes do not race to create the schema
+    SQLiteFaultStore(filename).close()
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=confirm_faults_in_process, args=(filename, args.block_size, args.threads, args.faults, results))
+                 for _ in range(args.processes)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    ids, errors = confirm_faults(filename, 1, args.threads, args.faults)
+    for _ in processes:
+        process_ids, process_errors = results.get()
+        ids.extend(process_ids)
+        errors.extend(process_errors)
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    store = SQLiteFaultStore(filename)
+    saved = store.execute("SELECT COUNT(*) FROM faults")[0][0]
+    store.close()
+
+    expected = (args.processes + 1) * args.threads * args.faults
+    duplicates = len(ids) - len(set(ids))
+    print(f"{args.processes} processes (block size {args.block_size}) & the main process (block size 1), "
+          f"{args.threads} threads each, {args.faults} faults per thread")
+    print(f"ids allocated {len(ids):>8} of {expected} in {elapsed:.2f}s")
+    print(f"duplicate ids {duplicates:>8}")
+    print(f"errors        {len(errors):>8}   {errors[:3] if errors else ''}")
+    print(f"faults saved  {saved:>8}")
+
+    if duplicates or errors or len(ids) != expected or saved != expected:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+    Benchmark of the input validation of the fault fields
+
+    Compares the stacked regex filters used by earlier versions of the bot against the InputLength filters, routing a
+    message the way the conversation does: the state handler first, then the too short & too long handlers.
+    Messages range from a few characters up to Telegram's max message length, and well beyond it.
+
+    Usage:
+    python benchmarks/input_validation_benchmark.py
+"""
+
+# Import statements
+import os
+import sys
+import time
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telegram
+from telegram.ext import Filters
+from input_validation import InputLimits, InputLength, TOO_SHORT, TOO_LONG
+
+
+def make_update(text):
+    chat = telegram.Chat(1, "private")
+    return telegram.Update(1, message=telegram.Message(1, datetime.datetime.now(), chat, text=text))
+
+
+def legacy_route(update, state_filter, short_filter, long_filter):
+    if state_filter(update):
+        return "valid"
+    if short_filter(update):
+        return "too_short"
+    if long_filter(update):
+        return "too_long"
+    return None
+
+
+def main():
+    legacy_state = Filters.text & ~Filters.command & ~Filters.regex(r'^.{1,4}$') & ~Filters.regex(r'^.{500,}$')
+    legacy_short = Filters.regex(r'^.{1,4}$')
+    legacy_long = Filters.regex(r'^.{500,}$')
+
+    limits = InputLimits()
+    state = Filters.text & ~Filters.command & InputLength(limits)
+    short = InputLength(limits, TOO_SHORT)
+    long = InputLength(limits, TOO_LONG)
+
+    print(f"{'length':>8}{'legacy':>12}{'InputLength':>14}{'speedup':>10}")
+    for length in (3, 100, 499, 500, 4096, 65536, 1048576):
+        update = make_update("x" * length)
+        calls = max(10, 200000 // max(1, length // 50))
+
+        start = time.perf_counter()
+        for _ in range(calls):
+            legacy = legacy_route(update, legacy_state, legacy_short, legacy_long)
+        legacy_time = (time.perf_counter() - start) / calls
+
+        start = time.perf_counter()
+        for _ in range(calls):
+            new = legacy_route(update, state, short, long)
+        new_time = (time.perf_counter() - start) / calls
+
+        assert legacy == new, (length, legacy, new)
+        print(f"{length:>8}{legacy_time * 1e6:>10.2f}us{new_time * 1e6:>12.2f}us{legacy_time / new_time:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+    Load test of the bot against a local stand-in for the Telegram Bot API
+
+    Runs the bot in-process against benchmarks/fake_bot_api.py, with a fresh fault store & persistence journal in a temporary
+    directory, and simulates concurrent users:
+        1. Reporters - /start -> type -> description -> location -> yes, repeated for every fault they submit
+        2. Clerks (the recipient list) - /history -> active & /resolved {fault_id}, until the reporters are done
+
+    Reports throughput, p50/p95/p99 latency from an update being handed to the bot until its first reply, per step,
+    along with the time taken by fan-outs, persistence journal flushes and fault store writes.
+
+    Usage:
+    python benchmarks/load_test.py --users 50 --clerks 3 --faults 5 --latency 0.02 --error-rate 0.01
+"""
+
+# Import statements
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+
+# Kinds of messages sent by the bot
+REPLY = "reply"
+NOTIFICATION = "notification"
+
+# Steps of submitting a fault, with the number of replies the bot sends for each
+REPORTER_STEPS = [
+    ("/start", lambda number: "/start", 1),
+    ("type", lambda number: f"Aircon leaking {number}", 1),
+    ("description", lambda number: f"Water is dripping from the aircon onto the floor, report number {number}", 1),
+    ("location", lambda number: f"Blk {number % 500 + 1}, level {number % 12 + 1}, room {number % 40 + 1}", 2),
+    ("confirm", lambda number: "Yes", 2),
+]
+
+
+class Timings:
+    """
+    Thread-safe collection of durations, grouped by name
+    """
+    def __init__(self):
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, duration):
+        with self._lock:
+            self._durations.setdefault(name, []).append(duration)
+
+    def wrap(self, name, function):
+        """
+        Returns the function timed under the given name
+        """
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        return timed
+
+    def items(self):
+        with self._lock:
+            return sorted((name, sorted(durations)) for name, durations in self._durations.items())
+
+
+def percentile(durations, share):
+    """
+    Returns a percentile of sorted durations
+    """
+    return durations[min(len(durations) - 1, int(len(durations) * share))]
+
+
+def classify_messages():
+    """
+    Returns a classify callback for FakeBotAPI telling fan-out notifications apart from replies
+
+    A fault's details are sent right after "New fault has been submitted!" by the fan-out, every such notice pairs
+    with the next fault message sent to the chat
+    """
+    pending_details = {}
+
+    def classify(message):
+        if message.text == "New fault has been submitted!":
+            pending_details[message.chat_id] = pending_details.get(message.chat_id, 0) + 1
+            return NOTIFICATION
+        if message.text.endswith("has been marked as resolved"):
+            return NOTIFICATION
+        if message.text.startswith("*Fault ID:*") and pending_details.get(message.chat_id):
+            pending_details[message.chat_id] -= 1
+            return NOTIFICATION
+        return REPLY
+
+    return classify
+
+
+class SimulatedUser:
+    """
+    A user chatting with the bot, sending a message and waiting for the replies before sending the next one
+    """
+    def __init__(self, api, user_id, timings, timeout):
+        self.api = api
+        self.user_id = user_id
+        self.timings = timings
+        self.timeout = timeout
+        self.errors = 0
+        self._next_message = 0
+
+    def send(self, step, text, replies, predicate=None):
+        """
+        Sends a message and waits for the replies of the bot
+
+        :return: type: list
+        Replies received, fewer than expected on timeout
+        """
+        self._next_message = max(self._next_message, self.api.message_count(self.user_id))
+        update_id = self.api.push_message(self.user_id, f"User {self.user_id}", text)
+        messages, self._next_message = self.api.wait_messages(self.user_id, self._next_message, replies, self.timeout,
+                                                              predicate or (lambda message: message.kind == REPLY))
+        delivered_at = self.api.delivered_at(update_id, timeout=0)
+
+        if len(messages) < replies or delivered_at is None:
+            self.errors += 1
+            self.timings.add("timeouts", 0)
+        else:
+            self.timings.add(f"step {step}", messages[0].sent_at - delivered_at)
+            self.timings.add("step (all)", messages[0].sent_at - delivered_at)
+        return messages
+
+
+def run_reporter(user, faults, submitted):
+    for _ in range(faults):
+        number = random.randint(1, 10 ** 6)
+        for step, text, replies in REPORTER_STEPS:
+            user.send(step, text(number), replies)
+        submitted.append(1)
+
+
+def run_clerk(user, submitted, done):
+    while not done.is_set():
+        user.send("/history", "/history", 1)
+        user.send("history active", "Active", 1)
+
+        if submitted:
+            fault_id = random.randint(1, len(submitted))
+            resolved_notice = f"Fault id: {fault_id} has been marked as resolved"
+            user.send("/resolved", f"/resolved {fault_id}", 1,
+                      predicate=lambda message: message.kind == REPLY or message.text == resolved_notice)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the bot against a local stand-in for the Telegram Bot API")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent users submitting faults")
+    parser.add_argument("--clerks", type=int, default=2, help="Concurrent recipients browsing & resolving faults")
+    parser.add_argument("--faults", type=int, default=5, help="Faults submitted by every user")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every Bot API call is delayed by")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of sendMessage calls answered with flood control")
+    parser.add_argument("--workers", type=int, default=4, help="update_workers of the bot")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds a user waits for a reply")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the simulated traffic")
+    args = parser.parse_args()
+    if args.clerks < 1:
+        parser.error("at least 1 clerk is needed, the recipient list cannot be empty")
+
+    random.seed(args.seed)
+    api = FakeBotAPI(latency=args.latency, error_rate=args.error_rate, seed=args.seed, classify=classify_messages())
+    api.start()
+
+    # The bot keeps its files in the working directory
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    os.chdir(workdir)
+    clerk_ids = [1000 + index for index in range(args.clerks)]
+    os.environ.update({
+        "bot_token": "123456:LOADTESTLOADTESTLOADTESTLOADTESTLOA",
+        "recipient_list": ",".join(str(clerk_id) for clerk_id in clerk_ids),
+        "bot_api_url": api.base_url,
+        "fault_db": os.path.join(workdir, "faults.db"),
+        "update_workers": str(args.workers),
+        "log_level": os.getenv("log_level", "WARNING"),
+    })
+
+    import run
+    run.create_app()
+
+    timings = Timings()
+    run.fan_out.send = timings.wrap("fan-out", run.fan_out.send)
+    run.persistence.write_batch = timings.wrap("persistence flush", run.persistence.write_batch)
+    run.fault_store.add_fault = timings.wrap("fault store write", run.fault_store.add_fault)
+    run.fault_store.resolve_faults = timings.wrap("fault store write", run.fault_store.resolve_faults)
+
+    run.add_handlers()
+    run.outbox.start()
+    run.updater.start_polling(poll_interval=0, timeout=10)
+
+    submitted = []
+    done = threading.Event()
+    reporters = [SimulatedUser(api, 1 + index, timings, args.timeout) for index in range(args.users)]
+    clerks = [SimulatedUser(api, clerk_id, timings, args.timeout) for clerk_id in clerk_ids]
+    reporter_threads = [threading.Thread(target=run_reporter, args=(user, args.faults, submitted)) for user in reporters]
+    clerk_threads = [threading.Thread(target=run_clerk, args=(user, submitted, done)) for user in clerks]
+
+    start = time.perf_counter()
+    for thread in reporter_threads + clerk_threads:
+        thread.start()
+    for thread in reporter_threads:
+        thread.join()
+    done.set()
+    for thread in clerk_threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    run.updater.stop()
+    run.outbox.stop()
+    run.fan_out.shutdown()
+    run.recipient_directory.shutdown()
+    run.persistence.close()
+    run.fault_store.close()
+    api.stop()
+
+    updates = sum(len(durations) for name, durations in timings.items() if name.startswith("step ") and name != "step (all)")
+    print(f"Users: {args.users}, clerks: {args.clerks}, faults per user: {args.faults}, "
+          f"API latency: {args.latency * 1000:.0f}ms, error rate: {args.error_rate:.1%}, workers: {args.workers}")
+    print(f"Elapsed: {elapsed:.2f}s, faults submitted: {len(submitted)} ({len(submitted) / elapsed:.1f}/s), "
+          f"updates handled: {updates} ({updates / elapsed:.1f}/s)")
+    print(f"Timeouts: {sum(user.errors for user in reporters + clerks)}, injected errors: {api.injected_errors}, API calls: {api.calls}")
+    print(f"{'':<24}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, durations in timings.items():
+        if name == "timeouts":
+            continue
+        print(f"{name:<24}{len(durations):>7}" + "".join(f"{value * 1000:>8.1f}ms" for value in (
+            percentile(durations, 0.5), percentile(durations, 0.95), percentile(durations, 0.99), durations[-1])))
+
+
+if __name__ == '__main__':
+    main()
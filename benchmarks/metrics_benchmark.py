@@ -0,0 +1,108 @@
+"""
+    Benchmark of the metrics overhead
+
+    Measures the time added to every handler call & Bot API call by the instrumentation, single threaded and with the
+    update workers contending for the same series, along with the time taken to render /metrics.
+
+    Usage:
+    python benchmarks/metrics_benchmark.py
+"""
+
+# Import statements
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import BotMetrics
+
+
+def handler(update, context):
+    return None
+
+
+def conversation_handler(update, context):
+    return 6
+
+
+def per_call(function, calls):
+    """
+    Returns the mean time of a call to function in seconds
+    """
+    start = time.perf_counter()
+    for _ in range(calls):
+        function(None, None)
+    return (time.perf_counter() - start) / calls
+
+
+def per_call_threaded(function, calls, threads):
+    """
+    Returns the mean wall time per call of function, called from several threads at once
+    """
+    barrier = threading.Barrier(threads + 1)
+
+    def work():
+        barrier.wait()
+        for _ in range(calls):
+            function(None, None)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (calls * threads)
+
+
+class FakeRequest:
+    """
+    Stand-in for telegram.utils.request.Request, answering every call at once
+    """
+    def post(self, url, data, timeout=None):
+        return True
+
+
+class FakeBot:
+    def __init__(self):
+        self.request = FakeRequest()
+
+
+def main():
+    calls = 200000
+    metrics = BotMetrics()
+
+    bare = per_call(handler, calls)
+    timed = per_call(metrics.wrap_callback(handler, "handler"), calls)
+    conversation = per_call(metrics.wrap_callback(conversation_handler, "conversation_handler", state="5"), calls)
+    print(f"Handler call, bare: {bare * 1e6:.2f}us, instrumented: {timed * 1e6:.2f}us (+{(timed - bare) * 1e6:.2f}us), "
+          f"instrumented in a conversation: {conversation * 1e6:.2f}us (+{(conversation - bare) * 1e6:.2f}us)")
+
+    for threads in (4, 8):
+        bare = per_call_threaded(handler, calls // threads, threads)
+        timed = per_call_threaded(metrics.wrap_callback(handler, "handler"), calls // threads, threads)
+        print(f"Handler call, {threads} threads, bare: {bare * 1e6:.2f}us, instrumented: {timed * 1e6:.2f}us "
+              f"(+{(timed - bare) * 1e6:.2f}us)")
+
+    bot = FakeBot()
+    bare = per_call(lambda update, context: bot.request.post("http://127.0.0.1/bot123:abc/sendMessage", {}), calls)
+    metrics.instrument_bot(bot)
+    timed = per_call(lambda update, context: bot.request.post("http://127.0.0.1/bot123:abc/sendMessage", {}), calls)
+    print(f"Bot API call, bare: {bare * 1e6:.2f}us, instrumented: {timed * 1e6:.2f}us (+{(timed - bare) * 1e6:.2f}us)")
+
+    # A bot with 20 handlers & 30 Bot API methods in use
+    for index in range(20):
+        metrics.handler_latency.labels(handler=f"handler_{index}").observe(0.01)
+    for index in range(30):
+        metrics.api_latency.labels(method=f"method_{index}").observe(0.01)
+    start = time.perf_counter()
+    for _ in range(100):
+        body = metrics.registry.render()
+    print(f"Render /metrics: {(time.perf_counter() - start) / 100 * 1000:.2f}ms, {len(body)} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+    Benchmark of the /history pagination
+
+    Compares the PaginationHandlerMeta decorator used by earlier versions of the bot against the pagination engine,
+    on fault histories of 1k, 10k & 100k faults of a realistic rendered length.
+
+    Usage:
+    python benchmarks/pagination_benchmark.py
+"""
+
+# Import statements
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pagination import Paginator, SEPARATOR
+
+
+def legacy_paginate(response, send):
+    """
+    Pagination of the PaginationHandlerMeta decorator, with update.message.reply_text replaced by send
+    """
+    separator = SEPARATOR
+    if len(f"{separator}".join(part for part in response.values())) > 4096:
+        keys = list(response.keys())
+        start_index = 0
+        for end_index, _ in enumerate(keys, start=1):
+            if len(f"{separator}".join(response[key] for key in keys[start_index:end_index])) > 4096:
+                send(f"{separator}".join(response[key] for key in keys[start_index:end_index - 1]))
+                if end_index == len(response):
+                    send(response[keys[end_index - 1]])
+                else:
+                    start_index = end_index - 1
+            elif end_index == len(response):
+                send(f"{separator}".join(response[key] for key in keys[start_index:end_index]))
+    else:
+        send(f"{separator}".join(part for part in response.values()))
+
+
+def make_history(size):
+    """
+    Returns a fault history of the given size, rendered faults keyed by fault id
+    """
+    random.seed(size)
+    return {fault_id: "x" * random.randint(180, 600) for fault_id in range(1, size + 1)}
+
+
+def main():
+    for size in (1000, 10000, 100000):
+        history = make_history(size)
+
+        pages = []
+        start = time.perf_counter()
+        legacy_paginate(history, pages.append)
+        legacy = time.perf_counter() - start
+
+        paginator = Paginator()
+        start = time.perf_counter()
+        view = paginator.get_view("resolved", 1, lambda: history.items())
+        first_page = paginator.render_page(view, 0, lambda keys: [history[key] for key in keys])
+        engine = time.perf_counter() - start
+
+        # Boundaries are cached until the revision changes
+        start = time.perf_counter()
+        view = paginator.get_view("resolved", 1, lambda: history.items())
+        paginator.render_page(view, len(view) // 2, lambda keys: [history[key] for key in keys])
+        cached = time.perf_counter() - start
+
+        assert len(pages) == len(view) and pages[0] == first_page
+        print(f"{size:>6} faults, {len(view):>5} pages: decorator {legacy * 1000:9.1f}ms, "
+              f"engine first page {engine * 1000:7.1f}ms, cached page {cached * 1000:6.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+    Benchmark of the persistence of user_data
+
+    Compares PicklePersistence, used by earlier versions of the bot, against JournalPersistence on states of 1k, 10k &
+    100k users, every user holding the fields of a fault being reported. Measures the time taken by a single update of
+    one user's data, as the dispatcher makes after every update, including the write of the file.
+
+    JournalPersistence is measured writing every change right away (flush_interval=0), with an fsync per change, and
+    batched (flush_interval=1), where an update only queues its record for the background thread.
+    PicklePersistence never calls fsync.
+
+    Usage:
+    python benchmarks/persistence_benchmark.py
+"""
+
+# Import statements
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.ext import PicklePersistence
+from journal_persistence import JournalPersistence
+
+
+def user_data(user_id, revision=0):
+    return {"type_of_fault": f"Leaking tap {revision}", "description_of_fault": "Water is leaking from the tap " * 4,
+            "location_of_fault": f"Block {user_id % 40}, level {user_id % 5}"}
+
+
+def make_state(filename, size):
+    """
+    Saves a state of the given number of users with PicklePersistence, JournalPersistence imports it on its first start
+    """
+    persistence = PicklePersistence(filename=filename)
+    persistence.get_user_data()
+    for user_id in range(size):
+        persistence.user_data[user_id] = user_data(user_id)
+    persistence.dump_singlefile()
+
+
+def measure(persistence, size, updates):
+    """
+    Returns the average seconds taken by an update of a single user's data
+    """
+    persistence.get_user_data()
+    start = time.perf_counter()
+    for revision in range(1, updates + 1):
+        persistence.update_user_data(revision % size, user_data(revision % size, revision))
+    return (time.perf_counter() - start) / updates
+
+
+def main():
+    print(f"{'users':>8}{'pickle':>12}{'journal':>12}{'batched':>12}{'speedup':>10}")
+    for size in (1000, 10000, 100000):
+        workdir = tempfile.mkdtemp(prefix="persistence_benchmark_")
+        updates = max(5, 200000 // size)
+
+        for name in ("pickle", "journal", "batched"):
+            make_state(os.path.join(workdir, name), size)
+
+        pickle_time = measure(PicklePersistence(filename=os.path.join(workdir, "pickle")), size, updates)
+        journal = JournalPersistence(filename=os.path.join(workdir, "journal"), flush_interval=0)
+        journal_time = measure(journal, size, updates)
+        journal.close()
+        batched = JournalPersistence(filename=os.path.join(workdir, "batched"), flush_interval=1)
+        batched_time = measure(batched, size, updates)
+        batched.close()
+
+        print(f"{size:>8}{pickle_time * 1000:>10.3f}ms{journal_time * 1000:>10.3f}ms{batched_time * 1000:>10.3f}ms"
+              f"{pickle_time / journal_time:>9.1f}x")
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
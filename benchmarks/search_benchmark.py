@@ -0,0 +1,108 @@
+"""
+    Benchmark of /search on a large fault history
+
+    Fills a temporary fault store with generated faults, where most faults match a common search term, then measures
+    for searches with & without filters:
+        1. ranked all - Ranking every match & keeping the best, as done by earlier versions
+        2. search - search_faults, ranking only the most recent matches
+        3. results - search_faults & reading the faults found, everything /search does before rendering the first page
+
+    Usage:
+    python benchmarks/search_benchmark.py --faults 100000 --limit 200
+"""
+
+# Import statements
+import os
+import sys
+import time
+import argparse
+import tempfile
+import itertools
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from export_benchmark import make_faults
+from fault_store import SQLiteFaultStore, SEARCH_TERM_PATTERN, ACTIVE, RESOLVED
+
+# Searches made, as (terms, status, since, until)
+SEARCHES = [
+    ("tap", None, None, None),
+    ("leaking tap", None, None, None),
+    ("ceiling fan crack", None, None, None),
+    ("door lift", ACTIVE, None, None),
+    ("light", RESOLVED, 1609459200.0 + 86400 * 30, 1609459200.0 + 86400 * 300),
+    ("block 12", None, None, None),
+    ("l", None, None, None),
+]
+
+
+def rank_all(store, terms, status, since, until, limit):
+    """
+    Search of earlier versions, every match is ranked
+    """
+    query = " ".join(f'"{term}"*' for term in SEARCH_TERM_PATTERN.findall(terms))
+    sql = "SELECT faults.id FROM faults_fts JOIN faults ON faults.id = faults_fts.rowid WHERE faults_fts MATCH ?"
+    parameters = [query]
+    if status is not None:
+        sql += " AND faults.status = ?"
+        parameters.append(status)
+    if since is not None:
+        sql += " AND faults.created_at >= ?"
+        parameters.append(since)
+    if until is not None:
+        sql += " AND faults.created_at < ?"
+        parameters.append(until)
+    sql += " ORDER BY faults_fts.rank LIMIT ?"
+    parameters.append(limit)
+    return [row[0] for row in store.execute(sql, parameters)]
+
+
+def measure(function, repeat):
+    """
+    Returns the result, median & max milliseconds of calling a function repeatedly
+    """
+    result = function()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(timings), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of /search on a large fault history")
+    parser.add_argument("--faults", type=int, default=100000, help="Number of faults in the fault store")
+    parser.add_argument("--limit", type=int, default=200, help="Max faults returned by a search")
+    parser.add_argument("--repeat", type=int, default=10, help="Times every search is measured")
+    args = parser.parse_args()
+
+    store = SQLiteFaultStore(os.path.join(tempfile.mkdtemp(prefix="search_benchmark_"), "faults.db"))
+    faults = make_faults(args.faults)
+    while True:
+        batch = list(itertools.islice(faults, 10000))
+        if not batch:
+            break
+        store.add_faults(batch)
+    print(f"Faults: {store.count_faults()}, limit: {args.limit}, median & max of {args.repeat} runs")
+
+    print(f"{'search':<30}{'matches':>9}{'ranked all':>18}{'search':>18}{'results':>18}")
+    for terms, status, since, until in SEARCHES:
+        label = terms + (f" status:{status}" if status else "") + (" from/to" if since else "")
+        query = " ".join(f'"{term}"*' for term in SEARCH_TERM_PATTERN.findall(terms))
+        matches = store.execute("SELECT COUNT(*) FROM faults_fts WHERE faults_fts MATCH ?", (query,))[0][0]
+
+        _, all_median, all_max = measure(lambda: rank_all(store, terms, status, since, until, args.limit), args.repeat)
+        _, search_median, search_max = measure(lambda: store.search_faults(terms, status=status, since=since, until=until, limit=args.limit), args.repeat)
+        _, results_median, results_max = measure(
+            lambda: store.get_faults(store.search_faults(terms, status=status, since=since, until=until, limit=args.limit)), args.repeat)
+        print(f"{label:<30}{matches:>9}{all_median:>9.1f}/{all_max:>6.1f}ms{search_median:>9.1f}/{search_max:>6.1f}ms"
+              f"{results_median:>9.1f}/{results_max:>6.1f}ms")
+
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+    Benchmark of the cold start of the bot against a large persisted dataset
+
+    Fills a temporary working directory with a conversation data journal, a fault store & an archive, then starts run.py
+    against a local stand-in for the Telegram Bot API and measures, from the moment the process is started:
+        1. import - Time taken by a bare `import run`, in a process of its own
+        2. first reply - Time until a reporter who sent /start got their first reply
+        3. full history - Time until a recipient who asked for the resolved fault history got its first page, which
+           needs the archive index to be read & the pages of the resolved faults to be built
+
+    Usage:
+    python benchmarks/startup_benchmark.py --users 100000 --faults 20000 --archived 500000
+"""
+
+# Import statements
+import os
+import sys
+import time
+import shutil
+import signal
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+from export_benchmark import make_faults
+from fault_store import SQLiteFaultStore, RESOLVED
+from fault_archive import FaultArchive
+from fault_draft import FaultDraft, DRAFT_KEY
+from journal_persistence import JournalPersistence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Chat ids of the recipient & the reporter
+CLERK_ID = 1000
+REPORTER_ID = 1
+
+
+def make_dataset(workdir, users, faults, archived):
+    """
+    Saves the conversation data of the given number of reporters mid-conversation, and faults split between the fault
+    store & the archive, the oldest resolved ones being archived
+    """
+    persistence = JournalPersistence(filename=os.path.join(workdir, "data"), flush_interval=3600)
+    for user_id in range(10000, 10000 + users):
+        persistence.update_user_data(user_id, {DRAFT_KEY: FaultDraft("Leaking tap", "Water is leaking from the tap " * 4, f"Block {user_id % 40}")})
+    persistence.close()
+
+    hot = SQLiteFaultStore(os.path.join(workdir, "faults.db"))
+    archive = FaultArchive(os.path.join(workdir, "archive"))
+    hot_batch, archive_batch = [], []
+    for fault in make_faults(archived + faults):
+        if fault.id <= archived and fault.status == RESOLVED:
+            archive_batch.append(fault)
+        else:
+            hot_batch.append(fault)
+        if len(archive_batch) >= 10000:
+            archive.append(archive_batch)
+            archive_batch = []
+        if len(hot_batch) >= 10000:
+            hot.add_faults(hot_batch)
+            hot_batch = []
+    archive.append(archive_batch)
+    hot.add_faults(hot_batch)
+    print(f"Dataset: {users} users, {hot.count_faults()} faults in the fault store, {len(archive)} archived")
+    hot.close()
+    archive.close()
+
+
+def measure_import(workdir, environment):
+    """
+    Returns the seconds taken by `import run` in a new process
+    """
+    code = "import time; start = time.perf_counter(); import run; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=dict(environment, PYTHONPATH=os.pathsep.join([ROOT, environment.get("PYTHONPATH", "")])),
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    return float(output.stdout.decode().strip().splitlines()[-1])
+
+
+def measure_start(workdir, environment, api, timeout):
+    """
+    Starts the bot, asks for a reply & the resolved fault history right away, then stops the bot
+
+    :return: type: tuple
+    Seconds from the start of the process until (the first reply, the first page of the resolved fault history)
+    """
+    reporter_start = api.message_count(REPORTER_ID)
+    clerk_start = api.message_count(CLERK_ID)
+
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "run.py")], cwd=workdir, env=environment,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        api.push_message(REPORTER_ID, "Reporter", "/start")
+        api.push_message(CLERK_ID, "Clerk", "/history")
+
+        replies, _ = api.wait_messages(REPORTER_ID, reporter_start, 1, timeout=timeout)
+        first_reply = replies[0].sent_at - start if replies else None
+
+        prompts, clerk_index = api.wait_messages(CLERK_ID, clerk_start, 1, timeout=timeout)
+        history = None
+        if prompts:
+            api.push_message(CLERK_ID, "Clerk", "Resolved")
+            pages, _ = api.wait_messages(CLERK_ID, clerk_index, 1, timeout=timeout)
+            history = pages[0].sent_at - start if pages else None
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    return first_reply, history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the cold start of the bot")
+    parser.add_argument("--users", type=int, default=100000, help="Reporters with conversation data in the journal")
+    parser.add_argument("--faults", type=int, default=20000, help="Faults in the fault store")
+    parser.add_argument("--archived", type=int, default=500000, help="Faults generated for the archive, the resolved ones are archived")
+    parser.add_argument("--runs", type=int, default=3, help="Number of starts measured")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Max seconds to wait for a reply")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="startup_benchmark_")
+    make_dataset(workdir, args.users, args.faults, args.archived)
+
+    api = FakeBotAPI()
+    api.start()
+    environment = dict(os.environ, bot_token="123456:STARTUPBENCHMARKSTARTUPBENCHMARKSTA", recipient_list=str(CLERK_ID),
+                       bot_api_url=api.base_url, log_level="INFO")
+
+    results = {"import": [], "first reply": [], "full history": []}
+    try:
+        for _ in range(args.runs):
+            results["import"].append(measure_import(workdir, environment))
+            first_reply, history = measure_start(workdir, environment, api, args.timeout)
+            if first_reply is not None:
+                results["first reply"].append(first_reply)
+            if history is not None:
+                results["full history"].append(history)
+    finally:
+        api.stop()
+        shutil.rmtree(workdir)
+
+    print(f"{'':<14}{'runs':>6}{'median':>10}{'min':>10}")
+    for name, timings in results.items():
+        if timings:
+            print(f"{name:<14}{len(timings):>6}{statistics.median(timings):>9.3f}s{min(timings):>9.3f}s")
+        else:
+            print(f"{name:<14}{0:>6}{'timeout':>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+    Replays recorded updates against a running webhook server
+
+    Every line of the input file is a single Update as JSON, as Telegram posts it to the webhook (see getUpdates output).
+    Updates are posted over a single keep-alive connection, the same way Telegram delivers them, and the time taken
+    for the server to accept every update is reported.
+
+    End-to-end latency (message sent -> handlers done) is logged by the bot for every message in both polling and
+    webhook mode ("Update handled in ..."), compare record.log of both modes for the full picture.
+
+    Usage:
+    python benchmarks/webhook_replay.py updates.jsonl --url http://127.0.0.1:8443/ --secret-token {webhook_secret}
+"""
+
+# Import statements
+import time
+import argparse
+import http.client
+import urllib.parse
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays recorded updates against a running webhook server")
+    parser.add_argument("updates", help="File with one Update as JSON per line")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/", help="URL of the webhook server")
+    parser.add_argument("--secret-token", required=True, help="Secret token of the webhook server")
+    parser.add_argument("--repeat", type=int, default=1, help="Times to replay the updates")
+    args = parser.parse_args()
+
+    with open(args.updates, encoding="utf-8") as file:
+        updates = [line.strip().encode("utf-8") for line in file if line.strip()]
+
+    url = urllib.parse.urlsplit(args.url)
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80)
+    headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": args.secret_token}
+
+    latencies = []
+    statuses = {}
+    for _ in range(args.repeat):
+        for body in updates:
+            start = time.perf_counter()
+            connection.request("POST", url.path or "/", body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+    connection.close()
+
+    if not latencies:
+        print("No updates replayed")
+        return
+
+    latencies.sort()
+    print(f"Posted {len(latencies)} updates, statuses: {statuses}")
+    print(f"Accept latency: p50 {latencies[len(latencies) // 2] * 1000:.2f}ms, "
+          f"p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.2f}ms, "
+          f"max {latencies[-1] * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""
+    Sharded runtime for running the bot as several processes on one machine, sharing the SQLite fault store
+
+    Every process is a shard owning the chats whose chat id maps to it (chat_id % shard_count), so a conversation is
+    always handled by the same process and its state stays in that process' persistence file.
+
+    One process at a time holds the leader lease, a row in the shared store renewed every lease_ttl / 3 seconds.
+    The leader:
+        1. Ingests updates - Long polls Telegram and writes every update into the shared inbox, tagged with its shard
+        2. Delivers notifications - Only the leader drains the outbox (see outbox.py), so recipients are not notified by every shard
+
+    Every shard, the leader included, moves the updates of its shard from the inbox into its dispatcher.
+    When the leader dies, another shard takes over once the lease expires and continues from the saved update offset.
+
+    Writes of the leader are fenced: they only commit while the lease is still held by the process.
+    Updates are removed from the inbox before they are handled, a process dying in between drops them rather than
+    handling them twice.
+"""
+
+# Import statements
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import telegram
+
+# Tables of the sharded runtime, created in the fault store
+CLUSTER_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS update_inbox (update_id INTEGER PRIMARY KEY, shard INTEGER NOT NULL, payload TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_update_inbox_shard ON update_inbox (shard, update_id)",
+)
+
+# Name of the leader lease
+LEADER_LEASE = "leader"
+
+
+def shard_of(update, shard_count):
+    """
+    Returns the shard owning an update, by the chat it belongs to
+
+    :param update: type: telegram.Update
+    The update
+
+    :param shard_count: type: int
+    Number of shards
+
+    :return: type: int
+    Index of the shard, updates without a chat or user go to shard 0
+    """
+    if update.effective_chat is not None:
+        return update.effective_chat.id % shard_count
+    if update.effective_user is not None:
+        return update.effective_user.id % shard_count
+    return 0
+
+
+class Lease:
+    """
+    A named lease in the fault store, held by at most one process until it expires
+    """
+    def __init__(self, store, name, holder, ttl):
+        """
+        :param store: type: fault_store.SQLiteFaultStore
+        Store shared by the processes
+
+        :param name: type: str
+        Name of the lease
+
+        :param holder: type: str
+        Identity of this process
+
+        :param ttl: type: float
+        Seconds the lease is held for after it was acquired or renewed
+        """
+        self.store = store
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        # Time until which this process holds the lease, None if it does not
+        self.expires_at = None
+
+    @property
+    def held(self):
+        return self.expires_at is not None and time.time() < self.expires_at
+
+    def acquire(self):
+        """
+        Acquires the lease if it is free or expired, renews it if this process already holds it
+
+        :return: type: bool
+        True if this process holds the lease
+        """
+        now = time.time()
+        with self.store.transaction() as connection:
+            row = connection.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (self.name,)).fetchone()
+            if row is not None and row[0] != self.holder and row[1] > now:
+                self.expires_at = None
+                return False
+            connection.execute("INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)", (self.name, self.holder, now + self.ttl))
+        self.expires_at = now + self.ttl
+        return True
+
+    def check(self, connection):
+        """
+        Returns True if this process still holds the lease, to be called inside the transaction it fences
+        """
+        return connection.execute("SELECT 1 FROM leases WHERE name = ? AND holder = ? AND expires_at > ?",
+                                  (self.name, self.holder, time.time())).fetchone() is not None
+
+    def release(self):
+        with self.store.transaction() as connection:
+            connection.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+        self.expires_at = None
+
+
+class ShardedRuntime:
+    """
+    Runs a single shard, taking over as leader whenever the lease is free
+    """
+    def __init__(self, store, bot, update_queue, shard, shard_count, lease_ttl=15.0, poll_interval=0.05, poll_timeout=None):
+        """
+        :param store: type: fault_store.SQLiteFaultStore
+        Store shared by the shards
+
+        :param bot: type: telegram.Bot
+        Bot of this process
+
+        :param update_queue: type: queue.Queue
+        Update queue of the dispatcher of this process
+
+        :param shard: type: int
+        Index of this shard
+
+        :param shard_count: type: int
+        Number of shards
+
+        :param lease_ttl: type: float
+        Seconds the leader lease is held for without being renewed
+
+        :param poll_interval: type: float
+        Seconds between checks of the inbox when there is nothing to do
+
+        :param poll_timeout: type: int or None
+        Timeout of the leader's long polls in seconds, must be well below lease_ttl (Defaults to a third of lease_ttl)
+        """
+        if not 0 <= shard < shard_count:
+            raise ValueError(f"Invalid shard {shard} of {shard_count}")
+
+        self.store = store
+        self.bot = bot
+        self.update_queue = update_queue
+        self.shard = shard
+        self.shard_count = shard_count
+        self.poll_interval = poll_interval
+        self.poll_timeout = poll_timeout if poll_timeout is not None else max(1, int(lease_ttl / 3))
+        self.lease = Lease(store, LEADER_LEASE, f"{socket.gethostname()}:{os.getpid()}:{shard}", lease_ttl)
+
+        with store.transaction() as connection:
+            for statement in CLUSTER_SCHEMA:
+                connection.execute(statement)
+
+        self._stopped = threading.Event()
+        self._leader = threading.Event()
+        self._threads = []
+
+    @property
+    def is_leader(self):
+        return self._leader.is_set() and self.lease.held
+
+    def start(self):
+        for target, name in [(self._run_lease, "lease"), (self._run_ingest, "ingest"), (self._run_consume, "consume")]:
+            thread = threading.Thread(target=target, name=f"shard{self.shard}_{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info("Info: Started shard %s of %s", self.shard, self.shard_count)
+
+    def stop(self):
+        """
+        Stops the shard, handing the lease over right away if this process holds it
+        """
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        if self._leader.is_set():
+            self._leader.clear()
+            self.lease.release()
+            logging.info("Info: Shard %s released the leader lease", self.shard)
+
+    def _run_lease(self):
+        while not self._stopped.is_set():
+            try:
+                acquired = self.lease.acquire()
+            except Exception as error:
+                logging.warning("Shard %s: Unable to renew the leader lease, Error: %s", self.shard, error)
+                acquired = self.lease.held
+
+            if acquired and not self._leader.is_set():
+                logging.info("Info: Shard %s is now the leader", self.shard)
+                self._leader.set()
+            elif not acquired and self._leader.is_set():
+                logging.warning("Shard %s lost the leader lease", self.shard)
+                self._leader.clear()
+
+            self._stopped.wait(self.lease.ttl / 3)
+
+    def _run_ingest(self):
+        webhook_deleted = False
+        while not self._stopped.is_set():
+            if not self.is_leader:
+                self._stopped.wait(self.poll_interval)
+                continue
+
+            try:
+                # Updates cannot be polled while a webhook is set
+                if not webhook_deleted:
+                    self.bot.delete_webhook()
+                    webhook_deleted = True
+
+                offset = int(self.store.get_meta("ingest_offset", "0"))
+                updates = self.bot.get_updates(offset=offset, timeout=self.poll_timeout)
+                if not updates:
+                    continue
+
+                with self.store.transaction() as connection:
+                    if not self.lease.check(connection):
+                        logging.warning("Shard %s: Dropped %s updates, the leader lease was lost", self.shard, len(updates))
+                        continue
+                    connection.executemany("INSERT OR IGNORE INTO update_inbox (update_id, shard, payload) VALUES (?, ?, ?)",
+                                           [(update.update_id, shard_of(update, self.shard_count), json.dumps(update.to_dict()))
+                                            for update in updates])
+                    connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('ingest_offset', ?)", (str(updates[-1].update_id + 1),))
+            except telegram.error.TelegramError as error:
+                logging.warning("Shard %s: Unable to get updates, Error: %s", self.shard, error)
+                self._stopped.wait(1)
+            except Exception:
+                logging.exception("Shard %s: Ingesting updates failed", self.shard)
+                self._stopped.wait(1)
+
+    def _run_consume(self):
+        while not self._stopped.is_set():
+            try:
+                # Only this shard removes its own updates, reading them first keeps idle shards off the write lock
+                rows = self.store.execute("SELECT update_id, payload FROM update_inbox WHERE shard = ? ORDER BY update_id LIMIT 100", (self.shard,))
+                if rows:
+                    self.store.execute("DELETE FROM update_inbox WHERE shard = ? AND update_id <= ?", (self.shard, rows[-1][0]))
+            except Exception:
+                logging.exception("Shard %s: Consuming updates failed", self.shard)
+                rows = []
+
+            if not rows:
+                self._stopped.wait(self.poll_interval)
+                continue
+            for row in rows:
+                self.update_queue.put(telegram.Update.de_json(json.loads(row[1]), self.bot))
+
+
+def start_sharded(updater, runtime):
+    """
+    Starts the job queue, the dispatcher & the shard runtime
+
+    Mirrors telegram.ext.Updater.start_polling so that updater.idle() & updater.stop() work the same as in polling mode
+
+    :param updater: type: telegram.ext.Updater
+    Updater of the bot
+
+    :param runtime: type: ShardedRuntime
+    Runtime feeding the dispatcher with the updates of this shard
+    """
+    updater.running = True
+    updater.job_queue.start()
+
+    dispatcher_ready = threading.Event()
+    threading.Thread(target=updater.dispatcher.start, args=(dispatcher_ready,), name="dispatcher", daemon=True).start()
+    dispatcher_ready.wait()
+
+    runtime.start()
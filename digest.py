@@ -0,0 +1,98 @@
+"""
+    Digest of the notifications sent to recipients during bursts of faults
+
+    Every notification is normally sent to every recipient as soon as it is saved, e.g. two messages per new fault. During
+    an incident dozens of faults arrive within minutes, which runs into Telegram's flood limits (~1 message per second
+    per chat) and buries the recipients in messages.
+
+    In digest mode, deliveries to the recipients holding digests are kept in the outbox for a window of seconds after
+    the first of them, then every delivery held for a recipient is sent at once, the text of the notifications packed
+    into as few messages of at most 4096 characters as possible. Photos & documents follow the text, as they cannot be
+    packed. Deliveries stay in the outbox until they are sent, so a restart does not lose the digests in progress.
+
+    Notifications about faults of urgent types (e.g. fire, gas leak) and escalations are never held.
+"""
+
+# Import statements
+from pagination import paginate, MAX_MESSAGE_LENGTH
+from routing import KeywordMatcher
+
+# Separator between the notifications of a digest message
+SEPARATOR = "\n\n"
+
+# Characters kept free for the header of every digest message
+HEADER_LENGTH = 64
+
+
+class DigestPolicy:
+    """
+    Which deliveries are held for a digest & how they are packed
+    """
+    def __init__(self, window, recipients=None, urgent_types=()):
+        """
+        :param window: type: float
+        Seconds deliveries are held for after the first of them
+
+        :param recipients: type: iterable or None
+        Chat ids of the recipients holding digests (Defaults to every recipient)
+
+        :param urgent_types: type: iterable
+        Keywords of the types of faults never held, matched like routing keywords, when they start a word of the type
+
+        :raises ValueError: if the window is not a positive number of seconds
+        """
+        if window <= 0:
+            raise ValueError(f"Invalid digest window: {window}, must be a positive number of seconds")
+        self.window = window
+        self.recipients = None if recipients is None else frozenset(str(chat_id) for chat_id in recipients)
+        self.urgent_types = tuple(keyword.strip() for keyword in urgent_types if keyword.strip())
+        self._urgent = KeywordMatcher({keyword: True for keyword in self.urgent_types})
+
+    def holds(self, chat_id):
+        """
+        Returns whether deliveries to a recipient are held for a digest
+        """
+        return self.recipients is None or str(chat_id) in self.recipients
+
+    def is_urgent(self, type_of_fault):
+        """
+        Returns whether notifications about a type of fault are sent right away
+        """
+        return any(self._urgent.match(type_of_fault or ""))
+
+    def pack(self, notifications):
+        """
+        Packs the notifications held for a recipient into digest messages
+
+        :param notifications: type: list
+        Messages of every notification, as keyword arguments for telegram.Bot.send_message, send_photo or send_document,
+        in the order they were saved
+
+        :return: type: list
+        Keyword arguments of the digest messages, text in MarkdownV2 first, then photos & documents
+        """
+        from telegram.utils.helpers import escape_markdown
+
+        # Nothing to coalesce
+        if len(notifications) == 1:
+            return list(notifications[0])
+
+        # Text of every notification in MarkdownV2, notifications too long to be packed are sent as they are
+        blocks = []
+        unpacked = []
+        files = []
+        for messages in notifications:
+            texts = [message["text"] if message.get("parse_mode") == "MarkdownV2" else escape_markdown(text=message["text"], version=2)
+                     for message in messages if "text" in message]
+            files.extend(message for message in messages if "text" not in message)
+            block = "\n".join(texts)
+            if len(block) > MAX_MESSAGE_LENGTH - HEADER_LENGTH:
+                unpacked.extend(message for message in messages if "text" in message)
+            elif block:
+                blocks.append(block)
+
+        bounds = paginate((len(block) for block in blocks), max_length=MAX_MESSAGE_LENGTH - HEADER_LENGTH, separator_length=len(SEPARATOR))
+        digest = [dict(text=f"*Digest of {len(notifications)} notifications, {page}/{len(bounds)}*{SEPARATOR}" +
+                            SEPARATOR.join(blocks[start:end]), parse_mode="MarkdownV2")
+                  for page, (start, end) in enumerate(bounds, start=1)]
+        return digest + unpacked + files
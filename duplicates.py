@@ -0,0 +1,374 @@
+"""
+    Near-duplicate detection of faults being reported
+
+    Several people often report the same broken light or leaking pipe. Every active fault is summarized by MinHash
+    signatures of two sets, the character shingles of its type & description, and the words & numbers of its location
+    (e.g. the block, level & room numbers). The share of signature values two faults have in common estimates the
+    Jaccard similarity of each set. Faults are likely duplicates when the similarity of their wording times the square of
+    the similarity of their locations is above a threshold, so that neither the same fault in the next room nor another
+    fault in the same room is.
+
+    Signatures are computed with one permutation hashing: every shingle is hashed once into one of the bins of the
+    signature, which keeps the smallest hash it was given. Bins left empty by short text take the value of another bin,
+    probed in a fixed random order per bin (optimal densification), which keeps the estimate of small sets such as
+    locations close. A signature costs O(shingles) rather than O(shingles * bins).
+
+    Signatures are split into bands, each of a few location values & a type & description value, indexed in hash tables
+    (locality-sensitive hashing). Faults agreeing on every value of any band are the candidates of a lookup, so a lookup
+    only compares the faults at a similar place with a similar wording rather than every active fault. Faults are added
+    as they are reported and removed as they are resolved. Faults saved by other processes are picked up by the lookups
+    following a commit of another process.
+
+    Shingles are hashed with the hash of str, which is randomized per process, signatures are never saved.
+"""
+
+# Import statements
+import re
+import time
+import array
+import random
+import logging
+import threading
+import functools
+from fault_store import ACTIVE
+
+# Characters in a shingle
+SHINGLE_SIZE = 3
+
+# Bands of the signatures, and the location & type & description values in every band, faults sharing a band are compared
+DEFAULT_BANDS = 16
+DEFAULT_LOCATION_ROWS = 3
+DEFAULT_TEXT_ROWS = 1
+
+# Min values of the type & description signature, more than the bands take so that its similarity is estimated closely
+TEXT_SIGNATURE_SIZE = 64
+
+# Min estimated similarity of a likely duplicate, see DuplicateIndex.similarity
+DEFAULT_THRESHOLD = 0.15
+
+# Max faults read from the fault store at a time while syncing
+SYNC_PAGE_SIZE = 1000
+
+# Tables of the duplicate index, created in the fault store
+DUPLICATE_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS duplicate_reports (id INTEGER PRIMARY KEY AUTOINCREMENT, fault_id INTEGER NOT NULL, "
+    "reporter_id INTEGER, reporter_first_name TEXT, reporter_last_name TEXT, reporter_username TEXT, "
+    "type TEXT NOT NULL, description TEXT NOT NULL, location TEXT NOT NULL, created_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_duplicate_reports_fault_id ON duplicate_reports (fault_id)",
+)
+
+# Splits text into words
+NON_WORD_PATTERN = re.compile(r'\W+')
+
+# Words naming parts of a location rather than telling locations apart
+LOCATION_STOP_WORDS = frozenset(["blk", "block", "lvl", "level", "floor", "storey", "rm", "room", "unit", "no", "the", "at",
+                                 "near", "next", "to", "of", "in", "on", "beside", "outside", "inside"])
+
+# Values of a bin
+MAX_VALUE = 0xFFFFFFFF
+
+
+def shingles(*fields):
+    """
+    Returns the character shingles of the fields of a fault, ignoring case & punctuation
+
+    :return: type: set
+    Strings of SHINGLE_SIZE characters
+    """
+    text = " ".join(NON_WORD_PATTERN.sub(" ", field.lower()).strip() for field in fields)
+    return {text[start:start + SHINGLE_SIZE] for start in range(max(1, len(text) - SHINGLE_SIZE + 1))}
+
+
+def location_terms(location):
+    """
+    Returns the words & numbers telling a location apart, ignoring case, punctuation & leading zeros
+
+    e.g. "Blk 12 #03-05" as {"12", "3", "5"}, the location as a whole if it is only made of LOCATION_STOP_WORDS
+
+    :return: type: set
+    Words & numbers of the location
+    """
+    words = [word.lstrip("0") or "0" if word.isdigit() else word for word in NON_WORD_PATTERN.sub(" ", location.lower()).split()]
+    return {word for word in words if word not in LOCATION_STOP_WORDS} or set(words) or {location.lower()}
+
+
+@functools.lru_cache(maxsize=None)
+def probe_order(size):
+    """
+    Returns the order in which every bin of a signature of the given size probes the other bins when it is empty,
+    the same for every signature
+    """
+    return tuple(tuple(random.Random(index).sample(range(size), size)) for index in range(size))
+
+
+def signature(shingle_set, size):
+    """
+    Returns the MinHash signature of a set of shingles, using one permutation hashing
+
+    :param shingle_set: type: set
+    Shingles of the fault
+
+    :param size: type: int
+    Values in the signature
+
+    :return: type: array.array
+    Smallest hash of every bin, as unsigned 32-bit integers
+    """
+    bins = [None] * size
+    for shingle in shingle_set:
+        value = hash(shingle) & 0xFFFFFFFFFFFFFFFF
+        index = value % size
+        value = (value // size) & MAX_VALUE
+        if bins[index] is None or value < bins[index]:
+            bins[index] = value
+
+    # Empty bins borrow the value of the first bin of their probe order that is not empty
+    if not shingle_set:
+        return array.array("I", [MAX_VALUE] * size)
+    if None in bins:
+        order = probe_order(size)
+        bins = [value if value is not None else next(bins[other] for other in order[index] if bins[other] is not None)
+                for index, value in enumerate(bins)]
+    return array.array("I", bins)
+
+
+def similarity(first, second, start=0, end=None):
+    """
+    Returns the estimated Jaccard similarity of two signatures, the share of values they have in common
+
+    :param start: type: int
+    :param end: type: int or None
+    Part of the signatures compared (Defaults to all of it)
+    """
+    end = len(first) if end is None else end
+    return sum(1 for index in range(start, end) if first[index] == second[index]) / (end - start)
+
+
+class DuplicateIndex:
+    """
+    Locality-sensitive hashing index of the signatures of the active faults
+    """
+    def __init__(self, store, threshold=DEFAULT_THRESHOLD, bands=DEFAULT_BANDS, location_rows=DEFAULT_LOCATION_ROWS,
+                 text_rows=DEFAULT_TEXT_ROWS):
+        """
+        :param store: type: fault_store.SQLiteFaultStore
+        Store holding the faults, reports attached to existing faults are saved in it
+
+        :param threshold: type: float
+        Min estimated similarity, from 0 to 1, of a likely duplicate
+
+        :param bands: type: int
+        Bands of the signatures, more bands find less similar faults at the cost of more candidates
+
+        :param location_rows: type: int
+        :param text_rows: type: int
+        Location & type & description values in every band, more values find fewer candidates at the cost of missing
+        less similar faults
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError(f"Invalid duplicate threshold: {threshold}, must be above 0 and at most 1")
+        self.store = store
+        self.threshold = threshold
+        self.bands = bands
+        self.location_rows = location_rows
+        self.text_rows = text_rows
+        # Signatures of a fault are kept in a single array, the location values first
+        self._location_size = bands * location_rows
+        self._text_size = max(TEXT_SIGNATURE_SIZE, bands * text_rows)
+        # Lookups & candidates compared, to check lookups stay sub-linear
+        self.lookups = 0
+        self.candidates = 0
+
+        with store.transaction() as connection:
+            for statement in DUPLICATE_SCHEMA:
+                connection.execute(statement)
+
+        # Signature of every fault keyed by fault id, and the fault ids of every band value in a table per band, most band
+        # values belong to a single fault which is kept as is rather than in a set
+        self._signatures = {}
+        self._buckets = [{} for _ in range(bands)]
+        self._lock = threading.Lock()
+        # Data version of the fault store seen by the last sync, None until the index is built, and the position of the last
+        # fault saved it saw, faults are not saved in id order, see fault_store.SAVE_ORDER_SCHEMA
+        self._data_version = None
+        self._saved_position = None
+        self._sync_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def signature(self, type_of_fault, description, location):
+        """
+        Returns the signatures of the location and of the type & description of a fault, in a single array
+        """
+        return signature(location_terms(location), self._location_size) + signature(shingles(type_of_fault, description), self._text_size)
+
+    def similarity(self, first, second):
+        """
+        Returns the estimated similarity of two faults, the similarity of their wording times the square of the similarity
+        of their locations, as a different place tells faults apart more than different words
+        """
+        return similarity(first, second, 0, self._location_size) ** 2 * similarity(first, second, self._location_size, len(first))
+
+    def _keys(self, fault_signature):
+        """
+        Yields the table & key of every band of a signature
+        """
+        text = self._location_size
+        for band, bucket in enumerate(self._buckets):
+            yield bucket, hash(fault_signature[band * self.location_rows:(band + 1) * self.location_rows].tobytes() +
+                               fault_signature[text + band * self.text_rows:text + (band + 1) * self.text_rows].tobytes())
+
+    def _insert(self, fault_id, fault_signature):
+        if fault_id in self._signatures:
+            return
+        self._signatures[fault_id] = fault_signature
+        for bucket, key in self._keys(fault_signature):
+            fault_ids = bucket.get(key)
+            if fault_ids is None:
+                bucket[key] = fault_id
+            elif isinstance(fault_ids, set):
+                fault_ids.add(fault_id)
+            else:
+                bucket[key] = {fault_ids, fault_id}
+
+    def _delete(self, fault_id):
+        fault_signature = self._signatures.pop(fault_id, None)
+        if fault_signature is None:
+            return
+        for bucket, key in self._keys(fault_signature):
+            fault_ids = bucket.get(key)
+            if fault_ids == fault_id:
+                del bucket[key]
+            elif isinstance(fault_ids, set):
+                fault_ids.discard(fault_id)
+                if len(fault_ids) == 1:
+                    bucket[key] = fault_ids.pop()
+
+    def add(self, fault_id, type_of_fault, description, location):
+        """
+        Indexes a newly reported fault
+        """
+        fault_signature = self.signature(type_of_fault, description, location)
+        with self._lock:
+            self._insert(int(fault_id), fault_signature)
+
+    def remove(self, fault_ids):
+        """
+        Drops resolved faults from the index
+        """
+        with self._lock:
+            for fault_id in fault_ids:
+                self._delete(int(fault_id))
+
+    def sync(self, blocking=True):
+        """
+        Indexes the active faults saved by other processes since the last sync, every active fault on the first sync
+
+        :param blocking: type: bool
+        Whether to wait for a sync already running, e.g. the first one, rather than skip this one
+
+        :return: type: int
+        Number of faults indexed
+        """
+        if not self._sync_lock.acquire(blocking=blocking):
+            return 0
+        try:
+            data_version = self.store.revision()[0]
+            if data_version == self._data_version:
+                return 0
+
+            start = time.perf_counter()
+            saved_position = self.store.saved_position()
+            indexed = 0
+            if self._saved_position is None:
+                # Every active fault, a page at a time
+                last_id = 0
+                while True:
+                    rows = self.store.execute("SELECT id, type, description, location FROM faults WHERE status = ? AND id > ? "
+                                              "ORDER BY id LIMIT ?", (ACTIVE, last_id, SYNC_PAGE_SIZE))
+                    indexed += self._index(rows)
+                    if len(rows) < SYNC_PAGE_SIZE:
+                        break
+                    last_id = rows[-1]["id"]
+            else:
+                # Faults saved since the last sync, by any process
+                rows = self.store.execute("SELECT id, type, description, location FROM faults WHERE status = ? AND saved_seq > ?",
+                                          (ACTIVE, self._saved_position))
+                indexed += self._index(rows)
+
+            if self._data_version is None:
+                logging.info("Duplicates: Indexed %s active faults in %.3fs", indexed, time.perf_counter() - start)
+            self._data_version = data_version
+            self._saved_position = saved_position
+            return indexed
+        finally:
+            self._sync_lock.release()
+
+    def _index(self, rows):
+        """
+        Indexes the faults read from the fault store that are not indexed yet
+
+        :return: type: int
+        Number of faults indexed
+        """
+        with self._lock:
+            rows = [row for row in rows if row["id"] not in self._signatures]
+        signatures = [(row["id"], self.signature(row["type"], row["description"], row["location"])) for row in rows]
+        with self._lock:
+            for fault_id, fault_signature in signatures:
+                self._insert(fault_id, fault_signature)
+        return len(signatures)
+
+    def candidates_of(self, fault_signature):
+        """
+        Returns (similarity, fault id) of the indexed faults sharing a band with a signature
+        """
+        with self._lock:
+            fault_ids = set()
+            for bucket, key in self._keys(fault_signature):
+                found = bucket.get(key)
+                if isinstance(found, set):
+                    fault_ids.update(found)
+                elif found is not None:
+                    fault_ids.add(found)
+            return [(self.similarity(fault_signature, self._signatures[fault_id]), fault_id) for fault_id in fault_ids]
+
+    def find(self, type_of_fault, description, location, limit=3):
+        """
+        Returns the active faults likely to be duplicates of a fault being reported
+
+        :return: type: list
+        (fault_store.Fault, estimated similarity) of up to limit faults, most similar first
+        """
+        # Lookups do not wait for the index to be built
+        self.sync(blocking=False)
+        candidates = self.candidates_of(self.signature(type_of_fault, description, location))
+        self.lookups += 1
+        self.candidates += len(candidates)
+
+        likely = sorted(((score, fault_id) for score, fault_id in candidates if score >= self.threshold), reverse=True)
+        if not likely:
+            return []
+
+        # Faults resolved by another process since they were indexed are dropped
+        faults = {fault.id: fault for fault in self.store.get_faults([fault_id for _, fault_id in likely])}
+        self.remove(fault_id for _, fault_id in likely if fault_id not in faults or faults[fault_id].status != ACTIVE)
+        return [(faults[fault_id], score) for score, fault_id in likely
+                if fault_id in faults and faults[fault_id].status == ACTIVE][:limit]
+
+    def add_report(self, connection, fault_id, reporter_id, reporter_first_name, reporter_last_name, reporter_username,
+                   type_of_fault, description, location, created_at):
+        """
+        Saves a report attached to an existing fault rather than saved as a new fault, inside the transaction of the caller
+        """
+        connection.execute("INSERT INTO duplicate_reports (fault_id, reporter_id, reporter_first_name, reporter_last_name, "
+                           "reporter_username, type, description, location, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (fault_id, reporter_id, reporter_first_name, reporter_last_name, reporter_username, type_of_fault,
+                            description, location, created_at))
+
+    def count_reports(self, fault_id):
+        """
+        Returns the number of reports attached to a fault
+        """
+        return self.store.execute("SELECT COUNT(*) FROM duplicate_reports WHERE fault_id = ?", (fault_id,))[0][0]
@@ -0,0 +1,271 @@
+"""
+    Escalation of faults left active for too long
+
+    SLA tiers are seconds after a fault was reported at which it is escalated if it is still active, each to either:
+        1. recipients - The recipients the fault was routed to, as a reminder
+        2. escalation - A second group of recipients, e.g. supervisors
+
+    Every active fault has a single timer, the due time of its next tier, kept in a min-heap. A tick of the job queue
+    pops the timers that are due, so it costs O(log n) per fault escalated rather than a scan of every active fault.
+    Resolving a fault marks its timer as cancelled in O(1), cancelled timers are dropped when they reach the top of the
+    heap, or all at once when they make up most of the heap.
+
+    The last tier reached by every fault is saved in the fault store, in the same transaction as its notification, so
+    no tier is notified twice. The heap is rebuilt from the active faults with a single query when the process starts
+    or takes over as leader. Faults saved by other processes are picked up by the ticks following a commit of another
+    process, in the order they were saved in (see fault_store.SAVE_ORDER_SCHEMA), ticks of a single process only look at
+    the heap.
+"""
+
+# Import statements
+import time
+import heapq
+import logging
+import threading
+from fault_store import ACTIVE
+
+# Who an SLA tier notifies
+RECIPIENTS = "recipients"
+ESCALATION = "escalation"
+
+# Tables of the escalation scheduler, created in the fault store
+ESCALATION_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS escalations (fault_id INTEGER PRIMARY KEY, tier INTEGER NOT NULL, escalated_at REAL NOT NULL)",
+)
+
+
+class SLATier:
+    """
+    Seconds after being reported a fault still active is escalated at, and who to
+    """
+    __slots__ = ("after", "target")
+
+    def __init__(self, after, target):
+        if after <= 0:
+            raise ValueError(f"Invalid SLA tier: {after}, must be a positive number of seconds")
+        if target not in (RECIPIENTS, ESCALATION):
+            raise ValueError(f"Unknown SLA tier target: {target}, use {RECIPIENTS} or {ESCALATION}")
+        self.after = after
+        self.target = target
+
+    def __repr__(self):
+        return f"SLATier({self.after}, {self.target})"
+
+
+def parse_sla_tiers(text):
+    """
+    Parses SLA tiers
+
+    :param text: type: str or None
+    Comma separated seconds=target pairs, e.g. "14400=recipients,86400=escalation"
+
+    :return: type: list
+    SLATier of every pair in ascending order of seconds
+
+    :raises ValueError: If a pair is malformed or names an unknown target
+    """
+    tiers = []
+    for pair in (text or "").split(","):
+        if not pair.strip():
+            continue
+        after, _, target = pair.partition("=")
+        try:
+            after = float(after)
+        except ValueError:
+            raise ValueError(f"Invalid SLA tier: {pair.strip()}, use seconds={RECIPIENTS} or seconds={ESCALATION}")
+        tiers.append(SLATier(after, target.strip().lower()))
+    return sorted(tiers, key=lambda tier: tier.after)
+
+
+def format_duration(seconds):
+    """
+    Returns a duration as text, e.g. 93600 as 1d 2h
+    """
+    parts = []
+    for unit, length in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= length:
+            parts.append(f"{int(seconds // length)}{unit}")
+            seconds %= length
+    return " ".join(parts) or f"{int(seconds)}s"
+
+
+class EscalationScheduler:
+    """
+    Timers of the next SLA tier of every active fault, in a min-heap
+    """
+    def __init__(self, store, tiers, notify, max_batch=500, is_active=None):
+        """
+        :param store: type: fault_store.SQLiteFaultStore
+        Store holding the faults, the last tier reached by every fault is saved in it
+
+        :param tiers: type: list
+        SLATier in ascending order of seconds
+
+        :param notify: type: callable
+        Called with (connection, fault, tier) of every fault escalated, inside the transaction saving the tier reached
+
+        :param max_batch: type: int
+        Max faults escalated per tick, the rest are escalated by the following ticks
+
+        :param is_active: type: callable or None
+        Returns whether this process should escalate, e.g. only the leader of several processes (Defaults to always)
+        """
+        self.store = store
+        self.tiers = list(tiers)
+        self.notify = notify
+        self.max_batch = max_batch
+        self.is_active = is_active or (lambda: True)
+        self.escalated = 0
+
+        with store.transaction() as connection:
+            for statement in ESCALATION_SCHEMA:
+                connection.execute(statement)
+
+        # Timers as [due_at, fault_id, tier index, cancelled] lists, the timer of every fault keyed by fault id
+        self._heap = []
+        self._timers = {}
+        self._cancelled = 0
+        self._lock = threading.Lock()
+        # Position of the last fault saved seen by the last sync with the fault store, None until the heap is built, and
+        # the data version it saw
+        self._saved_position = None
+        self._data_version = None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def _push(self, fault_id, created_at, tier):
+        """
+        Schedules the next tier of a fault, nothing if every tier was reached
+        """
+        if tier >= len(self.tiers) or fault_id in self._timers:
+            return
+        timer = [created_at + self.tiers[tier].after, fault_id, tier, False]
+        self._timers[fault_id] = timer
+        heapq.heappush(self._heap, timer)
+
+    def _active_faults(self, saved_after=None):
+        """
+        Returns (fault id, created_at, next tier) of the active faults, optionally only those saved after the given position
+        """
+        sql = ("SELECT faults.id, faults.created_at, COALESCE(escalations.tier, 0) FROM faults "
+               "LEFT JOIN escalations ON escalations.fault_id = faults.id WHERE faults.status = ?")
+        if saved_after is None:
+            return self.store.execute(sql, (ACTIVE,))
+        return self.store.execute(sql + " AND faults.saved_seq > ?", (ACTIVE, saved_after))
+
+    def rebuild(self):
+        """
+        Rebuilds the heap from the active faults in the fault store
+
+        :return: type: int
+        Number of timers scheduled
+        """
+        start = time.perf_counter()
+        data_version = self.store.revision()[0]
+        saved_position = self.store.saved_position()
+        with self.store.transaction() as connection:
+            # Tiers of faults no longer active are not needed anymore
+            connection.execute("DELETE FROM escalations WHERE fault_id NOT IN (SELECT id FROM faults WHERE status = ?)", (ACTIVE,))
+        rows = self._active_faults()
+
+        with self._lock:
+            self._timers = {fault_id: [created_at + self.tiers[tier].after, fault_id, tier, False]
+                            for fault_id, created_at, tier in rows if tier < len(self.tiers)}
+            self._heap = list(self._timers.values())
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+            self._saved_position = saved_position
+            self._data_version = data_version
+        logging.info("Escalation: Scheduled %s of %s active faults in %.3fs", len(self._timers), len(rows), time.perf_counter() - start)
+        return len(self._timers)
+
+    def add(self, fault_id, created_at):
+        """
+        Schedules the first tier of a newly reported fault
+        """
+        with self._lock:
+            self._push(int(fault_id), created_at, 0)
+
+    def cancel(self, fault_ids):
+        """
+        Cancels the timers of resolved faults
+        """
+        with self._lock:
+            for fault_id in fault_ids:
+                timer = self._timers.pop(int(fault_id), None)
+                if timer is not None:
+                    timer[3] = True
+                    self._cancelled += 1
+
+            # Drop the cancelled timers at once when they make up most of the heap
+            if self._cancelled > 1024 and self._cancelled * 2 > len(self._heap):
+                self._heap = [timer for timer in self._heap if not timer[3]]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def _pop_due(self, now):
+        """
+        Pops the timers due by the given time, up to max_batch
+        """
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(due) < self.max_batch:
+                timer = heapq.heappop(self._heap)
+                if timer[3]:
+                    self._cancelled -= 1
+                    continue
+                del self._timers[timer[1]]
+                due.append(timer)
+        return due
+
+    def tick(self, now=None):
+        """
+        Escalates the faults whose next tier is due, run periodically on the job queue
+
+        :return: type: int
+        Number of faults escalated
+        """
+        if not self.is_active():
+            # Another process escalates, rebuild once this process takes over
+            self._saved_position = None
+            return 0
+
+        now = time.time() if now is None else now
+        if self._saved_position is None:
+            self.rebuild()
+        elif self.store.revision()[0] != self._data_version:
+            # Another process committed, e.g. saved faults, since the last sync
+            data_version = self.store.revision()[0]
+            saved_position = self.store.saved_position()
+            rows = self._active_faults(saved_after=self._saved_position)
+            with self._lock:
+                for fault_id, created_at, tier in rows:
+                    self._push(fault_id, created_at, tier)
+                self._saved_position = saved_position
+                self._data_version = data_version
+
+        due = self._pop_due(now)
+        if not due:
+            return 0
+
+        escalated = 0
+        with self.store.transaction() as connection:
+            # Faults resolved by another process since their timer was set are skipped
+            faults = {fault.id: fault for fault in self.store.get_faults([timer[1] for timer in due]) if fault.status == ACTIVE}
+            for _, fault_id, tier, _ in due:
+                fault = faults.get(fault_id)
+                if fault is None:
+                    continue
+                self.notify(connection, fault, self.tiers[tier])
+                connection.execute("INSERT OR REPLACE INTO escalations (fault_id, tier, escalated_at) VALUES (?, ?, ?)",
+                                   (fault_id, tier + 1, now))
+                escalated += 1
+
+        with self._lock:
+            for _, fault_id, tier, _ in due:
+                if fault_id in faults:
+                    self._push(fault_id, faults[fault_id].created_at, tier + 1)
+        self.escalated += escalated
+        logging.info("Escalation: Escalated %s faults, %s timers left", escalated, len(self._timers))
+        return escalated
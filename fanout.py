@@ -0,0 +1,243 @@
+"""
+    Fan-out engine for sending notifications to multiple recipients
+
+    Recipients are served in parallel by a bounded pool of worker threads, while token buckets keep the outgoing messages
+    under Telegram's rate limits (~30 messages per second globally, ~1 message per second per chat).
+    Messages that hit flood control (RetryAfter) or time out are retried with backoff.
+"""
+
+# Import statements
+import time
+import logging
+import threading
+import telegram
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Delivery statuses
+SENT = "sent"
+FAILED = "failed"
+UNREACHABLE = "unreachable"
+
+# Descriptions of the BadRequest errors of a chat that cannot be messaged, other bad requests (e.g. "can't parse
+# entities") are about the message and fail the delivery instead
+UNREACHABLE_ERRORS = ("chat not found", "user not found", "chat is deactivated", "user is deactivated", "group chat was deactivated",
+                      "peer_id_invalid")
+
+# Max chats whose token bucket is kept, the least recently messaged are dropped first
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, refilled continuously at a fixed rate
+    """
+    def __init__(self, rate, capacity):
+        """
+        :param rate: type: float
+        Tokens added per second
+
+        :param capacity: type: float
+        Max tokens the bucket can hold, i.e. the allowed burst size
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a single token, blocks until one is available
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class DeliveryStatus:
+    """
+    Delivery outcome of a fan-out for a single recipient
+    """
+    __slots__ = ("chat_id", "status", "attempts", "error", "latency")
+
+    def __init__(self, chat_id, status, attempts, error=None, latency=0.0):
+        self.chat_id = chat_id
+        self.status = status
+        self.attempts = attempts
+        self.error = error
+        self.latency = latency
+
+
+class FanOutReport:
+    """
+    Delivery outcome of a fan-out for all recipients
+    """
+    def __init__(self, results, latency):
+        """
+        :param results: type: dict
+        DeliveryStatus for every recipient, keyed by chat id
+
+        :param latency: type: float
+        Total time taken by the fan-out in seconds
+        """
+        self.results = results
+        self.latency = latency
+
+    @property
+    def delivered(self):
+        return [chat_id for chat_id, result in self.results.items() if result.status == SENT]
+
+    @property
+    def undelivered(self):
+        return [chat_id for chat_id, result in self.results.items() if result.status != SENT]
+
+    def summary(self):
+        """
+        Returns the report in logging format
+        """
+        return f"Delivered to {len(self.delivered)}/{len(self.results)} recipients in {self.latency:.3f}s"
+
+
+class FanOut:
+    """
+    Sends messages to multiple recipients through a bounded pool of worker threads
+    """
+    def __init__(self, bot, max_workers=8, global_rate=30, per_chat_rate=1, per_chat_burst=3, max_retries=3, backoff=0.5):
+        """
+        :param bot: type: telegram.Bot
+        Bot used to send the messages
+
+        :param max_workers: type: int
+        Max recipients served at the same time
+
+        :param global_rate: type: float
+        Max messages per second across all chats
+
+        :param per_chat_rate: type: float
+        Max messages per second for a single chat
+
+        :param per_chat_burst: type: int
+        Max messages sent back to back to a single chat
+
+        :param max_retries: type: int
+        Max retries for a message hitting flood control or timing out
+
+        :param backoff: type: float
+        Initial backoff in seconds between retries of a timed out message, doubled after every retry
+        """
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fanout")
+        self._global_bucket = TokenBucket(rate=global_rate, capacity=global_rate)
+        self._chat_buckets = OrderedDict()
+        self._chat_buckets_lock = threading.Lock()
+
+    def _chat_bucket(self, chat_id):
+        with self._chat_buckets_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(rate=self.per_chat_rate, capacity=self.per_chat_burst)
+                if len(self._chat_buckets) > MAX_CHAT_BUCKETS:
+                    # Chats idle for long have a full bucket, dropping it changes nothing
+                    self._chat_buckets.popitem(last=False)
+            else:
+                self._chat_buckets.move_to_end(chat_id)
+            return bucket
+
+    def _send_message(self, chat_id, message):
+        """
+        Sends a single message, retrying on flood control & timeouts
+
+        Messages holding a photo or document are sent with send_photo or send_document, by the file_id Telegram gave the
+        file, so that it is not uploaded again for every recipient
+
+        :return: type: int
+        Number of attempts taken
+        """
+        if "photo" in message:
+            send = self.bot.send_photo
+        elif "document" in message:
+            send = self.bot.send_document
+        else:
+            send = self.bot.send_message
+
+        backoff = self.backoff
+        for attempt in range(1, self.max_retries + 2):
+            self._chat_bucket(chat_id).acquire()
+            self._global_bucket.acquire()
+            try:
+                send(chat_id=chat_id, **message)
+                return attempt
+            except telegram.error.RetryAfter as error:
+                if attempt > self.max_retries:
+                    raise
+                logging.warning("Flood control for chat: %s, retrying in %ss", chat_id, error.retry_after)
+                time.sleep(error.retry_after)
+            except telegram.error.TimedOut:
+                if attempt > self.max_retries:
+                    raise
+                logging.warning("Timed out sending to chat: %s, retrying in %ss", chat_id, backoff)
+                time.sleep(backoff)
+                backoff *= 2
+
+    def _deliver(self, chat_id, messages):
+        """
+        Sends all messages to a single recipient in order
+
+        :return: type: DeliveryStatus
+        Delivery outcome for the recipient
+        """
+        start = time.perf_counter()
+        attempts = 0
+        try:
+            for message in messages:
+                attempts += self._send_message(chat_id, message)
+        except telegram.error.Unauthorized as error:
+            # User blocked the bot or deleted their account
+            return DeliveryStatus(chat_id, UNREACHABLE, attempts, error, time.perf_counter() - start)
+        except telegram.error.BadRequest as error:
+            # User have not initialize a chat with bot yet
+            if any(description in str(error).lower() for description in UNREACHABLE_ERRORS):
+                return DeliveryStatus(chat_id, UNREACHABLE, attempts, error, time.perf_counter() - start)
+            return DeliveryStatus(chat_id, FAILED, attempts, error, time.perf_counter() - start)
+        except telegram.error.TelegramError as error:
+            return DeliveryStatus(chat_id, FAILED, attempts, error, time.perf_counter() - start)
+
+        return DeliveryStatus(chat_id, SENT, attempts, latency=time.perf_counter() - start)
+
+    def send(self, recipients, messages):
+        """
+        Sends the messages to every recipient and waits for all deliveries to finish
+
+        :param recipients: type: list
+        Chat ids of the recipients
+
+        :param messages: type: list
+        Keyword arguments for telegram.Bot.send_message, send_photo or send_document (excluding chat_id) of every message, sent in order
+
+        :return: type: FanOutReport
+        Delivery outcome for all recipients
+        """
+        start = time.perf_counter()
+        futures = {chat_id: self._executor.submit(self._deliver, chat_id, messages) for chat_id in recipients}
+        results = {chat_id: future.result() for chat_id, future in futures.items()}
+
+        return FanOutReport(results, time.perf_counter() - start)
+
+    def shutdown(self):
+        """
+        Waits for pending deliveries and stops the worker threads
+        """
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,417 @@
+"""
+    Archive tier of the fault store
+
+    Resolved faults are rarely read once they are old, yet every one of them is fetched & rendered again whenever the
+    resolved history view is rebuilt. Faults resolved longer than a configurable age ago are moved out of the fault store
+    into compressed, append-only segment files, leaving the hot store with the active & recently resolved faults only.
+
+    Segment files (segment-{number}.seg) are a sequence of blocks, every block holding up to block_size faults:
+        1. Header - Magic, number of faults & compressed length of the payload (BLOCK_HEADER)
+        2. Fault ids - One signed 64-bit integer per fault, uncompressed so the index is rebuilt without decompressing
+        3. Payload - zlib compressed JSON list of the faults, one list of FAULT_COLUMNS values per fault
+
+    Only the offset index is kept in memory (fault id -> block, block -> segment & offset), segments are memory mapped
+    and blocks are decompressed on demand into a bounded LRU cache. Processes sharing the directory pick up each other's
+    blocks through refresh(), appends are serialized with a file lock. A block torn by a crash is truncated by the next
+    append, faults are only deleted from the hot store once their block is on disk.
+
+    The index is read when the archive is opened, or with lazy=True on first use, so that the bot can start handling
+    updates while it is read in the background, see load().
+
+    Archived faults are no longer part of the full-text index, /search only covers faults in the hot store
+"""
+
+# Import statements
+import os
+import mmap
+import fcntl
+import zlib
+import json
+import bisect
+import struct
+import heapq
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from fault_store import FaultStore, Fault, FAULT_COLUMNS, RESOLVED
+
+# Header of a block: magic, number of faults, compressed length of the payload
+BLOCK_HEADER = struct.Struct("<4sII")
+BLOCK_MAGIC = b"FBLK"
+
+# Segment files are rolled over once they reach this size
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+
+class FaultArchive:
+    """
+    Append-only archive of resolved faults, stored in compressed segment files
+    """
+    def __init__(self, directory, block_size=64, cache_size=64, lazy=False):
+        """
+        :param directory: type: str
+        Directory of the segment files, created once faults are archived
+
+        :param block_size: type: int
+        Max faults compressed together into a single block
+
+        :param cache_size: type: int
+        Max decompressed blocks kept in memory, least recently used blocks are evicted first
+
+        :param lazy: type: bool
+        Read the index on first use rather than right away
+        """
+        self.directory = directory
+        self.block_size = block_size
+        self.cache_size = cache_size
+
+        # Blocks as (segment number, offset of the payload, compressed length), in the order they were written
+        self._blocks = []
+        # Archived fault ids in ascending order, alongside the index of the block holding them
+        self._ids = array("q")
+        self._block_of = array("l")
+        # Segments seen so far, with the offset every segment has been read up to
+        self._segments = []
+        self._scanned = {}
+        self._maps = {}
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._loaded = False
+
+        if not lazy:
+            self.refresh()
+
+    def load(self):
+        """
+        Reads the index if it has not been read yet, callers reading the archive meanwhile wait for it
+        """
+        if not self._loaded:
+            self.refresh()
+
+    @property
+    def loaded(self):
+        """
+        Whether the index has been read
+        """
+        return self._loaded
+
+    @property
+    def revision(self):
+        """
+        Changes whenever faults are archived
+        """
+        self.load()
+        return len(self._blocks)
+
+    def _segment_filename(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:06d}.seg")
+
+    def _scan_segment(self, segment, start):
+        """
+        Returns the blocks of a segment from an offset onwards, stopping at a block that is not completely written yet
+
+        :return: type: tuple
+        (List of (fault ids, offset of the payload, compressed length) of every complete block, offset after the last one)
+        """
+        with open(self._segment_filename(segment), "rb") as file:
+            file.seek(start)
+            data = file.read()
+
+        blocks = []
+        offset = 0
+        while offset + BLOCK_HEADER.size <= len(data):
+            magic, count, length = BLOCK_HEADER.unpack_from(data, offset)
+            payload_offset = offset + BLOCK_HEADER.size + count * 8
+            if magic != BLOCK_MAGIC or payload_offset + length > len(data):
+                break
+            blocks.append((array("q", data[offset + BLOCK_HEADER.size:payload_offset]), start + payload_offset, length))
+            offset = payload_offset + length
+
+        return blocks, start + offset
+
+    def refresh(self):
+        """
+        Picks up blocks archived by other processes sharing the directory
+
+        Only the segment files are stat'ed when nothing changed
+        """
+        with self._lock:
+            names = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+            segments = sorted(int(name[8:-4]) for name in names if name.startswith("segment-") and name.endswith(".seg"))
+
+            pairs = None
+            for segment in segments:
+                start = self._scanned.get(segment, 0)
+                if start == os.path.getsize(self._segment_filename(segment)):
+                    continue
+                blocks, self._scanned[segment] = self._scan_segment(segment, start)
+                if not blocks:
+                    continue
+                if pairs is None:
+                    pairs = list(zip(self._ids, self._block_of))
+                for fault_ids, offset, length in blocks:
+                    pairs.extend((fault_id, len(self._blocks)) for fault_id in fault_ids)
+                    self._blocks.append((segment, offset, length))
+                # The segment grew, map it again on the next read
+                stale = self._maps.pop(segment, None)
+                if stale is not None:
+                    stale.close()
+
+            self._segments = segments
+            if pairs is not None:
+                self._set_index(pairs)
+            self._loaded = True
+
+    def _set_index(self, pairs):
+        pairs.sort()
+        self._ids = array("q", (fault_id for fault_id, _ in pairs))
+        self._block_of = array("l", (block for _, block in pairs))
+
+    def __len__(self):
+        self.load()
+        return len(self._ids)
+
+    def __contains__(self, fault_id):
+        self.load()
+        index = bisect.bisect_left(self._ids, fault_id)
+        return index < len(self._ids) and self._ids[index] == fault_id
+
+    def append(self, faults):
+        """
+        Archives faults, faults already in the archive are skipped
+
+        Writers in other processes are held off with an exclusive lock on the directory, the blocks are written & synced
+        to disk before this returns
+
+        :param faults: type: iterable
+        fault_store.Fault records to archive
+
+        :return: type: list
+        Ids of the faults now in the archive, including the ones skipped
+        """
+        faults = sorted(faults, key=lambda fault: fault.id)
+        archived = [fault.id for fault in faults]
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(os.path.join(self.directory, "archive.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.refresh()
+            faults = [fault for fault in faults if fault.id not in self]
+            if not faults:
+                return archived
+
+            segment = self._segments[-1] if self._segments else 1
+            filename = self._segment_filename(segment)
+            if os.path.exists(filename) and os.path.getsize(filename) >= SEGMENT_SIZE:
+                segment += 1
+                filename = self._segment_filename(segment)
+
+            with open(filename, "ab") as file:
+                # No other writer holds the lock, anything after the last complete block was torn by a crash
+                if file.tell() > self._scanned.get(segment, 0):
+                    logging.warning("Archive: Truncating torn block at offset %s of %s", self._scanned.get(segment, 0), filename)
+                    file.truncate(self._scanned.get(segment, 0))
+
+                for start in range(0, len(faults), self.block_size):
+                    block = faults[start:start + self.block_size]
+                    payload = zlib.compress(json.dumps([[getattr(fault, column) for column in FAULT_COLUMNS] for fault in block],
+                                                       ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+                    file.write(BLOCK_HEADER.pack(BLOCK_MAGIC, len(block), len(payload)))
+                    file.write(array("q", (fault.id for fault in block)).tobytes())
+                    file.write(payload)
+                file.flush()
+                os.fsync(file.fileno())
+
+            self.refresh()
+
+        return archived
+
+    def _read_block(self, block):
+        """
+        Returns the faults of a block keyed by id, decompressing it if it is not cached
+        """
+        with self._lock:
+            faults = self._cache.get(block)
+            if faults is not None:
+                self._cache.move_to_end(block)
+                return faults
+
+            segment, offset, length = self._blocks[block]
+            segment_map = self._maps.get(segment)
+            if segment_map is None:
+                with open(self._segment_filename(segment), "rb") as file:
+                    segment_map = self._maps[segment] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            payload = segment_map[offset:offset + length]
+
+        faults = {fault.id: fault for fault in (Fault(*values) for values in json.loads(zlib.decompress(payload)))}
+
+        with self._lock:
+            self._cache[block] = faults
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return faults
+
+    def get_fault(self, fault_id):
+        """
+        Returns a single archived fault, None if the fault is not archived
+        """
+        self.load()
+        index = bisect.bisect_left(self._ids, fault_id)
+        if index == len(self._ids) or self._ids[index] != fault_id:
+            return None
+        return self._read_block(self._block_of[index]).get(fault_id)
+
+    def iter_faults(self, since=None, until=None):
+        """
+        Yields the archived faults in ascending id order, optionally filtered by created_at
+        """
+        self.load()
+        for fault_id, block in zip(self._ids, self._block_of):
+            fault = self._read_block(block).get(fault_id)
+            if fault is None:
+                continue
+            if since is not None and fault.created_at < since:
+                continue
+            if until is not None and fault.created_at >= until:
+                continue
+            yield fault
+
+    def last_fault_id(self):
+        self.load()
+        return self._ids[-1] if self._ids else 0
+
+    def close(self):
+        with self._lock:
+            for segment_map in self._maps.values():
+                segment_map.close()
+            self._maps.clear()
+            self._cache.clear()
+
+
+class TieredFaultStore(FaultStore):
+    """
+    Fault store made of a hot store holding active & recently resolved faults, and an archive of older resolved faults
+
+    Writes, search & metadata go to the hot store, reads fall back to the archive for faults not found in the hot store
+    """
+    def __init__(self, hot, archive):
+        """
+        :param hot: type: fault_store.FaultStore
+        Store of the active & recently resolved faults
+
+        :param archive: type: FaultArchive
+        Archive of the older resolved faults
+        """
+        self.hot = hot
+        self.archive = archive
+
+    @property
+    def searchable(self):
+        return self.hot.searchable
+
+    def transaction(self):
+        """
+        Returns a context manager running the enclosed statements in a single transaction of the hot store
+        """
+        return self.hot.transaction()
+
+    def add_fault(self, *args, **kwargs):
+        return self.hot.add_fault(*args, **kwargs)
+
+    def add_faults(self, faults):
+        self.archive.refresh()
+        return self.hot.add_faults(fault for fault in faults if fault.id not in self.archive)
+
+    def get_fault(self, fault_id):
+        fault = self.hot.get_fault(fault_id)
+        return fault if fault is not None else self.archive.get_fault(int(fault_id))
+
+    def get_faults(self, fault_ids):
+        fault_ids = [int(fault_id) for fault_id in fault_ids]
+        faults = {fault.id: fault for fault in self.hot.get_faults(fault_ids)}
+        for fault_id in fault_ids:
+            if fault_id not in faults:
+                fault = self.archive.get_fault(fault_id)
+                if fault is not None:
+                    faults[fault_id] = fault
+        return [faults[fault_id] for fault_id in fault_ids if fault_id in faults]
+
+    def resolve_fault(self, fault_id, resolved_at):
+        return self.hot.resolve_fault(fault_id, resolved_at)
+
+    def resolve_faults(self, id_ranges, resolved_at):
+        return self.hot.resolve_faults(id_ranges, resolved_at)
+
+    def iter_faults(self, status, since=None, until=None, resolved_before=None, limit=None):
+        faults = self.hot.iter_faults(status, since=since, until=until, resolved_before=resolved_before)
+        if status == RESOLVED:
+            archived = (fault for fault in self.archive.iter_faults(since=since, until=until)
+                        if resolved_before is None or fault.resolved_at < resolved_before)
+            faults = heapq.merge(archived, faults, key=lambda fault: fault.id)
+        for count, fault in enumerate(faults):
+            if limit is not None and count >= limit:
+                return
+            yield fault
+
+    def delete_faults(self, fault_ids):
+        return self.hot.delete_faults(fault_ids)
+
+    def count_faults(self, status=None):
+        count = self.hot.count_faults(status)
+        if status is None or status == RESOLVED:
+            count += len(self.archive)
+        return count
+
+    def last_fault_id(self):
+        return max(self.hot.last_fault_id(), self.archive.last_fault_id())
+
+    def has_fault(self, fault_id):
+        # Faults are archived long after their id was handed out, the archive is not read just for this
+        return self.hot.has_fault(fault_id) or (self.archive.loaded and int(fault_id) in self.archive)
+
+    def revision(self):
+        # Until load_archive has run, the archive is left to be read on first use rather than refreshed
+        if self.archive.loaded:
+            self.archive.refresh()
+        return self.hot.revision(), self.archive.revision
+
+    def saved_position(self):
+        return self.hot.saved_position()
+
+    def reserve_ids(self, count=1):
+        return self.hot.reserve_ids(count)
+
+    def search_faults(self, terms, status=None, since=None, until=None, limit=200):
+        return self.hot.search_faults(terms, status=status, since=since, until=until, limit=limit)
+
+    def get_meta(self, key, default=None):
+        return self.hot.get_meta(key, default)
+
+    def set_meta(self, key, value):
+        self.hot.set_meta(key, value)
+
+    def archive_resolved(self, resolved_before, batch_size=1000):
+        """
+        Moves the faults resolved before a given time from the hot store into the archive
+
+        :param resolved_before: type: float
+        POSIX timestamp, faults resolved before it are archived
+
+        :param batch_size: type: int
+        Max faults moved at a time
+
+        :return: type: int
+        Number of faults archived
+        """
+        archived = 0
+        while True:
+            faults = list(self.hot.iter_faults(RESOLVED, resolved_before=resolved_before, limit=batch_size))
+            if not faults:
+                return archived
+            # Faults are only removed from the hot store once they are safely in the archive
+            archived += self.hot.delete_faults(self.archive.append(faults))
+
+    def close(self):
+        self.hot.close()
+        self.archive.close()
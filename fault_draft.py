@@ -0,0 +1,105 @@
+"""
+    Drafts of faults being reported
+
+    A draft holds what a reporter has entered so far in the conversation, and is kept in user_data until the fault is
+    submitted or cancelled. It only holds plain values, so the persisted user_data of a reporter mid-conversation stays
+    small & the same size whatever Telegram returns, unlike the telegram.Message of the fault summary kept before.
+
+    Drafts of reporters who stopped replying expire draft_ttl seconds after their last change: the conversation times out
+    and removes the draft, and drafts left over from before a restart are removed by expire_drafts.
+"""
+
+# Import statements
+import time
+
+# Key of the draft in user_data
+DRAFT_KEY = "draft"
+
+# Seconds before a draft without changes expires
+DEFAULT_DRAFT_TTL = 24 * 60 * 60
+
+
+class FaultDraft:
+    """
+    Fields of a fault being reported, None until the reporter has entered them
+    """
+    __slots__ = ("type", "description", "location", "summarized_at", "updated_at", "attachments", "duplicate_ids")
+
+    def __init__(self, type=None, description=None, location=None, summarized_at=None, updated_at=None, attachments=(), duplicate_ids=()):
+        """
+        :param summarized_at: type: float or None
+        POSIX timestamp of the fault summary sent for confirmation, saved as the time the fault was created
+
+        :param updated_at: type: float or None
+        POSIX timestamp of the last change, the draft expires draft_ttl seconds after it (Defaults to now)
+
+        :param attachments: type: tuple
+        attachments.Attachment of every photo & document sent by the reporter, replaced rather than changed in place
+
+        :param duplicate_ids: type: tuple
+        Ids of the likely duplicates shown with the fault summary, the only faults the report can be added to
+        """
+        self.type = type
+        self.description = description
+        self.location = location
+        self.summarized_at = summarized_at
+        self.updated_at = updated_at if updated_at is not None else time.time()
+        self.attachments = tuple(attachments)
+        self.duplicate_ids = tuple(duplicate_ids)
+
+    def update(self, **fields):
+        """
+        Sets the given fields and marks the draft as changed
+        """
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.updated_at = time.time()
+
+    def _fields(self):
+        return self.type, self.description, self.location, self.summarized_at, self.updated_at, self.attachments, self.duplicate_ids
+
+    def __reduce__(self):
+        # Pickled as a plain tuple of the fields, without slot names
+        return FaultDraft, self._fields()
+
+    def __eq__(self, other):
+        # Persistence compares user_data against what it saved last to find out whether it changed
+        return isinstance(other, FaultDraft) and self._fields() == other._fields()
+
+    def __repr__(self):
+        return f"FaultDraft(type={self.type!r}, location={self.location!r}, updated_at={self.updated_at})"
+
+
+def get_draft(user_data):
+    """
+    Returns the draft of a reporter, starting a new one if there is none
+    """
+    draft = user_data.get(DRAFT_KEY)
+    if draft is None:
+        draft = user_data[DRAFT_KEY] = FaultDraft()
+    return draft
+
+
+def expire_drafts(user_data, ttl, now=None):
+    """
+    Removes the drafts without changes for longer than ttl seconds
+
+    :param user_data: type: dict
+    user_data of every user, keyed by user id
+
+    :param ttl: type: float
+    Seconds before a draft without changes expires
+
+    :return: type: int
+    Number of drafts removed
+    """
+    expires_before = (now if now is not None else time.time()) - ttl
+    expired = 0
+    # Copy the keys, handlers may add users while the drafts are being checked
+    for user_id in list(user_data):
+        data = user_data.get(user_id)
+        draft = data.get(DRAFT_KEY) if data else None
+        if draft is not None and draft.updated_at < expires_before:
+            data.pop(DRAFT_KEY, None)
+            expired += 1
+    return expired
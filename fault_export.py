@@ -0,0 +1,428 @@
+"""
+    Bulk export & import of the fault history
+
+    Faults are streamed one at a time between the fault store and a file, so that exports & imports run in bounded
+    memory however many faults there are. Imports are saved in batches, skipping fault ids that are already saved.
+
+    Imports can run while the bot is running, fault ids are handed out after the imported ones and ids already taken
+    are skipped. Imported active faults are only shown as likely duplicates & escalated once the bot is restarted,
+    as the bot reads every active fault on start only, see duplicates.py & escalation.py.
+
+    Formats:
+        1. csv - One row per fault under a header of FAULT_COLUMNS, for spreadsheets
+        2. jsonl - One JSON object per fault (JSON Lines), for BI tools & scripts
+        3. columnar - Compact binary format for big dumps, see below
+
+    Timestamps are written in ISO 8601 with their UTC offset in the csv & jsonl formats, and as POSIX timestamps in the
+    columnar format.
+
+    The columnar format is a header (COLUMNAR_MAGIC followed by the column names as a JSON line) and a sequence of row
+    groups, every group holding up to row_group_size faults:
+        1. Header - Magic & number of faults (GROUP_HEADER)
+        2. Columns - One zlib compressed chunk per column in FAULT_COLUMNS, prefixed by its compressed length
+    A column chunk is a validity byte per fault (0 for missing values) followed by the values that are present:
+    integers as little-endian 64-bit deltas from the previous value, floats as little-endian doubles, and text as
+    32-bit lengths followed by the UTF-8 bytes. Values of a column sit next to each other, so they compress well.
+
+    Usage:
+        python fault_export.py export faults.csv [--format csv|jsonl|columnar] [--status active|resolved] [--from DD/MM/YYYY] [--to DD/MM/YYYY]
+        python fault_export.py import faults.csv [--format csv|jsonl|columnar]
+
+        Reads fault_db & archive_dir like run.py, - as filename writes to stdout or reads from stdin
+"""
+
+# Import statements
+import io
+import os
+import sys
+import csv
+import json
+import zlib
+import heapq
+import struct
+import argparse
+import datetime
+import itertools
+from array import array
+from pytz import timezone
+from fault_store import Fault, SQLiteFaultStore, FAULT_COLUMNS, ACTIVE, RESOLVED
+from fault_archive import FaultArchive, TieredFaultStore
+
+# Formats faults can be exported in
+FORMATS = ("csv", "jsonl", "columnar")
+
+# Columns holding timestamps, written as ISO 8601 in the csv & jsonl formats
+TIMESTAMP_COLUMNS = ("created_at", "resolved_at")
+
+# Types of the columns, those not listed hold text
+INTEGER_COLUMNS = ("id", "reporter_id", "revision")
+FLOAT_COLUMNS = TIMESTAMP_COLUMNS
+
+# Columns left empty in a csv row for a missing value
+OPTIONAL_COLUMNS = ("reporter_id", "reporter_first_name", "reporter_last_name", "reporter_username", "resolved_at")
+
+# Start of a file in the columnar format
+COLUMNAR_MAGIC = b"FCOL1\n"
+
+# Header of a row group: magic, number of faults
+GROUP_HEADER = struct.Struct("<4sI")
+GROUP_MAGIC = b"FGRP"
+
+# Prefix of a column chunk: compressed length
+COLUMN_HEADER = struct.Struct("<I")
+
+
+def iter_export(store, status=None, since=None, until=None):
+    """
+    Yields the faults to export in ascending id order
+
+    :param store: type: fault_store.FaultStore
+    Store to export from
+
+    :param status: type: str or None
+    ACTIVE or RESOLVED, None for both
+
+    :param since: type: float or None
+    POSIX timestamp, only faults created at or after it are exported
+
+    :param until: type: float or None
+    POSIX timestamp, only faults created before it are exported
+    """
+    statuses = [status] if status is not None else [ACTIVE, RESOLVED]
+    return heapq.merge(*(store.iter_faults(status, since=since, until=until) for status in statuses), key=lambda fault: fault.id)
+
+
+def format_timestamp(timestamp, tz):
+    return datetime.datetime.fromtimestamp(timestamp, tz).isoformat() if timestamp is not None else None
+
+
+def parse_timestamp(value):
+    """
+    Returns the POSIX timestamp of an ISO 8601 datetime with a UTC offset, or of a number
+
+    :raises ValueError: If the datetime has no UTC offset
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    date = datetime.datetime.fromisoformat(value)
+    if date.tzinfo is None:
+        raise ValueError(f"Datetime without UTC offset: {value}")
+    return date.timestamp()
+
+
+def to_record(fault, tz):
+    """
+    Returns the fields of a fault as a dict, with its timestamps in ISO 8601
+    """
+    record = {column: getattr(fault, column) for column in FAULT_COLUMNS}
+    for column in TIMESTAMP_COLUMNS:
+        record[column] = format_timestamp(record[column], tz)
+    return record
+
+
+def from_record(record):
+    """
+    Builds a fault from the fields of a csv row or JSON object
+
+    :raises ValueError: If a field is missing or invalid
+    """
+    missing = [column for column in FAULT_COLUMNS if column not in record]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+
+    fields = {column: record[column] for column in FAULT_COLUMNS}
+    for column in OPTIONAL_COLUMNS:
+        if fields[column] == "":
+            fields[column] = None
+    for column in INTEGER_COLUMNS:
+        if fields[column] is not None:
+            fields[column] = int(fields[column])
+    for column in TIMESTAMP_COLUMNS:
+        fields[column] = parse_timestamp(fields[column])
+    if fields["created_at"] is None:
+        raise ValueError("Missing created_at")
+    if fields["status"] not in (ACTIVE, RESOLVED):
+        raise ValueError(f"Unknown status: {fields['status']}")
+    return Fault(**fields)
+
+
+# Text formats
+def write_csv(faults, file, tz):
+    writer = csv.DictWriter(file, fieldnames=FAULT_COLUMNS)
+    writer.writeheader()
+    count = 0
+    for fault in faults:
+        writer.writerow(to_record(fault, tz))
+        count += 1
+    return count
+
+
+def read_csv(file):
+    reader = csv.DictReader(file)
+    for record in reader:
+        try:
+            yield from_record(record)
+        except (TypeError, ValueError) as error:
+            raise ValueError(f"Line {reader.line_num}: {error}")
+
+
+def write_jsonl(faults, file, tz):
+    count = 0
+    for fault in faults:
+        file.write(json.dumps(to_record(fault, tz), ensure_ascii=False))
+        file.write("\n")
+        count += 1
+    return count
+
+
+def read_jsonl(file):
+    for line, text in enumerate(file, start=1):
+        if not text.strip():
+            continue
+        try:
+            yield from_record(json.loads(text))
+        except (TypeError, ValueError) as error:
+            raise ValueError(f"Line {line}: {error}")
+
+
+# Columnar format
+def _little_endian(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _encode_column(column, values):
+    present = [value for value in values if value is not None]
+    if column in INTEGER_COLUMNS:
+        payload = _little_endian(array("q", (value - previous for previous, value in zip([0] + present, present)))).tobytes()
+    elif column in FLOAT_COLUMNS:
+        payload = _little_endian(array("d", present)).tobytes()
+    else:
+        encoded = [value.encode("utf-8") for value in present]
+        payload = _little_endian(array("I", map(len, encoded))).tobytes() + b"".join(encoded)
+    return zlib.compress(bytes(value is not None for value in values) + payload)
+
+
+def _decode_column(column, data, count):
+    data = zlib.decompress(data)
+    validity = data[:count]
+    present = sum(validity)
+
+    if column in INTEGER_COLUMNS:
+        values = list(itertools.accumulate(_little_endian(array("q", data[count:count + present * 8]))))
+    elif column in FLOAT_COLUMNS:
+        values = list(_little_endian(array("d", data[count:count + present * 8])))
+    else:
+        lengths = _little_endian(array("I", data[count:count + present * 4]))
+        values = []
+        offset = count + present * 4
+        for length in lengths:
+            values.append(data[offset:offset + length].decode("utf-8"))
+            offset += length
+
+    present_values = iter(values)
+    return [next(present_values) if valid else None for valid in validity]
+
+
+def write_columnar(faults, file, row_group_size=4096):
+    file.write(COLUMNAR_MAGIC)
+    file.write(json.dumps(FAULT_COLUMNS).encode("utf-8") + b"\n")
+
+    count = 0
+    faults = iter(faults)
+    while True:
+        group = list(itertools.islice(faults, row_group_size))
+        if not group:
+            return count
+        file.write(GROUP_HEADER.pack(GROUP_MAGIC, len(group)))
+        for column in FAULT_COLUMNS:
+            chunk = _encode_column(column, [getattr(fault, column) for fault in group])
+            file.write(COLUMN_HEADER.pack(len(chunk)))
+            file.write(chunk)
+        count += len(group)
+
+
+def _read_exactly(file, size):
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated columnar file")
+    return data
+
+
+def read_columnar(file):
+    if file.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar fault export")
+    if tuple(json.loads(file.readline())) != FAULT_COLUMNS:
+        raise ValueError("Columns of the columnar file do not match the fault store")
+
+    while True:
+        header = file.read(GROUP_HEADER.size)
+        if not header:
+            return
+        if len(header) != GROUP_HEADER.size:
+            raise ValueError("Truncated columnar file")
+        magic, count = GROUP_HEADER.unpack(header)
+        if magic != GROUP_MAGIC:
+            raise ValueError("Corrupted columnar file")
+
+        columns = []
+        for column in FAULT_COLUMNS:
+            length, = COLUMN_HEADER.unpack(_read_exactly(file, COLUMN_HEADER.size))
+            columns.append(_decode_column(column, _read_exactly(file, length), count))
+        for values in zip(*columns):
+            yield Fault(*values)
+
+
+# Export & import
+def export_faults(store, file, format, status=None, since=None, until=None, tz=datetime.timezone.utc):
+    """
+    Streams faults from the fault store into a file
+
+    :param store: type: fault_store.FaultStore
+    Store to export from
+
+    :param file: type: binary file object
+    File to write to
+
+    :param format: type: str
+    One of FORMATS
+
+    :param status, since, until:
+    Filters of the faults exported, see iter_export
+
+    :param tz: type: datetime.tzinfo
+    Timezone of the timestamps in the csv & jsonl formats
+
+    :return: type: int
+    Number of faults exported
+    """
+    faults = iter_export(store, status=status, since=since, until=until)
+    if format == "columnar":
+        return write_columnar(faults, file)
+
+    text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+    try:
+        return write_csv(faults, text, tz) if format == "csv" else write_jsonl(faults, text, tz)
+    finally:
+        # Leave the file open for the caller
+        text.flush()
+        text.detach()
+
+
+def import_faults(store, file, format, batch_size=1000):
+    """
+    Streams faults from a file into the fault store, skipping fault ids that are already saved
+
+    :param store: type: fault_store.FaultStore
+    Store to import into
+
+    :param file: type: binary file object
+    File to read from
+
+    :param format: type: str
+    One of FORMATS
+
+    :param batch_size: type: int
+    Max faults saved at a time
+
+    :return: type: tuple
+    (Number of faults read, number of faults saved)
+
+    :raises ValueError: If the file holds an invalid fault, batches before it stay saved
+    """
+    text = None
+    if format == "columnar":
+        faults = read_columnar(file)
+    else:
+        text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+        faults = read_csv(text) if format == "csv" else read_jsonl(text)
+
+    read = saved = 0
+    try:
+        while True:
+            batch = list(itertools.islice(faults, batch_size))
+            if not batch:
+                return read, saved
+            read += len(batch)
+            saved += store.add_faults(batch)
+    finally:
+        # Leave the file open for the caller
+        if text is not None:
+            text.detach()
+
+
+def format_of(filename, format=None):
+    """
+    Returns the given format, or the format matching the extension of the filename (Defaults to csv)
+    """
+    if format:
+        return format
+    extension = os.path.splitext(filename)[1].lstrip(".").lower()
+    return {"json": "jsonl", "ndjson": "jsonl", "fcol": "columnar"}.get(extension, extension if extension in FORMATS else "csv")
+
+
+def open_store():
+    """
+    Opens the fault store configured for run.py
+    """
+    return TieredFaultStore(SQLiteFaultStore(os.getenv("fault_db", "faults.db")), FaultArchive(os.getenv("archive_dir", "archive")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk export & import of the fault history")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export faults into a file")
+    export_parser.add_argument("filename", help="File to write, - for stdout")
+    export_parser.add_argument("--format", choices=FORMATS, help="Format of the file (Defaults to the extension of the filename, else csv)")
+    export_parser.add_argument("--status", choices=[ACTIVE, RESOLVED], help="Only export faults with this status")
+    export_parser.add_argument("--from", dest="since", help="Only export faults created on or after DD/MM/YYYY")
+    export_parser.add_argument("--to", dest="until", help="Only export faults created on or before DD/MM/YYYY")
+    export_parser.add_argument("--timezone", default="Asia/Singapore", help="Timezone of the dates & exported timestamps")
+
+    import_parser = subparsers.add_parser("import", help="Import faults from a file")
+    import_parser.add_argument("filename", help="File to read, - for stdin")
+    import_parser.add_argument("--format", choices=FORMATS, help="Format of the file (Defaults to the extension of the filename, else csv)")
+    import_parser.add_argument("--batch-size", type=int, default=1000, help="Max faults saved at a time")
+
+    args = parser.parse_args()
+    format = format_of(args.filename, args.format)
+
+    if args.command == "export":
+        tz = timezone(args.timezone)
+        try:
+            since = tz.localize(datetime.datetime.strptime(args.since, "%d/%m/%Y")).timestamp() if args.since else None
+            until = (tz.localize(datetime.datetime.strptime(args.until, "%d/%m/%Y")) + datetime.timedelta(days=1)).timestamp() if args.until else None
+        except ValueError:
+            parser.error("dates have to be DD/MM/YYYY")
+
+    store = open_store()
+    try:
+        if args.command == "export":
+            if args.filename == "-":
+                count = export_faults(store, sys.stdout.buffer, format, status=args.status, since=since, until=until, tz=tz)
+            else:
+                with open(args.filename, "wb") as file:
+                    count = export_faults(store, file, format, status=args.status, since=since, until=until, tz=tz)
+            print(f"Exported {count} faults", file=sys.stderr)
+        else:
+            try:
+                if args.filename == "-":
+                    read, saved = import_faults(store, sys.stdin.buffer, format, batch_size=args.batch_size)
+                else:
+                    with open(args.filename, "rb") as file:
+                        read, saved = import_faults(store, file, format, batch_size=args.batch_size)
+            except ValueError as error:
+                sys.exit(f"Import stopped, {error}")
+            print(f"Imported {saved} of {read} faults, {read - saved} were already saved", file=sys.stderr)
+            if saved:
+                print("Restart the bot if it is running, so that imported active faults are escalated & shown as likely duplicates", file=sys.stderr)
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
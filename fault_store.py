@@ -0,0 +1,712 @@
+"""
+    Persistence backends for the fault store
+
+    Faults used to live as pre-rendered MarkdownV2 strings inside bot_data, which PicklePersistence re-pickles as a whole on every flush.
+    The fault store keeps one structured record per fault instead, so that writes are incremental and reads are indexed queries.
+
+    Faults are handed out as Fault records holding the raw fields, rendering them for display is left to the caller
+
+    Backends:
+        1. FaultStore - Interface every backend has to implement
+        2. SQLiteFaultStore - SQLite database in WAL mode, one row per fault
+
+    Fault history can be searched through a full-text index over type, description & location (SQLite FTS5),
+    kept up to date by triggers whenever faults are added or updated. Only the most recent matches are ranked.
+
+    Also contains a one-shot migration from an existing PicklePersistence file
+"""
+
+# Import statements
+import os
+import re
+import pickle
+import shutil
+import logging
+import sqlite3
+import datetime
+import time
+import threading
+
+# Fault statuses
+ACTIVE = "active"
+RESOLVED = "resolved"
+
+# Columns of a fault record, in storage order
+FAULT_COLUMNS = ("id", "type", "description", "location", "reporter_id", "reporter_first_name", "reporter_last_name",
+                 "reporter_username", "created_at", "resolved_at", "status", "revision")
+
+# Max faults read from the SQLite backend at a time while iterating over them
+ITER_PAGE_SIZE = 1000
+
+# Schema of the SQLite backend
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS faults (
+    id INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    description TEXT NOT NULL,
+    location TEXT NOT NULL,
+    reporter_id INTEGER,
+    reporter_first_name TEXT,
+    reporter_last_name TEXT,
+    reporter_username TEXT,
+    created_at REAL NOT NULL,
+    resolved_at REAL,
+    status TEXT NOT NULL DEFAULT 'active',
+    revision INTEGER NOT NULL DEFAULT 0,
+    saved_seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_faults_status ON faults (status, id);
+CREATE INDEX IF NOT EXISTS idx_faults_created_at ON faults (created_at);
+CREATE INDEX IF NOT EXISTS idx_faults_resolved_at ON faults (resolved_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Order faults are saved in by every process sharing the SQLite backend. Fault ids are reserved before the fault is
+# saved, in blocks per process, and created_at is when the fault was reported, so neither follows the order of commits.
+# Writes are serialized by SQLite, so a counter bumped in the transaction saving the fault does, see saved_position
+SAVE_ORDER_SCHEMA = (
+    "CREATE INDEX IF NOT EXISTS idx_faults_saved_seq ON faults (saved_seq)",
+    "INSERT OR IGNORE INTO sequences (name, value) VALUES ('fault_saved', 0)",
+)
+
+# Full-text index of the SQLite backend, an external content table over the faults kept in sync by triggers
+SEARCH_SCHEMA = (
+    "CREATE VIRTUAL TABLE faults_fts USING fts5(type, description, location, content='faults', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    """CREATE TRIGGER faults_fts_insert AFTER INSERT ON faults BEGIN
+    INSERT INTO faults_fts (rowid, type, description, location) VALUES (new.id, new.type, new.description, new.location);
+END""",
+    """CREATE TRIGGER faults_fts_delete AFTER DELETE ON faults BEGIN
+    INSERT INTO faults_fts (faults_fts, rowid, type, description, location) VALUES ('delete', old.id, old.type, old.description, old.location);
+END""",
+    """CREATE TRIGGER faults_fts_update AFTER UPDATE OF type, description, location ON faults BEGIN
+    INSERT INTO faults_fts (faults_fts, rowid, type, description, location) VALUES ('delete', old.id, old.type, old.description, old.location);
+    INSERT INTO faults_fts (rowid, type, description, location) VALUES (new.id, new.type, new.description, new.location);
+END""",
+)
+
+# Matches a single search term
+SEARCH_TERM_PATTERN = re.compile(r'\w+')
+
+
+class Fault:
+    """
+    A single fault, with the reporter identity saved alongside the reported details
+
+    Timestamps (created_at, resolved_at) are POSIX timestamps in seconds
+    The revision is bumped every time the fault is updated, so anything derived from a fault can be cached under (id, revision)
+    """
+    __slots__ = FAULT_COLUMNS
+
+    def __init__(self, id, type, description, location, reporter_id, reporter_first_name, reporter_last_name,
+                 reporter_username, created_at, resolved_at=None, status=ACTIVE, revision=0):
+        self.id = id
+        self.type = type
+        self.description = description
+        self.location = location
+        self.reporter_id = reporter_id
+        self.reporter_first_name = reporter_first_name
+        self.reporter_last_name = reporter_last_name
+        self.reporter_username = reporter_username
+        self.created_at = created_at
+        self.resolved_at = resolved_at
+        self.status = status
+        self.revision = revision
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Builds a fault from a database row holding the columns in FAULT_COLUMNS
+        """
+        return cls(*(row[column] for column in FAULT_COLUMNS))
+
+    def __repr__(self):
+        return f"Fault(id={self.id}, status={self.status}, revision={self.revision})"
+
+
+class FaultStore:
+    """
+    Interface of a fault store backend
+
+    Faults are returned as Fault records
+    """
+    def add_fault(self, fault_id, type_of_fault, description, location, reporter_id, reporter_first_name,
+                  reporter_last_name, reporter_username, created_at, status=ACTIVE, resolved_at=None):
+        """
+        Saves a newly reported fault
+
+        :return: type: int
+        The id of the saved fault
+        """
+        raise NotImplementedError
+
+    def add_faults(self, faults):
+        """
+        Saves faults in bulk, e.g. historical faults being imported, skipping ids that are already saved
+
+        :param faults: type: iterable
+        Fault records, saved as they are
+
+        :return: type: int
+        Number of faults saved
+        """
+        raise NotImplementedError
+
+    def get_fault(self, fault_id):
+        """
+        Returns a single fault, None if there is no fault under the id
+        """
+        raise NotImplementedError
+
+    def get_faults(self, fault_ids):
+        """
+        Returns the faults under the given ids in the same order, ids without a fault are skipped
+        """
+        raise NotImplementedError
+
+    def resolve_fault(self, fault_id, resolved_at):
+        """
+        Marks an active fault as resolved
+
+        :return: type: bool
+        True if the fault was active and is now resolved, False if there is no such active fault
+        """
+        raise NotImplementedError
+
+    def resolve_faults(self, id_ranges, resolved_at):
+        """
+        Marks the active faults in any of the id ranges as resolved, all of them or none
+
+        :param id_ranges: type: list
+        (first, last) fault ids of every range, both inclusive
+
+        :return: type: list
+        Ids of the faults resolved in ascending order, ids without an active fault are skipped
+        """
+        raise NotImplementedError
+
+    def iter_faults(self, status, since=None, until=None, resolved_before=None, limit=None):
+        """
+        Yields the faults with the given status in ascending id order, optionally filtered by created_at & resolved_at
+
+        :param limit: type: int or None
+        Max faults yielded, None for all of them
+        """
+        raise NotImplementedError
+
+    def delete_faults(self, fault_ids):
+        """
+        Removes faults from the store, e.g. once they are archived
+
+        :return: type: int
+        Number of faults removed
+        """
+        raise NotImplementedError
+
+    def count_faults(self, status=None):
+        """
+        Returns the amount of faults, optionally only of the given status
+        """
+        raise NotImplementedError
+
+    def last_fault_id(self):
+        """
+        Returns the highest fault id saved, 0 if the store is empty
+        """
+        raise NotImplementedError
+
+    def has_fault(self, fault_id):
+        """
+        Returns whether a fault is saved under the given id
+        """
+        raise NotImplementedError
+
+    def revision(self):
+        """
+        Returns a value that changes whenever faults are added or resolved, used to invalidate cached views of the faults
+        """
+        raise NotImplementedError
+
+    def saved_position(self):
+        """
+        Returns the position of the last fault saved in the order faults are committed in by every process, faults saved
+        afterwards have a higher saved_seq, see SAVE_ORDER_SCHEMA
+
+        Take it before reading the faults, then read the faults saved after it on the next sync, so that none is missed
+        """
+        raise NotImplementedError
+
+    def reserve_ids(self, count=1):
+        """
+        Atomically reserves a block of consecutive fault ids, ids are never handed out twice even if faults are deleted
+
+        :param count: type: int
+        Number of ids to reserve
+
+        :return: type: int
+        The first id of the reserved block
+        """
+        raise NotImplementedError
+
+    def search_faults(self, terms, status=None, since=None, until=None, limit=200):
+        """
+        Searches the type, description & location of the faults, every term has to match the start of a word
+
+        Only the limit matches with the highest fault ids, i.e. the most recent ones, are ranked
+
+        :param terms: type: str
+        Search terms, separated by whitespace
+
+        :param status: type: str or None
+        Only return faults with the given status
+
+        :param since: type: float or None
+        Only return faults created at or after this POSIX timestamp
+
+        :param until: type: float or None
+        Only return faults created before this POSIX timestamp
+
+        :param limit: type: int
+        Max faults returned
+
+        :return: type: list
+        Ids of the matching faults, best match first
+        """
+        raise NotImplementedError
+
+    def get_meta(self, key, default=None):
+        """
+        Returns a value from the store's key-value metadata
+        """
+        raise NotImplementedError
+
+    def set_meta(self, key, value):
+        """
+        Saves a value into the store's key-value metadata
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Releases any resources held by the backend
+        """
+        pass
+
+
+class SQLiteFaultStore(FaultStore):
+    """
+    Fault store backed by a SQLite database in WAL mode
+
+    A single connection is shared between the dispatcher worker threads, writes are serialized with a lock
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(filename, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        # Databases created by earlier versions have no revision & saved_seq columns yet
+        columns = {row["name"] for row in self._connection.execute("PRAGMA table_info(faults)")}
+        if "revision" not in columns:
+            self._connection.execute("ALTER TABLE faults ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        if "saved_seq" not in columns:
+            self._connection.execute("ALTER TABLE faults ADD COLUMN saved_seq INTEGER NOT NULL DEFAULT 0")
+        for statement in SAVE_ORDER_SCHEMA:
+            self._connection.execute(statement)
+        # Resolved faults migrated by earlier versions have no resolution time, see migrate_from_pickle, backfilled once
+        if self.get_meta("resolved_at_backfilled") is None:
+            with self.transaction() as connection:
+                connection.execute("UPDATE faults SET resolved_at = ? WHERE status = ? AND resolved_at IS NULL", (time.time(), RESOLVED))
+                connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('resolved_at_backfilled', '1')")
+        self.searchable = self._create_search_index()
+        # Number of writes made through this connection, writes by other connections show up in PRAGMA data_version
+        self._writes = 0
+
+    def _create_search_index(self):
+        """
+        Creates the full-text index if it does not exist yet, indexing the faults already saved
+
+        :return: type: bool
+        True if the index is available, False if SQLite was built without FTS5
+        """
+        if self._connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'faults_fts'").fetchone():
+            return True
+
+        try:
+            with self.transaction() as connection:
+                for statement in SEARCH_SCHEMA:
+                    connection.execute(statement)
+                connection.execute("INSERT INTO faults_fts (faults_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError as error:
+            logging.warning("Search: Full-text index unavailable, Error: %s", error)
+            return False
+
+        return True
+
+    def execute(self, sql, parameters=()):
+        """
+        Runs a single statement under the store lock and returns all resulting rows
+        """
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def transaction(self):
+        """
+        Returns a context manager running the enclosed statements in a single immediate transaction
+        """
+        return _Transaction(self._connection, self._lock)
+
+    def _reserve_saved_seq(self, connection, count):
+        """
+        Bumps the save order by count inside the transaction saving the faults, see SAVE_ORDER_SCHEMA
+
+        :return: type: int
+        saved_seq of the first fault saved
+        """
+        connection.execute("UPDATE sequences SET value = value + ? WHERE name = 'fault_saved'", (count,))
+        return connection.execute("SELECT value FROM sequences WHERE name = 'fault_saved'").fetchone()[0] - count + 1
+
+    def add_fault(self, fault_id, type_of_fault, description, location, reporter_id, reporter_first_name,
+                  reporter_last_name, reporter_username, created_at, status=ACTIVE, resolved_at=None):
+        row = (fault_id, type_of_fault, description, location, reporter_id, reporter_first_name, reporter_last_name,
+               reporter_username, created_at, resolved_at, status)
+        with self._lock:
+            # Saved in the transaction of the caller if there is one, e.g. together with its notification
+            if self._connection.in_transaction:
+                self._insert_fault(self._connection, row)
+            else:
+                with self.transaction() as connection:
+                    self._insert_fault(connection, row)
+            self._writes += 1
+        return int(fault_id)
+
+    def _insert_fault(self, connection, row):
+        connection.execute("INSERT INTO faults (id, type, description, location, reporter_id, reporter_first_name, "
+                           "reporter_last_name, reporter_username, created_at, resolved_at, status, saved_seq) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row + (self._reserve_saved_seq(connection, 1),))
+
+    def add_faults(self, faults):
+        rows = [tuple(getattr(fault, column) for column in FAULT_COLUMNS) for fault in faults]
+        if not rows:
+            return 0
+        with self.transaction() as connection:
+            first = self._reserve_saved_seq(connection, len(rows))
+            added = connection.executemany(f"INSERT OR IGNORE INTO faults ({', '.join(FAULT_COLUMNS)}, saved_seq) "
+                                           f"VALUES ({', '.join('?' * (len(FAULT_COLUMNS) + 1))})",
+                                           (row + (first + index,) for index, row in enumerate(rows))).rowcount
+            # Ids handed out afterwards have to continue after the saved faults
+            connection.execute("UPDATE sequences SET value = MAX(value, ?) WHERE name = 'fault_id'", (max(row[0] for row in rows),))
+            if added:
+                self._writes += 1
+        return added
+
+    def get_fault(self, fault_id):
+        rows = self.execute(f"SELECT {', '.join(FAULT_COLUMNS)} FROM faults WHERE id = ?", (fault_id,))
+        return Fault.from_row(rows[0]) if rows else None
+
+    def get_faults(self, fault_ids):
+        fault_ids = list(fault_ids)
+        faults = {}
+        # Stay under SQLite's limit of bound parameters per statement
+        for start in range(0, len(fault_ids), 500):
+            chunk = fault_ids[start:start + 500]
+            rows = self.execute(f"SELECT {', '.join(FAULT_COLUMNS)} FROM faults WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+            faults.update((row["id"], Fault.from_row(row)) for row in rows)
+        return [faults[int(fault_id)] for fault_id in fault_ids if int(fault_id) in faults]
+
+    def resolve_fault(self, fault_id, resolved_at):
+        with self._lock:
+            cursor = self._connection.execute("UPDATE faults SET status = ?, resolved_at = ?, revision = revision + 1 "
+                                              "WHERE id = ? AND status = ?",
+                                              (RESOLVED, resolved_at, fault_id, ACTIVE))
+            if cursor.rowcount == 1:
+                self._writes += 1
+            return cursor.rowcount == 1
+
+    def resolve_faults(self, id_ranges, resolved_at):
+        with self._lock:
+            # Joins the transaction of the caller, e.g. one saving the notification about the faults
+            if self._connection.in_transaction:
+                return self._resolve_faults(self._connection, id_ranges, resolved_at)
+            with self.transaction() as connection:
+                return self._resolve_faults(connection, id_ranges, resolved_at)
+
+    def _resolve_faults(self, connection, id_ranges, resolved_at):
+        id_ranges = list(id_ranges)
+        fault_ids = set()
+        # Stay under SQLite's limit of bound parameters per statement
+        for start in range(0, len(id_ranges), 250):
+            chunk = id_ranges[start:start + 250]
+            rows = connection.execute(f"SELECT id FROM faults WHERE status = ? AND ({' OR '.join(['id BETWEEN ? AND ?'] * len(chunk))})",
+                                      [ACTIVE] + [fault_id for id_range in chunk for fault_id in id_range]).fetchall()
+            fault_ids.update(row[0] for row in rows)
+
+        fault_ids = sorted(fault_ids)
+        for start in range(0, len(fault_ids), 500):
+            chunk = fault_ids[start:start + 500]
+            connection.execute(f"UPDATE faults SET status = ?, resolved_at = ?, revision = revision + 1 "
+                               f"WHERE id IN ({', '.join('?' * len(chunk))})", [RESOLVED, resolved_at] + chunk)
+        if fault_ids:
+            self._writes += 1
+        return fault_ids
+
+    def iter_faults(self, status, since=None, until=None, resolved_before=None, limit=None):
+        sql = f"SELECT {', '.join(FAULT_COLUMNS)} FROM faults WHERE status = ?"
+        parameters = [status]
+        if since is not None:
+            sql += " AND created_at >= ?"
+            parameters.append(since)
+        if until is not None:
+            sql += " AND created_at < ?"
+            parameters.append(until)
+        if resolved_before is not None:
+            sql += " AND resolved_at < ?"
+            parameters.append(resolved_before)
+        sql += " AND id > ? ORDER BY id LIMIT ?"
+
+        # Read a page at a time after the last id yielded, so that memory stays bounded and the store lock is not held
+        # while the caller goes through the faults
+        last_id = -1
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_size = ITER_PAGE_SIZE if remaining is None else min(ITER_PAGE_SIZE, remaining)
+            rows = self.execute(sql, parameters + [last_id, page_size])
+            for row in rows:
+                yield Fault.from_row(row)
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1]["id"]
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def delete_faults(self, fault_ids):
+        fault_ids = list(fault_ids)
+        deleted = 0
+        with self.transaction() as connection:
+            for start in range(0, len(fault_ids), 500):
+                chunk = fault_ids[start:start + 500]
+                deleted += connection.execute(f"DELETE FROM faults WHERE id IN ({', '.join('?' * len(chunk))})", chunk).rowcount
+            if deleted:
+                self._writes += 1
+        return deleted
+
+    def count_faults(self, status=None):
+        if status is None:
+            return self.execute("SELECT COUNT(*) FROM faults")[0][0]
+        return self.execute("SELECT COUNT(*) FROM faults WHERE status = ?", (status,))[0][0]
+
+    def last_fault_id(self):
+        return self.execute("SELECT COALESCE(MAX(id), 0) FROM faults")[0][0]
+
+    def has_fault(self, fault_id):
+        return bool(self.execute("SELECT 1 FROM faults WHERE id = ?", (fault_id,)))
+
+    def revision(self):
+        with self._lock:
+            return self._connection.execute("PRAGMA data_version").fetchone()[0], self._writes
+
+    def saved_position(self):
+        return self.execute("SELECT value FROM sequences WHERE name = 'fault_saved'")[0][0]
+
+    def reserve_ids(self, count=1):
+        with self.transaction() as connection:
+            row = connection.execute("SELECT value FROM sequences WHERE name = 'fault_id'").fetchone()
+            if row is None:
+                # Continue after any fault saved before the sequence existed
+                last_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM faults").fetchone()[0]
+                connection.execute("INSERT INTO sequences (name, value) VALUES ('fault_id', ?)", (last_id + count,))
+            else:
+                last_id = row[0]
+                connection.execute("UPDATE sequences SET value = ? WHERE name = 'fault_id'", (last_id + count,))
+        return last_id + 1
+
+    def search_faults(self, terms, status=None, since=None, until=None, limit=200):
+        if not self.searchable:
+            return []
+
+        # Quote every term so user input cannot be read as FTS5 query syntax, * makes it a prefix match
+        query = " ".join(f'"{term}"*' for term in SEARCH_TERM_PATTERN.findall(terms))
+        if not query:
+            return []
+
+        sql = "SELECT faults.id FROM faults_fts JOIN faults ON faults.id = faults_fts.rowid WHERE faults_fts MATCH ?"
+        parameters = [query]
+        if status is not None:
+            sql += " AND faults.status = ?"
+            parameters.append(status)
+        if since is not None:
+            sql += " AND faults.created_at >= ?"
+            parameters.append(since)
+        if until is not None:
+            sql += " AND faults.created_at < ?"
+            parameters.append(until)
+        # Ranking costs the same for every match however few are returned, walking the matches by rowid is cheap,
+        # so only the matches from the limit-th highest fault id up are ranked
+        cutoff = self.execute(sql + " ORDER BY faults_fts.rowid DESC LIMIT 1 OFFSET ?", parameters + [limit - 1])
+        if cutoff:
+            sql += " AND faults_fts.rowid >= ?"
+            parameters.append(cutoff[0][0])
+        sql += " ORDER BY faults_fts.rank LIMIT ?"
+        parameters.append(limit)
+
+        return [row[0] for row in self.execute(sql, parameters)]
+
+    def get_meta(self, key, default=None):
+        rows = self.execute("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else default
+
+    def set_meta(self, key, value):
+        self.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class _Transaction:
+    """
+    Context manager for an immediate SQLite transaction, holding the store lock for its whole duration
+    """
+    def __init__(self, connection, lock):
+        self._connection = connection
+        self._lock = lock
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            self._connection.execute("BEGIN IMMEDIATE")
+        except Exception:
+            self._lock.release()
+            raise
+        return self._connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self._connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self._lock.release()
+        return False
+
+
+# Migration from PicklePersistence
+# Matches a fault message as rendered by send_details_to_maintenance_clerks
+RENDERED_FAULT_PATTERN = re.compile(r'^\*Fault ID:\* (?P<id>\d+)\n'
+                                    r'\*Datetime:\* (?P<datetime>[^\n]+)\n'
+                                    r'\*Name:\* \[(?P<name>.*?)\]\(tg://user\?id=(?P<reporter_id>\d+)\)'
+                                    r'(?:, \*Username:\* \[(?P<username>.*?)\]\(https://t\.me/[^)]*\))?\n'
+                                    r'\*Type of fault:\* (?P<type>.*?)\n'
+                                    r'\*Description:\* (?P<description>.*?)\n'
+                                    r'\*Location:\* (?P<location>.*)$', re.DOTALL)
+
+# Matches a MarkdownV2 escape sequence
+MARKDOWN_ESCAPE_PATTERN = re.compile(r'\\([_*\[\]()~`>#+\-=|{}.!\\])')
+
+
+def unescape_markdown(text):
+    """
+    Reverses telegram.utils.helpers.escape_markdown for MarkdownV2 text
+
+    :param text: type: str
+    Escaped MarkdownV2 text
+
+    :return: type: str
+    The original text
+    """
+    return MARKDOWN_ESCAPE_PATTERN.sub(r'\1', text)
+
+
+def parse_rendered_fault(text, tz):
+    """
+    Parses a fault message rendered by earlier versions of the bot back into its fields
+
+    :param text: type: str
+    The MarkdownV2 fault message saved in bot_data
+
+    :param tz: type: datetime.tzinfo
+    Timezone the datetime in the message was rendered in
+
+    :return: type: dict or None
+    Fields of the fault, None if the message could not be parsed
+    """
+    match = RENDERED_FAULT_PATTERN.match(text)
+    if not match:
+        return None
+
+    created_at = tz.localize(datetime.datetime.strptime(match.group("datetime"), "%d/%m/%Y, %H:%M:%S")).timestamp()
+
+    return {
+        "id": int(match.group("id")),
+        "type_of_fault": unescape_markdown(match.group("type")),
+        "description": unescape_markdown(match.group("description")),
+        "location": unescape_markdown(match.group("location")),
+        "reporter_id": int(match.group("reporter_id")),
+        # First & last name are rendered together, they cannot be told apart reliably
+        "reporter_first_name": unescape_markdown(match.group("name")).strip(),
+        "reporter_last_name": None,
+        "reporter_username": unescape_markdown(match.group("username")) if match.group("username") else None,
+        "created_at": created_at,
+    }
+
+
+def migrate_from_pickle(store, filename, tz):
+    """
+    One-shot migration of the fault history saved by PicklePersistence into the fault store
+
+    The history dicts are removed from the pickle file afterwards, a backup of the original file is kept under {filename}.bak
+
+    :param store: type: FaultStore
+    Store to migrate the faults into
+
+    :param filename: type: str
+    Filename of the PicklePersistence file
+
+    :param tz: type: datetime.tzinfo
+    Timezone the datetimes in the saved messages were rendered in
+
+    :return: type: int
+    Number of faults migrated
+    """
+    if store.get_meta("pickle_migrated") or not os.path.isfile(filename):
+        return 0
+
+    with open(filename, "rb") as file:
+        data = pickle.load(file)
+
+    bot_data = data.get("bot_data", {})
+    # Earlier versions did not save when a fault was resolved, resolved faults are taken as resolved at the migration
+    migrated_at = time.time()
+    migrated = 0
+    for key, status in [("active_history", ACTIVE), ("resolved_history", RESOLVED)]:
+        for fault_id, text in bot_data.get(key, {}).items():
+            fault = parse_rendered_fault(text, tz)
+            if fault is None:
+                logging.warning("Migration: Unable to parse fault id: %s. Skipping.", fault_id)
+                continue
+            if store.get_fault(fault["id"]) is not None:
+                continue
+            if status == RESOLVED:
+                fault["resolved_at"] = migrated_at
+            store.add_fault(fault_id=fault.pop("id"), status=status, **fault)
+            migrated += 1
+
+    # Drop the history from the pickle so that it is no longer loaded and re-pickled
+    if "active_history" in bot_data or "resolved_history" in bot_data:
+        shutil.copyfile(filename, f"{filename}.bak")
+        bot_data.pop("active_history", None)
+        bot_data.pop("resolved_history", None)
+        with open(filename, "wb") as file:
+            pickle.dump(data, file)
+
+    store.set_meta("pickle_migrated", "1")
+    logging.info("Migration: Migrated %s faults from %s", migrated, filename)
+
+    return migrated
@@ -0,0 +1,58 @@
+"""
+    Monotonic fault id allocator
+
+    Fault ids used to be derived from the amount of faults saved, which hands out the same id to submissions confirmed at
+    the same moment and reuses ids once faults are purged. The allocator draws ids from a persisted sequence in the fault store instead.
+
+    Ids are reserved from the store in blocks, allocating from a reserved block costs a lock and an increment.
+    With a block size above 1, several processes can allocate without contending on the store for every id,
+    at the cost of gaps in the numbering for ids left unused in a block when a process stops.
+
+    Faults imported with fault_export.py while the bot runs move the sequence past their ids, but may take ids of a
+    block already reserved. Ids of a reserved block that are already taken are skipped.
+"""
+
+# Import statements
+import logging
+import threading
+
+
+class FaultIdAllocator:
+    """
+    Thread-safe allocator handing out unique, increasing fault ids
+    """
+    def __init__(self, store, block_size=1):
+        """
+        :param store: type: fault_store.FaultStore
+        Store holding the persisted id sequence
+
+        :param block_size: type: int
+        Number of ids reserved from the store at a time
+        """
+        self.store = store
+        self.block_size = block_size
+
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._block_end = 0
+
+    def next_id(self):
+        """
+        Allocates a new fault id
+
+        :return: type: int
+        The newly allocated fault id
+        """
+        while True:
+            with self._lock:
+                if self._next_id >= self._block_end:
+                    # Reserved block used up, reserve the next one
+                    self._next_id = self.store.reserve_ids(self.block_size)
+                    self._block_end = self._next_id + self.block_size
+
+                fault_id = self._next_id
+                self._next_id += 1
+
+            if not self.store.has_fault(fault_id):
+                return fault_id
+            logging.warning("Fault ids: Skipped fault id: %s, already taken, e.g. by an import", fault_id)
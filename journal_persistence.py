@@ -0,0 +1,359 @@
+"""
+    Incremental persistence of user_data, chat_data, bot_data & conversation states
+
+    PicklePersistence pickles the whole state into its file on every change, so the cost of a flush grows with the number
+    of users rather than with what changed. JournalPersistence only writes what changed, as records appended to a journal:
+        1. user_data & chat_data - One record per user or chat whose data changed
+        2. bot_data - One record per changed or removed key
+        3. Conversations - One record per changed conversation state
+
+    Records are written by a background thread in batches, every flush_interval seconds, with a single write & fsync per
+    batch. A crash loses at most the changes of the last flush_interval seconds.
+
+    The latest record of every entry is kept in memory, the journal is compacted by rewriting those records once it
+    grows to compact_ratio times their size, so replaying the journal on start stays proportional to the state.
+
+    Journal file ({filename}.journal): a sequence of records, every record is a header (RECORD_HEADER: length of the
+    payload & its CRC32) followed by the pickled (kind, key, value) of the entry, a value of None removes the entry.
+    A record torn by a crash is dropped, along with anything after it, when the journal is opened.
+
+    On the first start, the state saved by PicklePersistence under the same filename is imported into the journal.
+
+    user_data & chat_data are decoded from the journal for the dispatcher alone, so they are handed over as they are
+    instead of being copied entry by entry like BasePersistence does, only entries saved with the bot replaced in them
+    are walked. Changes to them are found by comparing the encoded record against the latest one, rather than against a
+    copy.
+"""
+
+# Import statements
+import os
+import time
+import zlib
+import pickle
+import struct
+import logging
+import threading
+from collections import defaultdict
+from telegram.ext import BasePersistence
+
+# Header of a record: length of the payload, CRC32 of the payload
+RECORD_HEADER = struct.Struct("<II")
+
+# Kinds of records
+USER = "user"
+CHAT = "chat"
+BOT = "bot"
+CONVERSATION = "conversation"
+
+# Placeholder BasePersistence.replace_bot saves in place of the bot, as found in the pickled records
+REPLACED_BOT = BasePersistence.REPLACED_BOT.encode("utf-8")
+
+
+class JournalPersistence(BasePersistence):
+    """
+    Persistence appending changed entries to a journal file, written in batches by a background thread
+    """
+    def __init__(self, filename, flush_interval=1.0, compact_ratio=4, compact_min_bytes=1024 * 1024,
+                 store_user_data=True, store_chat_data=True, store_bot_data=True):
+        """
+        :param filename: type: str
+        Filename of the state, the journal is saved as {filename}.journal
+
+        :param flush_interval: type: float
+        Seconds between batched writes of the journal, 0 writes every change right away
+
+        :param compact_ratio: type: float
+        The journal is compacted once it is this many times the size of the latest records
+
+        :param compact_min_bytes: type: int
+        The journal is not compacted below this size
+        """
+        super().__init__(store_user_data=store_user_data, store_chat_data=store_chat_data, store_bot_data=store_bot_data)
+        self.filename = filename
+        self.journal_filename = f"{filename}.journal"
+        self.flush_interval = flush_interval
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+
+        self.user_data = defaultdict(dict)
+        self.chat_data = defaultdict(dict)
+        self.bot_data = {}
+        self.conversations = {}
+
+        # Latest record of every entry, keyed by (kind, key), and their total size
+        self._records = {}
+        self._live_bytes = 0
+        # user_data & chat_data entries saved with the bot replaced in them, see insert_bot
+        self._with_bot = set()
+        # Records not written to the journal yet
+        self._pending = []
+        self._journal_bytes = 0
+
+        # _lock guards the state & pending records, _write_lock serializes writes of the journal
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self._load()
+        self._file = open(self.journal_filename, "ab")
+
+        if self.flush_interval > 0:
+            self._thread = threading.Thread(target=self._run, name="journal_persistence", daemon=True)
+            self._thread.start()
+
+    # Loading
+    def _load(self):
+        if not os.path.exists(self.journal_filename):
+            self._import_pickle()
+            return
+
+        with open(self.journal_filename, "rb") as file:
+            data = file.read()
+
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            length, checksum = RECORD_HEADER.unpack_from(data, offset)
+            end = offset + RECORD_HEADER.size + length
+            record = data[offset:end]
+            if end > len(data) or zlib.crc32(record[RECORD_HEADER.size:]) != checksum:
+                break
+            kind, key, value = pickle.loads(record[RECORD_HEADER.size:])
+            self._apply_state(kind, key, value, record)
+            self._apply(kind, key, value, record)
+            offset = end
+
+        if offset < len(data):
+            logging.warning("Persistence: Dropped %s bytes torn off the end of %s", len(data) - offset, self.journal_filename)
+            with open(self.journal_filename, "r+b") as file:
+                file.truncate(offset)
+        self._journal_bytes = offset
+
+    def _import_pickle(self):
+        """
+        Imports the state saved by PicklePersistence, the pickle file itself is left as it is
+        """
+        if not os.path.isfile(self.filename):
+            return
+
+        with open(self.filename, "rb") as file:
+            data = pickle.load(file)
+        entries = [(USER, user_id, user_data) for user_id, user_data in data.get("user_data", {}).items()]
+        entries += [(CHAT, chat_id, chat_data) for chat_id, chat_data in data.get("chat_data", {}).items()]
+        entries += [(BOT, key, value) for key, value in data.get("bot_data", {}).items()]
+        entries += [(CONVERSATION, (name, key), state) for name, conversations in data.get("conversations", {}).items()
+                    for key, state in conversations.items() if state is not None]
+        for kind, key, value in entries:
+            record = self._encode(kind, key, value)
+            self._apply_state(kind, key, value, record)
+            self._apply(kind, key, value, record)
+        self._compact()
+        logging.info("Persistence: Imported %s users & %s chats from %s", len(self.user_data), len(self.chat_data), self.filename)
+
+    @staticmethod
+    def _encode(kind, key, value):
+        payload = pickle.dumps((kind, key, value), protocol=pickle.HIGHEST_PROTOCOL)
+        return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def _apply_state(self, kind, key, value, record):
+        """
+        Applies a record read from the journal to the state
+        """
+        if kind == USER:
+            entries, entry_key = self.user_data, key
+        elif kind == CHAT:
+            entries, entry_key = self.chat_data, key
+        elif kind == BOT:
+            entries, entry_key = self.bot_data, key
+        else:
+            name, entry_key = key
+            entries = self.conversations.setdefault(name, {})
+
+        if value is None:
+            entries.pop(entry_key, None)
+        else:
+            entries[entry_key] = value
+
+        if kind in (USER, CHAT):
+            if value is not None and REPLACED_BOT in record:
+                self._with_bot.add((kind, key))
+            else:
+                self._with_bot.discard((kind, key))
+
+    def _apply(self, kind, key, value, record):
+        """
+        Applies a record to the latest records, without writing it
+        """
+        previous = self._records.pop((kind, key), None)
+        if previous is not None:
+            self._live_bytes -= len(previous)
+        if value is not None:
+            self._records[(kind, key)] = record
+            self._live_bytes += len(record)
+
+    def _record(self, kind, key, value, record=None):
+        """
+        Applies a change and queues its record for the next write, to be called holding _lock
+
+        user_data & chat_data belong to the dispatcher once handed over, only their records are kept up to date
+        """
+        if record is None:
+            record = self._encode(kind, key, value)
+        if kind in (BOT, CONVERSATION):
+            self._apply_state(kind, key, value, record)
+        self._apply(kind, key, value, record)
+        self._pending.append(record)
+
+    # BasePersistence
+    def get_user_data(self):
+        return self.user_data
+
+    def get_chat_data(self):
+        return self.chat_data
+
+    def get_bot_data(self):
+        return self.bot_data
+
+    def get_conversations(self, name):
+        return self.conversations.get(name, {}).copy()
+
+    def insert_bot(self, obj):
+        """
+        Hands user_data & chat_data over as they were decoded, walking only the entries saved with the bot replaced in
+        them, anything else is copied by BasePersistence.insert_bot
+        """
+        for kind, entries in ((USER, self.user_data), (CHAT, self.chat_data)):
+            if obj is entries:
+                for entry_kind, key in list(self._with_bot):
+                    if entry_kind == kind and key in entries:
+                        entries[key] = super().insert_bot(entries[key])
+                return entries
+        return super().insert_bot(obj)
+
+    def update_user_data(self, user_id, data):
+        record = self._encode(USER, user_id, data)
+        with self._lock:
+            if self._records.get((USER, user_id)) == record:
+                return
+            self._record(USER, user_id, data, record)
+        self._write_now()
+
+    def update_chat_data(self, chat_id, data):
+        record = self._encode(CHAT, chat_id, data)
+        with self._lock:
+            if self._records.get((CHAT, chat_id)) == record:
+                return
+            self._record(CHAT, chat_id, data, record)
+        self._write_now()
+
+    def update_bot_data(self, data):
+        with self._lock:
+            changed = False
+            for key in [key for key in self.bot_data if key not in data]:
+                self._record(BOT, key, None)
+                changed = True
+            for key, value in data.items():
+                if key not in self.bot_data or self.bot_data[key] != value:
+                    self._record(BOT, key, value)
+                    changed = True
+        if changed:
+            self._write_now()
+
+    def update_conversation(self, name, key, new_state):
+        with self._lock:
+            if self.conversations.get(name, {}).get(key) == new_state:
+                return
+            self._record(CONVERSATION, (name, key), new_state)
+        self._write_now()
+
+    def flush(self):
+        """
+        Writes the pending records right away, called by the updater when it is stopped by a signal
+        """
+        self.write_batch()
+
+    def close(self):
+        """
+        Stops the background thread & closes the journal, after writing the pending records
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write_batch()
+        with self._write_lock:
+            self._file.close()
+
+    # Writing
+    def _write_now(self):
+        if self.flush_interval <= 0:
+            self.write_batch()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.write_batch()
+            except Exception:
+                logging.exception("Persistence: Writing %s failed", self.journal_filename)
+
+    def write_batch(self):
+        """
+        Appends the pending records to the journal with a single write & fsync, compacting the journal when it is due
+
+        :return: type: int
+        Number of bytes written
+        """
+        with self._write_lock:
+            if self._file.closed:
+                return 0
+            with self._lock:
+                pending, self._pending = self._pending, []
+                compact = self._journal_bytes > max(self.compact_min_bytes, self._live_bytes * self.compact_ratio)
+            if compact:
+                return self._compact()
+            if not pending:
+                return 0
+
+            data = b"".join(pending)
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._journal_bytes += len(data)
+            return len(data)
+
+    def _compact(self):
+        """
+        Rewrites the journal with the latest record of every entry, to be called holding _write_lock
+
+        :return: type: int
+        Number of bytes written
+        """
+        start = time.perf_counter()
+        with self._lock:
+            # Pending records are part of the latest records, later ones are appended to the new journal
+            records = list(self._records.values())
+            self._pending = []
+
+        temporary_filename = f"{self.journal_filename}.tmp"
+        with open(temporary_filename, "wb") as file:
+            for record in records:
+                file.write(record)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_filename, self.journal_filename)
+
+        # Make the rename itself durable
+        directory = os.open(os.path.dirname(os.path.abspath(self.journal_filename)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+        previous_bytes = self._journal_bytes
+        self._journal_bytes = sum(len(record) for record in records)
+        if getattr(self, "_file", None) is not None:
+            self._file.close()
+            self._file = open(self.journal_filename, "ab")
+
+        logging.info("Persistence: Compacted %s from %s to %s bytes in %.3fs", self.journal_filename, previous_bytes,
+                     self._journal_bytes, time.perf_counter() - start)
+        return self._journal_bytes
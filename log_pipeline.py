@@ -0,0 +1,233 @@
+"""
+    Asynchronous logging pipeline
+
+    Log calls only put the record on a queue (QueueHandler), the records are formatted and written by a background
+    thread (QueueListener), so disk writes never sit in the path of a handler. Messages are formatted lazily with
+    %-style arguments in the background thread, a call for a disabled level does not build its message at all.
+
+    Outputs:
+        1. Console
+        2. record.log - Flushed in batches, rotated by size & age
+        3. JSON lines file (optional) - One JSON object per record, carrying user_id, action & fault_id when known
+"""
+
+# Import statements
+import os
+import json
+import time
+import queue
+import logging
+import logging.handlers
+
+
+class UserDetails:
+    """
+    Details of the user chatting with the bot, formatted for logging only when the message is built
+    """
+    __slots__ = ("user_id", "first_name", "last_name", "username")
+
+    def __init__(self, user):
+        """
+        :param user: type: telegram.User
+        The user chatting with the bot
+        """
+        self.user_id = user.id
+        self.first_name = user.first_name
+        self.last_name = user.last_name
+        self.username = user.username
+
+    def __str__(self):
+        return f'UserID: {self.user_id}, Name: {self.first_name}'\
+               f'{f" {self.last_name}" if self.last_name else ""}'\
+               f'{f", Username: {self.username}" if self.username else ""}'
+
+
+class BatchedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    File handler writing records in batches, rotated once it exceeds max_bytes or is older than rotate_interval seconds
+
+    Records are flushed to disk every flush_records records, the listener flushes the rest when the queue runs idle
+    """
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, backup_count=5, rotate_interval=None, flush_records=64, encoding="utf-8"):
+        """
+        :param filename: type: str
+        Filename of the log file
+
+        :param max_bytes: type: int
+        Size in bytes the log file is rotated at, 0 to never rotate by size
+
+        :param backup_count: type: int
+        Number of rotated log files kept
+
+        :param rotate_interval: type: float or None
+        Seconds after which the log file is rotated, None to never rotate by age
+
+        :param flush_records: type: int
+        Number of records written before the file is flushed
+        """
+        super().__init__(filename, mode="a", maxBytes=max_bytes, backupCount=backup_count, encoding=encoding)
+        self.rotate_interval = rotate_interval
+        self.flush_records = flush_records
+        self._pending = 0
+        self._rollover_at = time.time() + rotate_interval if rotate_interval else None
+
+    def shouldRollover(self, record):
+        if self._rollover_at is not None and time.time() >= self._rollover_at and os.path.getsize(self.baseFilename) > 0:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._pending = 0
+        if self.rotate_interval:
+            self._rollover_at = time.time() + self.rotate_interval
+
+    def flush(self):
+        # Called by StreamHandler.emit after every record, only flush once a whole batch is written
+        self._pending += 1
+        if self._pending >= self.flush_records:
+            self.flush_batch()
+
+    def flush_batch(self):
+        """
+        Flushes every record written so far to disk
+        """
+        self.acquire()
+        try:
+            if self.stream and self._pending:
+                self.stream.flush()
+            self._pending = 0
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush_batch()
+        super().close()
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats a record into a single JSON object
+
+    The user id is taken from a UserDetails argument of the log call, action & fault_id from its extra fields
+    """
+    def format(self, record):
+        entry = {"time": self.formatTime(record, self.datefmt), "level": record.levelname, "logger": record.name, "message": record.getMessage()}
+
+        for argument in record.args if isinstance(record.args, tuple) else ():
+            if isinstance(argument, UserDetails):
+                entry["user_id"] = argument.user_id
+                entry["username"] = argument.username
+                break
+
+        for field in ("action", "fault_id"):
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """
+    Queue listener flushing the batched handlers whenever the queue has been idle for flush_interval seconds
+    """
+    def __init__(self, log_queue, *handlers, flush_interval=1.0):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval if block else None)
+            except queue.Empty:
+                if not block:
+                    raise
+                for handler in self.handlers:
+                    if isinstance(handler, BatchedRotatingFileHandler):
+                        handler.flush_batch()
+
+    def stop(self):
+        """
+        Writes out the remaining records, then stops the listener thread & flushes every handler
+        """
+        super().stop()
+        for handler in self.handlers:
+            if isinstance(handler, BatchedRotatingFileHandler):
+                handler.flush_batch()
+            else:
+                handler.flush()
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler leaving the message to be formatted by the listener thread
+
+    The stock QueueHandler formats the message in the calling thread, so that unpicklable arguments are not sent
+    across processes. The queue here never leaves the process, so formatting is deferred to the listener.
+    Arguments of a log call must not be mutated after the call.
+    """
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(filename, formatter, level=logging.INFO, max_bytes=10 * 1024 * 1024, backup_count=5,
+                  rotate_interval=None, json_filename=None, flush_records=64, flush_interval=1.0):
+    """
+    Routes the root logger through the asynchronous pipeline
+
+    :param filename: type: str
+    Filename of the log file
+
+    :param formatter: type: logging.Formatter
+    Formatter of the console & log file output
+
+    :param level: type: int
+    Level of the root logger
+
+    :param max_bytes: type: int
+    Size in bytes the log files are rotated at, 0 to never rotate by size
+
+    :param backup_count: type: int
+    Number of rotated log files kept
+
+    :param rotate_interval: type: float or None
+    Seconds after which the log files are rotated, None to never rotate by age
+
+    :param json_filename: type: str or None
+    Filename of the JSON lines output, None to disable it
+
+    :param flush_records: type: int
+    Number of records written before the log files are flushed
+
+    :param flush_interval: type: float
+    Seconds of idle queue after which the log files are flushed
+
+    :return: type: BatchingQueueListener
+    The started listener, stop it before exiting to write out the remaining records
+    """
+    handlers = [logging.StreamHandler(),
+                BatchedRotatingFileHandler(filename, max_bytes=max_bytes, backup_count=backup_count,
+                                           rotate_interval=rotate_interval, flush_records=flush_records)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    if json_filename:
+        json_handler = BatchedRotatingFileHandler(json_filename, max_bytes=max_bytes, backup_count=backup_count,
+                                                  rotate_interval=rotate_interval, flush_records=flush_records)
+        json_handler.setFormatter(JSONFormatter(datefmt=formatter.datefmt))
+        handlers.append(json_handler)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener = BatchingQueueListener(log_queue, *handlers, flush_interval=flush_interval)
+    listener.start()
+
+    return listener
@@ -0,0 +1,356 @@
+"""
+    Metrics of the bot, exposed in the Prometheus text format over a local /metrics endpoint
+
+    Metrics:
+        1. bot_handler_latency_seconds - Histogram of the time taken by every handler callback
+        2. bot_handler_errors_total - Exceptions raised by handler callbacks
+        3. bot_conversation_transitions_total - Conversation state transitions, by the state they came from & went to
+        4. bot_api_request_latency_seconds - Histogram of the time taken by Telegram Bot API calls, by method
+        5. bot_api_request_errors_total - Failed Telegram Bot API calls, by method & error
+        6. bot_persistence_flush_seconds - Histogram of the time taken to write a batch of the persistence journal
+        7. bot_persistence_written_bytes_total - Bytes written to the persistence journal
+        8. bot_update_queue_depth - Updates waiting in the dispatcher's update queue
+        9. bot_outbox_pending_deliveries - Notification deliveries waiting in the outbox, registered by run.py
+        10. bot_digest_notifications_total - Notifications sent to a recipient in a digest, in digest mode
+        11. bot_digest_messages_saved_total - Messages not sent to recipients thanks to digests, in digest mode
+
+    Series are looked up once when a callback is wrapped, recording a sample costs a lock and a bisect.
+    See benchmarks/metrics_benchmark.py for the overhead.
+"""
+
+# Import statements
+import time
+import bisect
+import logging
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telegram.ext import ConversationHandler
+
+# Default histogram buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels):
+    """
+    Returns labels in the Prometheus text format, an empty string if there are none
+    """
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+class Counter:
+    """
+    Monotonic counter of a single series
+    """
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield f"{name}{format_labels(labels)} {self.value}"
+
+
+class Histogram:
+    """
+    Histogram of a single series with fixed buckets
+    """
+    __slots__ = ("buckets", "counts", "count", "sum", "_lock")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # The last count is for samples above the highest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+            total = self.sum
+
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            yield f"{name}_bucket{format_labels(dict(labels, le=repr(bound)))} {cumulative}"
+        yield f"{name}_bucket{format_labels(dict(labels, le='+Inf'))} {count}"
+        yield f"{name}_sum{format_labels(labels)} {total}"
+        yield f"{name}_count{format_labels(labels)} {count}"
+
+
+class Gauge:
+    """
+    Gauge of a single series, read from a callback when the metrics are rendered
+    """
+    __slots__ = ("read",)
+
+    def __init__(self, read):
+        self.read = read
+
+    def samples(self, name, labels):
+        yield f"{name}{format_labels(labels)} {self.read()}"
+
+
+class Metric:
+    """
+    A named metric holding one series per combination of label values
+    """
+    def __init__(self, name, kind, description, factory):
+        self.name = name
+        self.kind = kind
+        self.description = description
+        self._factory = factory
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        """
+        Returns the series for the given label values, look it up once and keep it around on hot paths
+        """
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, self._factory())
+        return series
+
+    def render(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            series = list(self._series.items())
+        for key, value in series:
+            yield from value.samples(self.name, dict(key))
+
+
+class Registry:
+    """
+    Collection of metrics, rendered together in the Prometheus text format
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, name, kind, description, factory):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Metric(name, kind, description, factory)
+            return self._metrics[name]
+
+    def counter(self, name, description):
+        return self._register(name, "counter", description, Counter)
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS):
+        return self._register(name, "histogram", description, lambda: Histogram(buckets))
+
+    def gauge(self, name, description, read):
+        metric = self._register(name, "gauge", description, lambda: Gauge(read))
+        metric.labels()
+        return metric
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+class BotMetrics:
+    """
+    Instruments the handlers, Bot API calls & persistence of a bot
+    """
+    def __init__(self, registry=None):
+        self.registry = registry or Registry()
+        self.handler_latency = self.registry.histogram("bot_handler_latency_seconds", "Time taken by handler callbacks")
+        self.handler_errors = self.registry.counter("bot_handler_errors_total", "Exceptions raised by handler callbacks")
+        self.transitions = self.registry.counter("bot_conversation_transitions_total", "Conversation state transitions")
+        self.api_latency = self.registry.histogram("bot_api_request_latency_seconds", "Time taken by Telegram Bot API calls")
+        self.api_errors = self.registry.counter("bot_api_request_errors_total", "Failed Telegram Bot API calls")
+        self.flush_latency = self.registry.histogram("bot_persistence_flush_seconds", "Time taken to write a batch of the persistence journal")
+        self.flush_bytes = self.registry.counter("bot_persistence_written_bytes_total", "Bytes written to the persistence journal")
+        self.digest_notifications = self.registry.counter("bot_digest_notifications_total", "Notifications sent to a recipient in a digest")
+        self.digest_saved = self.registry.counter("bot_digest_messages_saved_total", "Messages not sent to recipients thanks to digests")
+
+        self._server = None
+
+    def wrap_callback(self, callback, handler_name, state=None):
+        """
+        Returns the callback timed, counting errors and the conversation state it returns
+
+        :param callback: type: callable
+        Handler callback
+
+        :param handler_name: type: str
+        Name of the handler in the metric labels
+
+        :param state: type: str or None
+        Conversation state the handler is registered under, None if it is not part of a conversation
+
+        :return: type: callable
+        The instrumented callback
+        """
+        latency = self.handler_latency.labels(handler=handler_name)
+        errors = self.handler_errors.labels(handler=handler_name)
+        transitions = {}
+
+        @functools.wraps(callback)
+        def instrumented(update, context):
+            start = time.perf_counter()
+            try:
+                new_state = callback(update, context)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - start)
+
+            if state is not None:
+                series = transitions.get(new_state)
+                if series is None:
+                    target = "end" if new_state == ConversationHandler.END else ("unchanged" if new_state is None else new_state)
+                    series = transitions[new_state] = self.transitions.labels(handler=handler_name, source=state, target=target)
+                series.inc()
+            return new_state
+
+        instrumented.instrumented = True
+        return instrumented
+
+    def instrument_dispatcher(self, dispatcher):
+        """
+        Wraps the callbacks of every handler registered in the dispatcher, including the handlers inside conversations,
+        and tracks the depth of the update queue
+
+        Call after all handlers are added
+        """
+        for handlers in dispatcher.handlers.values():
+            for handler in handlers:
+                if isinstance(handler, ConversationHandler):
+                    for entry_point in handler.entry_points:
+                        self._instrument_handler(entry_point, state="entry")
+                    for state, state_handlers in handler.states.items():
+                        for state_handler in state_handlers:
+                            self._instrument_handler(state_handler, state=state)
+                    for fallback in handler.fallbacks:
+                        self._instrument_handler(fallback, state="fallback")
+                else:
+                    self._instrument_handler(handler)
+
+        self.registry.gauge("bot_update_queue_depth", "Updates waiting in the dispatcher's update queue", dispatcher.update_queue.qsize)
+
+    def _instrument_handler(self, handler, state=None):
+        # Handlers shared between a conversation and the dispatcher are only wrapped once
+        if getattr(handler.callback, "instrumented", False):
+            return
+        handler.callback = self.wrap_callback(handler.callback, handler.callback.__name__, None if state is None else str(state))
+
+    def instrument_bot(self, bot):
+        """
+        Times every Bot API call made by the bot
+        """
+        request = bot.request
+        post = request.post
+        series = {}
+
+        def instrumented(url, data, timeout=None):
+            method = url.rsplit("/", 1)[-1]
+            latency = series.get(method)
+            if latency is None:
+                latency = series[method] = self.api_latency.labels(method=method)
+            start = time.perf_counter()
+            try:
+                return post(url, data, timeout=timeout)
+            except Exception as error:
+                self.api_errors.labels(method=method, error=type(error).__name__).inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - start)
+
+        request.post = instrumented
+
+    def instrument_persistence(self, persistence):
+        """
+        Times every batch written to a JournalPersistence journal, and counts the bytes written
+        """
+        latency = self.flush_latency.labels()
+        written = self.flush_bytes.labels()
+        write_batch = persistence.write_batch
+
+        def instrumented():
+            start = time.perf_counter()
+            try:
+                size = write_batch()
+            finally:
+                latency.observe(time.perf_counter() - start)
+            written.inc(size)
+            return size
+
+        persistence.write_batch = instrumented
+
+    def instrument_digest(self, digest):
+        """
+        Counts the notifications packed into digests by a digest.DigestPolicy, and the messages it saved
+        """
+        notifications = self.digest_notifications.labels()
+        saved = self.digest_saved.labels()
+        pack = digest.pack
+
+        def instrumented(held):
+            messages = pack(held)
+            notifications.inc(len(held))
+            saved.inc(sum(len(message) for message in held) - len(messages))
+            return messages
+
+        digest.pack = instrumented
+
+    def serve(self, port, listen="127.0.0.1"):
+        """
+        Serves the metrics on http://{listen}:{port}/metrics in a background thread
+        """
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((listen, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        logging.info("Info: Serving metrics on http://%s:%s/metrics", listen, port)
+
+    def shutdown(self):
+        """
+        Stops serving the metrics
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,241 @@
+"""
+    Durable outbox for notifications
+
+    A notification is saved as one delivery row per recipient, in the same transaction as the fault change it is about,
+    so a fault can never be saved without its notifications or the other way round. A background thread drains the
+    pending deliveries in batches through the fan-out engine, and keeps a record of who was notified and when.
+
+    Deliveries that fail are retried with exponential backoff, up to max_attempts. Deliveries still pending when the
+    process stops are replayed when it starts again. A delivery is only marked as sent once Telegram accepted it, so a
+    crash in between sends it again (at least once).
+
+    In digest mode, deliveries to the recipients holding digests are saved as due at the end of the digest window, and
+    sent together with every other delivery held for the same recipient, see digest.py.
+"""
+
+# Import statements
+import json
+import time
+import logging
+import threading
+from fanout import SENT, UNREACHABLE
+
+# Delivery statuses in the outbox, on top of fanout.SENT & fanout.UNREACHABLE
+PENDING = "pending"
+FAILED = "failed"
+
+# Tables of the outbox, created in the fault store
+OUTBOX_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, description TEXT NOT NULL, "
+    "messages TEXT NOT NULL, fault_id INTEGER, created_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS outbox_deliveries (id INTEGER PRIMARY KEY AUTOINCREMENT, notification_id INTEGER NOT NULL, "
+    "chat_id TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+    "next_attempt_at REAL NOT NULL, sent_at REAL, error TEXT, digest INTEGER NOT NULL DEFAULT 0)",
+    "CREATE INDEX IF NOT EXISTS idx_outbox_deliveries_pending ON outbox_deliveries (status, next_attempt_at)",
+)
+
+# Index of the deliveries held for the digest of every recipient, created once outbox_deliveries has the digest column
+DIGEST_INDEX = "CREATE INDEX IF NOT EXISTS idx_outbox_deliveries_digest ON outbox_deliveries (chat_id, status, digest)"
+
+
+class Outbox:
+    """
+    Outbox in the fault store, drained by a background thread
+    """
+    def __init__(self, store, deliver, batch_size=100, max_attempts=8, retry_delay=5.0, poll_interval=0.5, is_active=None, digest=None):
+        """
+        :param store: type: fault_store.SQLiteFaultStore
+        Store holding the outbox
+
+        :param deliver: type: callable
+        Called with (chat_ids, messages, description) of a notification, returns a fanout.FanOutReport holding every chat id
+
+        :param batch_size: type: int
+        Max deliveries taken from the outbox at a time
+
+        :param max_attempts: type: int
+        Attempts before a delivery is given up on
+
+        :param retry_delay: type: float
+        Seconds before the first retry of a failed delivery, doubled after every attempt
+
+        :param poll_interval: type: float
+        Seconds between checks of the outbox when it was not woken up
+
+        :param is_active: type: callable or None
+        Returns whether this process should drain the outbox, e.g. only the leader of several processes (Defaults to always)
+
+        :param digest: type: digest.DigestPolicy or None
+        Holds deliveries for digests (Defaults to sending every notification right away)
+        """
+        self.store = store
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.is_active = is_active or (lambda: True)
+        self.digest = digest
+
+        with store.transaction() as connection:
+            for statement in OUTBOX_SCHEMA:
+                connection.execute(statement)
+            # Outboxes created by earlier versions have no digest column yet
+            if "digest" not in {row["name"] for row in connection.execute("PRAGMA table_info(outbox_deliveries)")}:
+                connection.execute("ALTER TABLE outbox_deliveries ADD COLUMN digest INTEGER NOT NULL DEFAULT 0")
+            connection.execute(DIGEST_INDEX)
+
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def enqueue(self, connection, chat_ids, messages, description, fault_id=None, urgent=False):
+        """
+        Saves a notification for every recipient, inside the transaction of the caller
+
+        :param connection: type: sqlite3.Connection
+        Connection of the fault store transaction the notification belongs to
+
+        :param chat_ids: type: list
+        Chat ids of the recipients
+
+        :param messages: type: list
+        Keyword arguments for telegram.Bot.send_message, send_photo or send_document (excluding chat_id) of every message, sent in order
+
+        :param description: type: str
+        Description of the notification for logging
+
+        :param fault_id: type: int or None
+        Fault the notification is about
+
+        :param urgent: type: bool
+        Whether the notification is sent right away in digest mode too
+
+        :return: type: int
+        Id of the notification
+        """
+        now = time.time()
+        notification_id = connection.execute("INSERT INTO outbox (description, messages, fault_id, created_at) VALUES (?, ?, ?, ?)",
+                                             (description, json.dumps(messages), fault_id, now)).lastrowid
+        deliveries = []
+        for chat_id in chat_ids:
+            if self.digest is not None and not urgent and self.digest.holds(chat_id):
+                # Sent with the digest of the recipient, at the latest once the window is over
+                deliveries.append((notification_id, str(chat_id), now + self.digest.window, 1))
+            else:
+                deliveries.append((notification_id, str(chat_id), now, 0))
+        connection.executemany("INSERT INTO outbox_deliveries (notification_id, chat_id, next_attempt_at, digest) VALUES (?, ?, ?, ?)",
+                               deliveries)
+        # The drainer waits for the store lock, so it only sees the notification once the transaction is committed
+        self._wake.set()
+        return notification_id
+
+    def pending_count(self):
+        """
+        Returns the number of deliveries still to be made
+        """
+        return self.store.execute("SELECT COUNT(*) FROM outbox_deliveries WHERE status = ?", (PENDING,))[0][0]
+
+    def start(self):
+        """
+        Starts draining the outbox, replaying the deliveries left pending by an earlier run
+        """
+        pending = self.pending_count()
+        if pending:
+            logging.info("Outbox: Replaying %s pending deliveries", pending)
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops draining after the batch in progress, pending deliveries are replayed on the next start
+        """
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            drained = 0
+            if self.is_active():
+                try:
+                    drained = self.drain()
+                except Exception:
+                    logging.exception("Outbox: Draining failed")
+            if not drained:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def drain(self):
+        """
+        Delivers a single batch of due deliveries, notification by notification in the order they were saved
+
+        :return: type: int
+        Number of deliveries attempted
+        """
+        rows = self.store.execute("SELECT outbox_deliveries.id, notification_id, chat_id, attempts, digest, description, messages "
+                                  "FROM outbox_deliveries JOIN outbox ON outbox.id = outbox_deliveries.notification_id "
+                                  "WHERE status = ? AND next_attempt_at <= ? ORDER BY outbox_deliveries.id LIMIT ?",
+                                  (PENDING, time.time(), self.batch_size))
+
+        notifications = {}
+        digests = []
+        for row in rows:
+            if row["digest"]:
+                if row["chat_id"] not in digests:
+                    digests.append(row["chat_id"])
+            else:
+                notifications.setdefault(row["notification_id"], []).append(row)
+
+        attempted = 0
+        for deliveries in notifications.values():
+            description = deliveries[0]["description"]
+            report = self.deliver([row["chat_id"] for row in deliveries], json.loads(deliveries[0]["messages"]), description)
+            self._record(deliveries, report, description)
+            attempted += len(deliveries)
+
+        for chat_id in digests:
+            attempted += self._send_digest(chat_id)
+
+        return attempted
+
+    def _send_digest(self, chat_id):
+        """
+        Sends every delivery held for the digest of a recipient at once, including those whose window is not over yet
+
+        :return: type: int
+        Number of deliveries attempted
+        """
+        deliveries = self.store.execute("SELECT outbox_deliveries.id, chat_id, attempts, messages "
+                                        "FROM outbox_deliveries JOIN outbox ON outbox.id = outbox_deliveries.notification_id "
+                                        "WHERE chat_id = ? AND status = ? AND digest = 1 ORDER BY outbox_deliveries.id",
+                                        (chat_id, PENDING))
+        if not deliveries:
+            return 0
+
+        description = f"digest of {len(deliveries)} notifications"
+        report = self.deliver([chat_id], self.digest.pack([json.loads(row["messages"]) for row in deliveries]), description)
+        self._record(deliveries, report, description)
+        return len(deliveries)
+
+    def _record(self, deliveries, report, description):
+        """
+        Saves the outcome of the deliveries of a notification or digest, scheduling a retry of those that failed
+        """
+        now = time.time()
+        updates = []
+        for row in deliveries:
+            result = report.results[row["chat_id"]]
+            attempts = row["attempts"] + 1
+            if result.status in (SENT, UNREACHABLE):
+                updates.append((result.status, attempts, now, now if result.status == SENT else None, None, row["id"]))
+            elif attempts >= self.max_attempts:
+                logging.error("Outbox: Gave up on %s to chat: %s after %s attempts", description, row["chat_id"], attempts)
+                updates.append((FAILED, attempts, now, None, str(result.error), row["id"]))
+            else:
+                updates.append((PENDING, attempts, now + self.retry_delay * 2 ** (attempts - 1), None, str(result.error), row["id"]))
+
+        with self.store.transaction() as connection:
+            connection.executemany("UPDATE outbox_deliveries SET status = ?, attempts = ?, next_attempt_at = ?, sent_at = ?, error = ? "
+                                   "WHERE id = ?", updates)
@@ -0,0 +1,214 @@
+"""
+    Pagination engine for sending long lists of records over multiple messages
+
+    Records are packed into pages of at most 4096 characters (Telegram's max message length) in a single pass over their
+    rendered lengths. Only the page boundaries (the record keys of every page) are cached per view, pages are rendered on
+    demand when they are requested, and the boundaries are only rebuilt when the revision of the underlying data changes.
+"""
+
+# Import statements
+import threading
+from collections import OrderedDict
+
+# Max characters in a single Telegram message
+MAX_MESSAGE_LENGTH = 4096
+
+# Separator between records on the same page
+SEPARATOR = "\n\n\n"
+
+
+def paginate(lengths, max_length=MAX_MESSAGE_LENGTH, separator_length=len(SEPARATOR)):
+    """
+    Packs records into pages in a single pass, keeping a running length of the current page
+
+    A record longer than max_length on its own is given a page of its own
+
+    :param lengths: type: iterable
+    Rendered length of every record, in display order
+
+    :param max_length: type: int
+    Max characters per page, separators included
+
+    :param separator_length: type: int
+    Length of the separator placed between records on the same page
+
+    :return: type: list
+    (start, end) index bounds of every page, end exclusive
+    """
+    bounds = []
+    start = 0
+    page_length = 0
+    index = -1
+    for index, length in enumerate(lengths):
+        if index > start and page_length + separator_length + length > max_length:
+            # Record does not fit, close the current page
+            bounds.append((start, index))
+            start = index
+            page_length = length
+        elif index == start:
+            page_length = length
+        else:
+            page_length += separator_length + length
+
+    if index >= start:
+        bounds.append((start, index + 1))
+
+    return bounds
+
+
+class PageView:
+    """
+    Page boundaries of a single view, built from the data at a given revision
+    """
+    __slots__ = ("name", "revision", "keys", "bounds")
+
+    def __init__(self, name, revision, keys, bounds):
+        self.name = name
+        self.revision = revision
+        self.keys = keys
+        self.bounds = bounds
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def page_keys(self, page):
+        """
+        Returns the keys of the records on a page
+
+        :param page: type: int
+        Index of the page, clamped into the available pages
+
+        :return: type: list
+        Keys of the records on the page, in display order
+        """
+        start, end = self.bounds[self.clamp(page)]
+        return self.keys[start:end]
+
+    def clamp(self, page):
+        """
+        Clamps a page index into the available pages, a view may have shrunk since a page was requested
+        """
+        return max(0, min(page, len(self.bounds) - 1))
+
+
+class ChainedPageView:
+    """
+    Pages of several views shown one after the other under a single name
+
+    Every view keeps its own revision, so a view whose data rarely changes is not rebuilt along with the others.
+    Pages never span two views.
+    """
+    __slots__ = ("name", "revision", "views")
+
+    def __init__(self, name, views):
+        self.name = name
+        self.views = views
+        self.revision = tuple(view.revision for view in views)
+
+    def __len__(self):
+        return sum(len(view) for view in self.views)
+
+    def page_keys(self, page):
+        """
+        Returns the keys of the records on a page, see PageView.page_keys
+        """
+        page = self.clamp(page)
+        for view in self.views:
+            if page < len(view):
+                return view.page_keys(page)
+            page -= len(view)
+        return []
+
+    def clamp(self, page):
+        """
+        Clamps a page index into the available pages, a view may have shrunk since a page was requested
+        """
+        return max(0, min(page, len(self) - 1))
+
+
+class Paginator:
+    """
+    Caches the page boundaries of multiple views, rebuilding a view only when its revision changes
+    """
+    def __init__(self, max_length=MAX_MESSAGE_LENGTH, separator=SEPARATOR, max_views=64):
+        """
+        :param max_length: type: int
+        Max characters per page
+
+        :param separator: type: str
+        Separator between records on the same page
+
+        :param max_views: type: int
+        Max views kept in the cache, least recently used views are evicted first
+        """
+        self.max_length = max_length
+        self.separator = separator
+        self.max_views = max_views
+
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_view(self, name, revision, build):
+        """
+        Returns the page boundaries of a view, building them if the cached view is missing or outdated
+
+        :param name: type: str
+        Name of the view
+
+        :param revision: type: hashable
+        Revision of the underlying data, the cached view is rebuilt when it changes
+
+        :param build: type: callable
+        Returns an iterable of (key, rendered record) pairs in display order, only called when the view is (re)built
+
+        :return: type: PageView
+        Page boundaries of the view
+        """
+        with self._lock:
+            view = self._views.get(name)
+            if view is not None and view.revision == revision:
+                self._views.move_to_end(name)
+                return view
+
+        keys = []
+        lengths = []
+        for key, text in build():
+            keys.append(key)
+            lengths.append(len(text))
+        view = PageView(name, revision, keys, paginate(lengths, self.max_length, len(self.separator)))
+
+        with self._lock:
+            self._views[name] = view
+            self._views.move_to_end(name)
+            while len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+
+        return view
+
+    def render_page(self, view, page, render):
+        """
+        Renders a single page of a view
+
+        :param view: type: PageView
+        View the page belongs to
+
+        :param page: type: int
+        Index of the page
+
+        :param render: type: callable
+        Returns the rendered records for a list of keys, in the same order
+
+        :return: type: str
+        The page, records joined by the separator
+        """
+        return self.separator.join(render(view.page_keys(page)))
+
+    def invalidate(self, name=None):
+        """
+        Drops a cached view, or every view if no name is given
+        """
+        with self._lock:
+            if name is None:
+                self._views.clear()
+            else:
+                self._views.pop(name, None)
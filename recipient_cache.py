@@ -0,0 +1,165 @@
+"""
+    Recipient directory caching the chat metadata of recipients
+
+    Looking up a recipient's first name used to cost a get_chat round-trip per recipient for every notification.
+    The directory keeps the metadata in an LRU cache with a TTL, refreshes expired entries in the background,
+    and remembers chats that cannot be reached so that they are skipped without a network call until their entry expires.
+"""
+
+# Import statements
+import time
+import logging
+import threading
+import telegram
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _Entry:
+    """
+    Cached metadata of a single chat
+    """
+    __slots__ = ("first_name", "unreachable", "expires_at")
+
+    def __init__(self, first_name, unreachable, expires_at):
+        self.first_name = first_name
+        self.unreachable = unreachable
+        self.expires_at = expires_at
+
+
+class RecipientDirectory:
+    """
+    LRU cache of recipient chat metadata keyed by chat id, entries expire after a TTL
+    """
+    def __init__(self, bot, ttl=3600, max_size=1024):
+        """
+        :param bot: type: telegram.Bot
+        Bot used to look up the chats
+
+        :param ttl: type: float
+        Seconds before a cached entry has to be refreshed
+
+        :param max_size: type: int
+        Max chats kept in the cache, least recently used chats are evicted first
+        """
+        self.bot = bot
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recipient_directory")
+
+    def _store(self, chat_id, first_name, unreachable):
+        with self._lock:
+            self._entries[chat_id] = _Entry(first_name, unreachable, time.monotonic() + self.ttl)
+            self._entries.move_to_end(chat_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _refresh(self, chat_id):
+        """
+        Looks up a single chat and caches the outcome
+        """
+        try:
+            first_name = self.bot.get_chat(chat_id).first_name
+            self._store(chat_id, first_name, unreachable=False)
+        except telegram.error.BadRequest:
+            # User have not initialize a chat with bot yet
+            self._store(chat_id, None, unreachable=True)
+        except telegram.error.TelegramError as error:
+            logging.warning("Unable to look up chat: %s, Error: %s", chat_id, error)
+        finally:
+            with self._lock:
+                self._refreshing.discard(chat_id)
+
+    def _schedule_refresh(self, chat_id):
+        with self._lock:
+            if chat_id in self._refreshing:
+                return
+            self._refreshing.add(chat_id)
+        self._executor.submit(self._refresh, chat_id)
+
+    def _lookup(self, chat_id):
+        """
+        Returns the cached entry of a chat, counting hits & misses
+
+        Expired entries are still returned but get refreshed in the background, missing entries are fetched in the background
+
+        :return: type: _Entry or None
+        The cached entry, None if the chat is not cached yet
+        """
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(chat_id)
+
+        if entry is None or entry.expires_at <= time.monotonic():
+            self._schedule_refresh(chat_id)
+
+        return entry
+
+    def warm(self, chat_ids):
+        """
+        Fetches the metadata of the given chats in the background
+
+        :param chat_ids: type: list
+        Chat ids to look up
+        """
+        for chat_id in chat_ids:
+            self._schedule_refresh(chat_id)
+
+    def get_first_name(self, chat_id):
+        """
+        Returns the cached first name of a chat
+
+        :param chat_id: type: str or int
+        Chat id of the recipient
+
+        :return: type: str or None
+        First name of the chat, None if it is not known yet
+        """
+        entry = self._lookup(chat_id)
+        return entry.first_name if entry else None
+
+    def is_unreachable(self, chat_id):
+        """
+        Checks if a chat is known to be unreachable, without making a network call
+
+        :param chat_id: type: str or int
+        Chat id of the recipient
+
+        :return: type: bool
+        True if looking up or sending to the chat raised BadRequest and the entry has not expired yet
+        """
+        with self._lock:
+            entry = self._entries.get(chat_id)
+        return bool(entry and entry.unreachable and entry.expires_at > time.monotonic())
+
+    def mark_unreachable(self, chat_id):
+        """
+        Remembers a chat that raised BadRequest so it can be skipped until its entry expires
+        """
+        self._store(chat_id, None, unreachable=True)
+
+    def stats(self):
+        """
+        Returns the cache counters
+
+        :return: type: dict
+        Hits, misses & amount of chats cached
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def shutdown(self):
+        """
+        Stops the background refresh thread
+        """
+        self._executor.shutdown(wait=False)
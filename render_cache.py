@@ -0,0 +1,72 @@
+"""
+    Render cache for fault messages
+
+    Faults are stored as raw fields and rendered into MarkdownV2 on demand. Rendering escapes every field, so the rendered
+    messages are memoized in an LRU cache keyed by (fault id, revision). A fault that is updated gets a new revision,
+    which makes its stale rendering unreachable until it is evicted.
+"""
+
+# Import statements
+import threading
+from collections import OrderedDict
+
+
+class RenderCache:
+    """
+    Thread-safe LRU cache of rendered faults
+    """
+    def __init__(self, render, max_size=4096):
+        """
+        :param render: type: callable
+        Renders a fault_store.Fault into a str
+
+        :param max_size: type: int
+        Max rendered faults kept in the cache, least recently used faults are evicted first
+        """
+        self.render = render
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fault):
+        """
+        Returns the rendered fault, rendering it if it is not cached yet
+
+        :param fault: type: fault_store.Fault
+        Fault to render
+
+        :return: type: str
+        The rendered fault
+        """
+        key = (fault.id, fault.revision)
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return text
+            self.misses += 1
+
+        # Render outside of the lock, rendering the same fault twice is harmless
+        text = self.render(fault)
+
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return text
+
+    def stats(self):
+        """
+        Returns the cache counters
+
+        :return: type: dict
+        Hits, misses & amount of faults cached
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
@@ -0,0 +1,310 @@
+"""
+    Routing of fault notifications to groups of recipients
+
+    Without routing, every fault is sent to everyone in the recipient list. A rules file sends a fault only to the groups
+    of recipients whose rules match its type & location:
+        {
+            "groups": {"plumbing": [1001, 1002], "electrical": [1003], "block_12": [1004]},
+            "rules": [
+                {"type": ["leak", "tap", "pipe"], "groups": ["plumbing"]},
+                {"type": ["light", "socket", "air con"], "groups": ["electrical"]},
+                {"blocks": ["12", "12A"], "groups": ["block_12"]},
+                {"type": ["flood"], "location": ["switch room"], "groups": ["plumbing", "electrical"]}
+            ],
+            "default": ["plumbing", "electrical"]
+        }
+
+    A rule matches when every field it lists matches:
+        1. type & location - Any of the keywords starts a word of the field, case insensitive like /search
+        2. blocks - Any of the blocks is among the block numbers found in the location, e.g. "Blk 12", "block 12A"
+
+    A fault goes to the groups of every matching rule, or to the default groups when no rule matches. Faults go to
+    everyone in the recipient list when there is no default.
+
+    Keywords of all rules are compiled into one Aho-Corasick automaton per field, and blocks into a dict, so routing a
+    fault takes time linear in the length of its type & location whatever the number of rules.
+    See benchmarks/routing_benchmark.py.
+
+    The rules file is checked for changes at most every check_interval seconds and reloaded without a restart. A file
+    that fails to load is logged and the previous rules are kept.
+"""
+
+# Import statements
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+# Block numbers in the location of a fault, e.g. "Blk 12", "block 12A", "Blk12"
+BLOCK_PATTERN = re.compile(r'\b(?:blk|block)\s*\.?\s*#?\s*(\d+[a-z]?)\b', re.IGNORECASE)
+
+# Fields of a rule matched against the fault
+KEYWORD_FIELDS = ("type", "location")
+
+
+def parse_blocks(location):
+    """
+    Returns the block numbers found in the location of a fault, in lower case
+    """
+    return {block.lower() for block in BLOCK_PATTERN.findall(location or "")}
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton finding the keywords that start a word of a text, in a single pass over the text
+    """
+    def __init__(self, keywords):
+        """
+        :param keywords: type: dict
+        Value returned for every keyword, keywords are matched in lower case
+        """
+        # Transitions, failure link & (keyword length, value) of the keywords ending at every node
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+
+        for keyword, value in keywords.items():
+            node = 0
+            for char in keyword.lower():
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = self._goto[node][char] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                node = child
+            self._output[node] += ((len(keyword), value),)
+
+        # Breadth first, so the failure link of a node's parent is known before the node
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0) if node else 0
+                self._output[child] += self._output[self._fail[child]]
+
+    def __len__(self):
+        return len(self._goto)
+
+    def match(self, text):
+        """
+        Yields the value of every keyword starting a word of the text, once per occurrence
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        text = text.lower()
+        node = 0
+        for end, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, value in output[node]:
+                start = end - length + 1
+                if start == 0 or not text[start - 1].isalnum():
+                    yield value
+
+
+class RoutingRules:
+    """
+    Rules of a rules file, compiled for routing
+    """
+    def __init__(self, config, everyone):
+        """
+        :param config: type: dict
+        Contents of the rules file, see the module docstring
+
+        :param everyone: type: list
+        Chat ids of every recipient, notified when no rule matches and there is no default
+
+        :raises ValueError: if the rules are invalid
+        """
+        if not isinstance(config, dict):
+            raise ValueError("Routing rules must be a JSON object")
+        groups = config.get("groups", {})
+        if not isinstance(groups, dict):
+            raise ValueError("groups must map group names to lists of chat ids")
+        self.groups = {name: [str(chat_id) for chat_id in members] for name, members in groups.items()}
+
+        def resolve(names, where):
+            if not isinstance(names, list) or not names:
+                raise ValueError(f"{where} must list at least 1 group")
+            unknown = [name for name in names if name not in self.groups]
+            if unknown:
+                raise ValueError(f"{where} refers to unknown groups: {', '.join(map(str, unknown))}")
+            return tuple(names)
+
+        # Rules are numbered by their position, matched keywords & blocks map to the numbers of their rules
+        self.rule_groups = []
+        self.required = []
+        keywords = {field: {} for field in KEYWORD_FIELDS}
+        self.blocks = {}
+        for number, rule in enumerate(config.get("rules", [])):
+            where = f"Rule {number + 1}"
+            if not isinstance(rule, dict):
+                raise ValueError(f"{where} must be a JSON object")
+            for field in KEYWORD_FIELDS + ("blocks",):
+                if field in rule and not isinstance(rule[field], list):
+                    raise ValueError(f"{where} must list the {field} it matches")
+            fields = 0
+            for field in KEYWORD_FIELDS:
+                if field in rule:
+                    for keyword in rule[field]:
+                        keyword = str(keyword).strip().lower()
+                        if not keyword:
+                            raise ValueError(f"{where} has an empty {field} keyword")
+                        keywords[field].setdefault(keyword, set()).add(number)
+                    fields += 1
+            if "blocks" in rule:
+                for block in rule["blocks"]:
+                    self.blocks.setdefault(str(block).strip().lower(), set()).add(number)
+                fields += 1
+            if not fields:
+                raise ValueError(f"{where} must match on type, location or blocks")
+            self.rule_groups.append(resolve(rule.get("groups"), where))
+            self.required.append(fields)
+
+        self.matchers = {field: KeywordMatcher({keyword: frozenset(rules) for keyword, rules in field_keywords.items()})
+                         for field, field_keywords in keywords.items()}
+        self.default = resolve(config["default"], "default") if "default" in config else None
+        self.everyone = [str(chat_id) for chat_id in everyone]
+
+    def __len__(self):
+        return len(self.rule_groups)
+
+    def matching_rules(self, type_of_fault, location):
+        """
+        Returns the numbers of the rules matching a fault
+        """
+        # Number of fields of every rule matched so far
+        matched = {}
+        for field, text in (("type", type_of_fault), ("location", location)):
+            field_rules = set()
+            for rules in self.matchers[field].match(text or ""):
+                field_rules |= rules
+            for number in field_rules:
+                matched[number] = matched.get(number, 0) + 1
+        if self.blocks:
+            block_rules = set()
+            for block in parse_blocks(location):
+                block_rules |= self.blocks.get(block, set())
+            for number in block_rules:
+                matched[number] = matched.get(number, 0) + 1
+        return sorted(number for number, fields in matched.items() if fields == self.required[number])
+
+    def route(self, type_of_fault, location):
+        """
+        Returns the chat ids of the recipients of a fault, in the order they are listed
+        """
+        rules = self.matching_rules(type_of_fault, location)
+        if rules:
+            names = [name for number in rules for name in self.rule_groups[number]]
+        elif self.default is not None:
+            names = self.default
+        else:
+            return list(self.everyone)
+        return list(dict.fromkeys(chat_id for name in names for chat_id in self.groups[name]))
+
+
+class RecipientRouter:
+    """
+    Routes faults to recipients with the rules of a rules file, reloaded when the file changes
+    """
+    def __init__(self, filename, everyone, check_interval=5.0):
+        """
+        :param filename: type: str or None
+        Filename of the rules file, None to send every fault to everyone
+
+        :param everyone: type: list
+        Chat ids of every recipient
+
+        :param check_interval: type: float
+        Min seconds between checks of the rules file for changes
+
+        :raises ValueError: if the rules file cannot be loaded
+        """
+        self.filename = filename
+        self.everyone = list(everyone)
+        self.check_interval = check_interval
+        self.rules = None
+        self.reloads = 0
+
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+        if filename is not None:
+            self._load()
+
+    def _stat(self):
+        stat = os.stat(self.filename)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        """
+        Loads & compiles the rules file
+
+        :raises ValueError: if the rules file cannot be loaded
+        """
+        try:
+            signature = self._stat()
+            with open(self.filename, encoding="utf-8") as file:
+                config = json.load(file)
+        except (OSError, ValueError) as error:
+            raise ValueError(f"Unable to load routing rules from {self.filename}: {error}")
+
+        start = time.perf_counter()
+        self.rules = RoutingRules(config, self.everyone)
+        self._signature = signature
+        logging.info("Routing: Loaded %s rules & %s groups from %s in %.3fs", len(self.rules), len(self.rules.groups),
+                     self.filename, time.perf_counter() - start)
+
+    def reload(self):
+        """
+        Reloads the rules file if it changed since it was loaded, the previous rules are kept if it fails to load
+
+        :return: type: bool
+        True if the rules were reloaded
+        """
+        if self.filename is None:
+            return False
+        with self._lock:
+            self._checked_at = time.monotonic()
+            signature = None
+            try:
+                signature = self._stat()
+                if signature == self._signature:
+                    return False
+                self._load()
+            except (OSError, ValueError) as error:
+                # Logged once per change of the file, rather than at every check
+                if signature != self._signature:
+                    logging.error("Routing: %s, keeping the previous rules", error)
+                    self._signature = signature
+                return False
+            self.reloads += 1
+            return True
+
+    def route(self, type_of_fault, location):
+        """
+        Returns the chat ids of the recipients of a fault
+
+        :param type_of_fault: type: str
+        Type of the fault
+
+        :param location: type: str
+        Location of the fault
+
+        :return: type: list
+        Chat ids of the recipients
+        """
+        if self.filename is None:
+            return list(self.everyone)
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload()
+        return self.rules.route(type_of_fault, location)
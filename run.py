@@ -14,35 +14,138 @@
     Bot commands:
         1. /history
         2. /start
-        3. /resolved {fault_id}
+        3. /resolved {fault_id} [{fault_id} | {first}-{last} ...]
+        4. /search {terms} (Archived faults are not searched, see /history resolved)
+        5. /export [csv|jsonl]
 
     Requires an environment file with the following variables:
         1. bot_token - API token of the bot, can be created via @BotFather
         2. recipient_list - Telegram chat id for users who want to be notified by the bot for new faults (Separated by comma for multiple users)
+
+    Optional environment variables:
+        1. fault_db - Filename of the SQLite fault store (Defaults to faults.db)
+        2. fanout_workers - Max recipients notified at the same time (Defaults to 8)
+        3. recipient_cache_ttl - Seconds before cached recipient chat details are refreshed (Defaults to 3600)
+        4. fault_id_block_size - Number of fault ids reserved at a time, raise when running multiple processes on one fault store (Defaults to 1)
+        5. render_cache_size - Max rendered fault messages kept in memory (Defaults to 4096)
+        6. update_workers - Worker threads for handlers that run asynchronously (Defaults to 4)
+        7. webhook_url - Public URL Telegram posts updates to, required in webhook mode
+        8. webhook_secret - Secret token Telegram sends along with every update, required in webhook mode
+        9. webhook_listen - Address the webhook server listens on (Defaults to 0.0.0.0)
+        10. webhook_port - Port the webhook server listens on (Defaults to 8443)
+        11. log_level - Level of the records logged (Defaults to INFO)
+        12. log_max_bytes - Size in bytes record.log is rotated at (Defaults to 10485760)
+        13. log_rotate_interval - Seconds after which record.log is rotated (Defaults to never)
+        14. log_json - Filename of an additional JSON lines log with user_id, action & fault_id fields (Defaults to disabled)
+        15. bot_api_url - Base URL of the Bot API, e.g. a local stand-in for load testing (Defaults to https://api.telegram.org/bot)
+        16. metrics_port - Port of the local /metrics endpoint, served on 127.0.0.1, plus shard_index when running as several processes (Defaults to disabled)
+        17. archive_after_days - Days after being resolved that faults are moved into the archive (Defaults to never)
+        18. archive_dir - Directory of the archive segment files (Defaults to archive)
+        19. input_limits - Min & max characters of the type, description & location of a fault, e.g. type=5-100,location=5-200 (Defaults to 5-499 each)
+        20. shard_count - Number of processes sharing the fault store, see cluster.py (Defaults to 1)
+        21. shard_index - Index of this process among the shards, from 0 to shard_count - 1 (Defaults to 0)
+        22. leader_lease_ttl - Seconds before another shard takes over from a leader that stopped renewing its lease (Defaults to 15)
+        23. persistence_flush_interval - Seconds between batched writes of the conversation data journal, 0 writes every change right away (Defaults to 1)
+        24. draft_ttl - Seconds without a reply before a fault being reported is dropped (Defaults to 86400)
+        25. routing_rules - Filename of the JSON rules routing faults to groups of recipients by type & location, reloaded when it changes, see routing.py (Defaults to every fault going to everyone in recipient_list)
+        26. sla_tiers - Seconds after being reported that active faults are escalated at & to whom, e.g. 14400=recipients,86400=escalation, see escalation.py (Defaults to never)
+        27. escalation_list - Telegram chat id for users who are notified of faults escalated to escalation (Separated by comma for multiple users)
+        28. escalation_interval - Seconds between checks for faults due for escalation (Defaults to 60)
+        29. attachment_dir - Directory the photos & documents attached to faults are kept in, see attachments.py (Defaults to attachments)
+        30. attachment_max_bytes - Max size of an attachment in bytes (Defaults to 20971520, the most the Bot API lets bots download)
+        31. duplicate_threshold - Min similarity, from 0 to 1, of an active fault shown to a reporter as a likely duplicate of their fault, see duplicates.py (Defaults to 0.15)
+        32. digest_window - Seconds notifications to a recipient are held for & sent together as a digest, see digest.py (Defaults to disabled, every notification sent right away)
+        33. digest_recipients - Telegram chat id for users who get digests in digest mode (Separated by comma for multiple users, Defaults to everyone)
+        34. digest_urgent - Keywords of the types of faults that are never held for a digest, e.g. fire,gas leak,flood (Separated by comma)
+
+    Usage:
+        python run.py [--mode polling|webhook]
+
+        # Several processes on one machine, one per shard
+        shard_count=3 shard_index=0 python run.py
+
+        # Embedded, importing the module has no side effects
+        import run
+        updater = run.create_app()
+        run.add_handlers()
 """
 
 # Import statements
+# telegram, pytz & the modules built on them are imported once the bot is created, see create_app
 import os
 import re
-import telegram
-from pytz import timezone
+import time
+import atexit
+import hashlib
+import argparse
+import tempfile
+import threading
+import urllib.parse
 import logging
 import datetime
-from telegram.ext import CommandHandler, MessageHandler, Updater, Filters, ConversationHandler, PicklePersistence
-from telegram.utils.helpers import escape_markdown
-
-# Initialize logging
-# Define timezone
-tz = timezone('Asia/Singapore')
-logging.Formatter.converter = lambda *args: datetime.datetime.now(tz).timetuple()
-
-# Modify root logger
-logging_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-datefmt = '%d/%m/%Y, %H:%M:%S'
-handlers = [logging.FileHandler('record.log', mode='a'), logging.StreamHandler()]
-level = logging.INFO
-
-logging.basicConfig(handlers=handlers, format=logging_format, datefmt=datefmt, level=logging.INFO)
+from collections import OrderedDict
+from fault_store import SQLiteFaultStore, migrate_from_pickle, ACTIVE, RESOLVED
+from fault_archive import FaultArchive, TieredFaultStore
+from id_allocator import FaultIdAllocator
+from pagination import Paginator, ChainedPageView, paginate, MAX_MESSAGE_LENGTH
+from render_cache import RenderCache
+from log_pipeline import setup_logging, UserDetails
+from fault_draft import get_draft, expire_drafts, DRAFT_KEY, DEFAULT_DRAFT_TTL
+from routing import RecipientRouter
+from escalation import ESCALATION, format_duration
+
+# Objects of the bot, built from the environment variables by create_app()
+# Shard of this process, logs & conversation state are kept per shard
+shard_count = 1
+shard_index = 0
+tz = None
+log_listener = None
+fault_store = None
+fault_id_allocator = None
+persistence = None
+updater = None
+dispatcher = None
+bot_metrics = None
+recipient_list = None
+recipient_ids = None
+recipient_router = None
+escalation_list = None
+escalations = None
+attachment_store = None
+duplicate_index = None
+digest_policy = None
+fan_out = None
+recipient_directory = None
+outbox = None
+input_limits = None
+draft_ttl = DEFAULT_DRAFT_TTL
+fault_renderer = None
+
+# How updates are received, set by main()
+mode = "polling"
+
+# Initialize paginator for caching the page boundaries of the fault history & search results
+fault_paginator = Paginator()
+
+# Recent searches, keyed by the hash found in the callback data of their Prev/Next buttons
+search_queries = OrderedDict()
+search_queries_lock = threading.Lock()
+
+# Attachments still being downloaded, keyed by the user id of their reporter
+attachments_in_progress = {}
+attachments_in_progress_lock = threading.Lock()
+
+# Runtime of this shard when running as several processes, set by main()
+cluster = None
+
+# Max fault ids covered by a single /resolved command, ranges included
+MAX_RESOLVED_FAULTS = 1000
+
+# Max photos & documents attached to a single fault
+MAX_ATTACHMENTS = 10
+
+# Sent after /search results that may be missing archived faults
+ARCHIVED_SEARCH_NOTE = "Faults resolved long ago are archived and not searched, they are still listed in /history resolved"
 
 
 # Define custom error exception class
@@ -63,8 +166,55 @@ def display_user_details(update):
     :return: type: str
     Formatted user details (First name, last name & username)
     """
-    response = f'*Name:* [{escape_markdown(text=update.effective_user.first_name, version=2)} {escape_markdown(text=update.effective_user.last_name, version=2) if update.effective_user.last_name else ""}](tg://user?id={update.effective_user.id})'\
-               f'{f", *Username:* [{escape_markdown(text=update.effective_user.username, version=2)}](https://t.me/{update.effective_user.username})" if update.effective_user.username else ""}'
+    return format_user_details(update.effective_user.id, update.effective_user.first_name, update.effective_user.last_name, update.effective_user.username)
+
+
+def format_user_details(user_id, first_name, last_name, username):
+    """
+    Returns the given user details in displaying format
+
+    :param user_id: type: int
+    Telegram user id
+
+    :param first_name: type: str
+    First name of the user
+
+    :param last_name: type: str or None
+    Last name of the user
+
+    :param username: type: str or None
+    Username of the user
+
+    :return: type: str
+    Formatted user details (First name, last name & username)
+    """
+    from telegram.utils.helpers import escape_markdown
+
+    response = f'*Name:* [{escape_markdown(text=first_name, version=2)} {escape_markdown(text=last_name, version=2) if last_name else ""}](tg://user?id={user_id})'\
+               f'{f", *Username:* [{escape_markdown(text=username, version=2)}](https://t.me/{username})" if username else ""}'
+    return response
+
+
+# Formatting fault record for display
+def render_fault(fault):
+    """
+    Returns a fault saved in the fault store in displaying format
+    Use fault_renderer.get to render through the render cache
+
+    :param fault: type: fault_store.Fault
+    Fault record returned by the fault store
+
+    :return: type: str
+    Formatted fault details in MarkdownV2
+    """
+    from telegram.utils.helpers import escape_markdown
+
+    response = f'*Fault ID:* {fault.id}\n'\
+               f'*Datetime:* {datetime.datetime.fromtimestamp(fault.created_at, tz).strftime("%d/%m/%Y, %H:%M:%S")}\n'\
+               f'{format_user_details(fault.reporter_id, fault.reporter_first_name, fault.reporter_last_name, fault.reporter_username)}\n'\
+               f'*Type of fault:* {escape_markdown(text=fault.type, version=2)}\n'\
+               f'*Description:* {escape_markdown(text=fault.description, version=2)}\n'\
+               f'*Location:* {escape_markdown(text=fault.location, version=2)}'
     return response
 
 
@@ -72,23 +222,21 @@ def display_user_details(update):
 def get_user_details(update):
     """
     Returns the user details who was chatting with the bot in logging format
+    Pass it as a %-style logging argument, it is only formatted when the record is written
 
     :param update: type: telegram.update.Update
     Object represents an incoming update.
 
-    :return: type: str
-    Formatted user details (First name, last name & username)
+    :return: type: log_pipeline.UserDetails
+    User details (First name, last name & username), formatted when converted to str
     """
-    response = f'UserID: {update.effective_user.id}, Name: {update.effective_user.first_name}'\
-               f'{f" {update.effective_user.last_name}" if update.effective_user.last_name else ""}'\
-               f'{f", Username: {update.effective_user.username}" if update.effective_user.username else ""}'
-    return response
+    return UserDetails(update.effective_user)
 
 
-# Get latest fault running number and returns a new fault number
+# Allocate a new fault running number
 def get_fault_index(context):
     """
-    Get the total amount of faults (resolved/active) and derive a new fault id for the newly reported fault
+    Allocate a new fault id for the newly reported fault from the persisted fault id sequence
 
     :param context: type: telegram.ext.callbackcontext.CallbackContext
     This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
@@ -96,109 +244,416 @@ def get_fault_index(context):
     :return: type: str
     Number of the new fault id
     """
+    return str(fault_id_allocator.next_id())
 
-    # Both dicts are not empty
-    if all(context.bot_data[dict_name] for dict_name in ["active_history", "resolved_history"]):
-        index = len(context.bot_data['active_history']) + len(context.bot_data['resolved_history'])
-    elif context.bot_data["active_history"]:
-        index = len(context.bot_data["active_history"])
-    elif context.bot_data["resolved_history"]:
-        index = len(context.bot_data["resolved_history"])
-    else:
-        # Both dict empty
-        index = 0
-
-    return str(index + 1)
-
-
-# Check if environment variables are loaded
-logging.info("Checking environment variables")
-environment_variables = ["bot_token", "recipient_list"]
-# Check if environment variables are loaded
-if any(item not in os.environ for item in environment_variables):
-    logging.critical("Error: Environment variables not loaded")
-    raise EnvironmentVariableError("Environment variables not loaded")
-
-# Check if environment variables are empty
-if any(item for item in environment_variables if not os.getenv(item)):
-    logging.critical("Error: Environment variables are empty")
-    raise EnvironmentVariableError("Environment variables are empty")
-
-# Define & initialize bot
-updater = Updater(token=os.getenv("bot_token"), use_context=True, persistence=PicklePersistence(filename='data'))
-dispatcher = updater.dispatcher
-
-# Initialize bot_data dicts
-if "active_history" not in dispatcher.bot_data:
-    dispatcher.bot_data['active_history'] = {}
-    logging.info(f'Info: Initializing active history dict')
-if "resolved_history" not in dispatcher.bot_data:
-    dispatcher.bot_data['resolved_history'] = {}
-    logging.info(f'Info: Initializing resolved history dict')
-
-# Format recipient list
-recipient_list = os.getenv('recipient_list').split(",")
-logging.info(f'{len(recipient_list)} recipients loaded')
-
-
-# Decorator for paginating replies
-def PaginationHandlerMeta(func):
-    """
-    Meta function
-    """
-    def PaginationHandler(*args, **kwargs):
-        """
-        Splits large amounts of characters in a single message into multiple messages to avoid the max characters length for a single message
-        The max character per message is 4096
-        """
-        # Define separator
-        separator = "\n\n\n"
-
-        # Get response
-        response = func(*args, **kwargs)
-
-        # Find update & context in parameters
-        for arg in args:
-            if isinstance(arg, telegram.update.Update):
-                update = arg
-            elif isinstance(arg, telegram.ext.callbackcontext.CallbackContext):
-                context = arg
-
-        if isinstance(response, dict):
-            # Dict, need to check for pagination
-            if len(f"{separator}".join(part for part in response.values())) > 4096:
-                # Get key references
-                keys = list(response.keys())
-                # Construct paginated response
-                start_index = 0
-                for end_index, _ in enumerate(keys, start=1):
-                    if len(f"{separator}".join(response[key] for key in keys[start_index:end_index])) > 4096:
-                        # Remove last element and send
-                        update.message.reply_text(parse_mode="MarkdownV2", text=f"{separator}".join(
-                            response[key] for key in keys[start_index:end_index - 1]))
-
-                        # Check if last element
-                        if end_index == len(response):
-                            # Just send out last element
-                            update.message.reply_text(parse_mode="MarkdownV2", text=response[keys[end_index - 1]])
-                        else:
-                            # Go back one index
-                            start_index = end_index - 1
-
-                    elif end_index == len(response):
-                        # Last element without exceeding message character count
-                        update.message.reply_text(parse_mode="MarkdownV2", text=f"{separator}".join(
-                            response[key] for key in keys[start_index:end_index]))
-            else:
-                # No need to paginate
-                update.message.reply_text(parse_mode="MarkdownV2", text=f"{separator}".join(part for part in response.values()))
+
+def create_app():
+    """
+    Builds the bot from the environment variables, importing the module itself has no side effects
+
+    Does the following:
+        1. Sets up logging
+        2. Opens the fault store, the index of the archive is only read on first use, see load_archive
+        3. Loads the conversation data & creates the updater
+        4. Initializes metrics, notifications & caches
+
+    The objects are kept in the module, where the handlers find them. Handlers are added by add_handlers
+
+    :return: type: telegram.ext.Updater
+    Updater of the bot, not started yet
+    """
+    global shard_count, shard_index, tz, log_listener, fault_store, fault_id_allocator, persistence, updater, dispatcher, bot_metrics, \
+        recipient_list, recipient_ids, recipient_router, escalation_list, escalations, attachment_store, duplicate_index, digest_policy, fan_out, recipient_directory, outbox, input_limits, draft_ttl, fault_renderer
+
+    from pytz import timezone
+    from telegram.ext import Updater
+    from input_validation import parse_input_limits
+    from escalation import EscalationScheduler, parse_sla_tiers
+    from attachments import AttachmentStore, DEFAULT_MAX_SIZE
+    from duplicates import DuplicateIndex, DEFAULT_THRESHOLD
+    from digest import DigestPolicy
+    from fanout import FanOut
+    from outbox import Outbox
+    from recipient_cache import RecipientDirectory
+    from metrics import BotMetrics
+    from journal_persistence import JournalPersistence
+
+    shard_count = int(os.getenv("shard_count", "1"))
+    shard_index = int(os.getenv("shard_index", "0"))
+
+    # Initialize logging
+    # Define timezone
+    tz = timezone('Asia/Singapore')
+    # Records are formatted later on the listener thread, their time is when they were logged
+    logging.Formatter.converter = staticmethod(lambda secs: datetime.datetime.fromtimestamp(secs, tz).timetuple())
+
+    # Modify root logger, records are written by a background thread
+    logging_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    datefmt = '%d/%m/%Y, %H:%M:%S'
+    level = getattr(logging, os.getenv("log_level", "INFO").upper())
+
+    log_listener = setup_logging('record.log' if shard_count == 1 else f'record.shard{shard_index}.log', logging.Formatter(logging_format, datefmt=datefmt), level=level,
+                                 max_bytes=int(os.getenv("log_max_bytes", str(10 * 1024 * 1024))),
+                                 rotate_interval=float(os.getenv("log_rotate_interval")) if os.getenv("log_rotate_interval") else None,
+                                 json_filename=os.getenv("log_json") or None)
+    atexit.register(log_listener.stop)
+
+    # Check if environment variables are loaded
+    logging.info("Checking environment variables")
+    environment_variables = ["bot_token", "recipient_list"]
+    # Check if environment variables are loaded
+    if any(item not in os.environ for item in environment_variables):
+        logging.critical("Error: Environment variables not loaded")
+        raise EnvironmentVariableError("Environment variables not loaded")
+
+    # Check if environment variables are empty
+    if any(item for item in environment_variables if not os.getenv(item)):
+        logging.critical("Error: Environment variables are empty")
+        raise EnvironmentVariableError("Environment variables are empty")
+
+    # Load the length limits of the fault fields
+    try:
+        input_limits = parse_input_limits(os.getenv("input_limits"), ["type", "description", "location"])
+    except ValueError as error:
+        logging.critical("Error: %s", error)
+        raise EnvironmentVariableError(str(error))
+
+    # Initialize fault store, older resolved faults are read from the archive
+    fault_store = TieredFaultStore(SQLiteFaultStore(os.getenv("fault_db", "faults.db")), FaultArchive(os.getenv("archive_dir", "archive"), lazy=True))
+    logging.info('Info: Opened fault store')
+
+    # Move fault history saved by older versions out of the pickle file
+    migrate_from_pickle(fault_store, filename='data', tz=tz)
+
+    # Initialize fault id allocator
+    fault_id_allocator = FaultIdAllocator(fault_store, block_size=int(os.getenv("fault_id_block_size", "1")))
+
+    # Define & initialize bot
+    # Only changes to user_data are written, in batches, see journal_persistence
+    start = time.perf_counter()
+    persistence = JournalPersistence(filename='data' if shard_count == 1 else f'data.shard{shard_index}',
+                                     flush_interval=float(os.getenv("persistence_flush_interval", "1")))
+    # Files are downloaded from the same server as the Bot API, e.g. https://api.telegram.org/file/bot
+    base_url = os.getenv("bot_api_url") or None
+    updater = Updater(token=os.getenv("bot_token"), use_context=True, persistence=persistence,
+                      workers=int(os.getenv("update_workers", "4")), base_url=base_url,
+                      base_file_url=re.sub(r'/bot$', '/file/bot', base_url) if base_url else None)
+    dispatcher = updater.dispatcher
+    logging.info('Info: Loaded conversation data of %s users in %.3fs', len(dispatcher.user_data), time.perf_counter() - start)
+
+    # Initialize metrics, handlers are instrumented once added
+    bot_metrics = BotMetrics()
+    bot_metrics.instrument_bot(updater.bot)
+    bot_metrics.instrument_persistence(updater.persistence)
+
+    # Format recipient list
+    recipient_list = os.getenv('recipient_list').split(",")
+    recipient_ids = frozenset(int(user_id) for user_id in recipient_list)
+    logging.info('%s recipients loaded', len(recipient_list))
+
+    # Load the rules routing faults to groups of recipients
+    try:
+        recipient_router = RecipientRouter(os.getenv("routing_rules") or None, recipient_list)
+    except ValueError as error:
+        logging.critical("Error: %s", error)
+        raise EnvironmentVariableError(str(error))
+
+    # Initialize fan-out engine for notifying recipients
+    fan_out = FanOut(updater.bot, max_workers=int(os.getenv("fanout_workers", "8")))
+
+    # Initialize recipient directory for caching recipient chat details
+    recipient_directory = RecipientDirectory(updater.bot, ttl=float(os.getenv("recipient_cache_ttl", "3600")))
+    recipient_directory.warm(recipient_list)
+
+    # Hold notifications for digests during bursts, in front of the recipient loops of the outbox
+    if float(os.getenv("digest_window") or 0):
+        try:
+            digest_recipients = [user_id.strip() for user_id in os.getenv("digest_recipients", "").split(",") if user_id.strip()]
+            digest_policy = DigestPolicy(float(os.getenv("digest_window")), recipients=digest_recipients or None,
+                                         urgent_types=os.getenv("digest_urgent", "").split(","))
+        except ValueError as error:
+            logging.critical("Error: %s", error)
+            raise EnvironmentVariableError(str(error))
+        bot_metrics.instrument_digest(digest_policy)
+        logging.info('Info: Digest mode, notifications held for %ss', digest_policy.window)
+
+    # Initialize outbox for notifications, drained by the leader when running as several processes
+    outbox = Outbox(fault_store.hot, deliver_notification, is_active=lambda: cluster is None or cluster.is_leader, digest=digest_policy)
+    bot_metrics.registry.gauge("bot_outbox_pending_deliveries", "Notification deliveries waiting in the outbox", outbox.pending_count)
+
+    # Initialize escalation of faults left active for too long, by the leader when running as several processes
+    try:
+        sla_tiers = parse_sla_tiers(os.getenv("sla_tiers"))
+    except ValueError as error:
+        logging.critical("Error: %s", error)
+        raise EnvironmentVariableError(str(error))
+    escalation_list = [user_id.strip() for user_id in os.getenv("escalation_list", "").split(",") if user_id.strip()]
+    if any(tier.target == ESCALATION for tier in sla_tiers) and not escalation_list:
+        logging.critical("Error: escalation_list is required by the escalation SLA tiers")
+        raise EnvironmentVariableError("escalation_list is required by the escalation SLA tiers")
+    if sla_tiers:
+        escalations = EscalationScheduler(fault_store.hot, sla_tiers, escalate_fault, is_active=lambda: cluster is None or cluster.is_leader)
+        bot_metrics.registry.gauge("bot_escalation_timers", "Active faults waiting for their next SLA tier", lambda: len(escalations))
+
+    # Initialize store of the photos & documents attached to faults
+    attachment_store = AttachmentStore(fault_store.hot, os.getenv("attachment_dir", "attachments"),
+                                       max_size=int(os.getenv("attachment_max_bytes", str(DEFAULT_MAX_SIZE))))
+
+    # Initialize index of the active faults, for showing reporters likely duplicates of their fault, built by load_duplicate_index
+    try:
+        duplicate_index = DuplicateIndex(fault_store.hot, threshold=float(os.getenv("duplicate_threshold", str(DEFAULT_THRESHOLD))))
+    except ValueError as error:
+        logging.critical("Error: %s", error)
+        raise EnvironmentVariableError(str(error))
+    bot_metrics.registry.gauge("bot_duplicate_index_faults", "Active faults in the index of likely duplicates", lambda: len(duplicate_index))
+
+    # Seconds before the draft of a reporter who stopped replying expires
+    draft_ttl = float(os.getenv("draft_ttl", str(DEFAULT_DRAFT_TTL)))
+
+    # Initialize render cache for rendered fault messages
+    fault_renderer = RenderCache(render_fault, max_size=int(os.getenv("render_cache_size", "4096")))
+
+    return updater
+
+
+def load_archive():
+    """
+    Reads the index of the archived faults, run in the background once the bot is receiving updates
+    Until it is read, only handlers reading archived faults wait for it
+    """
+    start = time.perf_counter()
+    fault_store.archive.load()
+    logging.info('Info: Loaded archive, %s faults archived in %.3fs', len(fault_store.archive), time.perf_counter() - start)
+
+
+def load_duplicate_index():
+    """
+    Indexes the active faults for finding likely duplicates, run in the background once the bot is receiving updates
+    Until they are indexed, reporters are not shown likely duplicates
+    """
+    duplicate_index.sync()
+
+
+# Notifying recipients
+def notify_recipients(connection, messages, description, fault_id=None, recipients=None, urgent=False):
+    """
+    Saves a notification to the recipients into the outbox, it is sent once the transaction is committed
+
+    :param connection: type: sqlite3.Connection
+    Connection of the fault store transaction the notification belongs to
+
+    :param messages: type: list
+    Keyword arguments for telegram.Bot.send_message, send_photo or send_document (excluding chat_id) of every message, sent in order
+
+    :param description: type: str
+    Description of the notification for logging
+
+    :param fault_id: type: int or None
+    Fault the notification is about
+
+    :param recipients: type: list or None
+    Chat ids of the recipients, as routed by recipient_router (Defaults to everyone in the recipient list)
+
+    :param urgent: type: bool
+    Whether the notification is sent right away in digest mode too
+    """
+    recipients = recipient_list if recipients is None else recipients
+    if not recipients:
+        logging.warning("No recipients for %s", description)
+        return
+    outbox.enqueue(connection, recipients, messages, description, fault_id=fault_id, urgent=urgent)
+
+
+def is_urgent(type_of_fault):
+    """
+    Returns whether notifications about a type of fault are never held for a digest
+    """
+    return digest_policy is not None and digest_policy.is_urgent(type_of_fault)
+
+
+def escalate_fault(connection, fault, tier):
+    """
+    Saves the notification of a fault reaching an SLA tier into the outbox, called by escalations
+
+    :param connection: type: sqlite3.Connection
+    Connection of the fault store transaction saving the tier reached
+
+    :param fault: type: fault_store.Fault
+    Fault still active
+
+    :param tier: type: escalation.SLATier
+    Tier reached
+    """
+    recipients = escalation_list if tier.target == ESCALATION else recipient_router.route(fault.type, fault.location)
+    # Faults escalated are late already, they are never held for a digest
+    notify_recipients(connection, [dict(text=f"Fault id: {fault.id} is still active {format_duration(tier.after)} after being reported"),
+                                   dict(text=fault_renderer.get(fault), parse_mode="MarkdownV2")],
+                      description="escalation notification" if tier.target == ESCALATION else "reminder notification", fault_id=fault.id, recipients=recipients,
+                      urgent=True)
+
+
+def escalate_active_faults(context):
+    """
+    Escalates the active faults whose next SLA tier is due
+    Runs periodically on the job queue
+
+    :param context: type: telegram.ext.callbackcontext.CallbackContext
+    Context of the job
+    """
+    escalations.tick()
+
+
+def deliver_notification(chat_ids, messages, description):
+    """
+    Sends the messages to the recipients in parallel and logs the delivery outcome
+    Called by the outbox for every pending notification
+
+    :param chat_ids: type: list
+    Chat ids of the recipients
+
+    :param messages: type: list
+    Keyword arguments for telegram.Bot.send_message, send_photo or send_document (excluding chat_id) of every message, sent in order
+
+    :param description: type: str
+    Description of the notification for logging
+
+    :return: type: fanout.FanOutReport
+    Delivery outcome for all recipients
+    """
+    from fanout import DeliveryStatus, SENT, UNREACHABLE
+
+    # Skip recipients known to be unreachable without a network call
+    recipients = []
+    skipped = []
+    for chat_id in chat_ids:
+        if recipient_directory.is_unreachable(chat_id):
+            logging.warning("User: %s have not talked to the bot before. Skipping.", chat_id)
+            skipped.append(chat_id)
         else:
-            # String, single output, no need paginate
-            update.message.reply_text(parse_mode="MarkdownV2", text=response)
+            recipients.append(chat_id)
+
+    report = fan_out.send(recipients, messages)
+    report.results.update((chat_id, DeliveryStatus(chat_id, UNREACHABLE, 0)) for chat_id in skipped)
+
+    for chat_id, result in report.results.items():
+        if result.status == SENT:
+            logging.info("Sent %s to User: %s in %.3fs", description, recipient_directory.get_first_name(chat_id) or chat_id, result.latency)
+        elif result.status == UNREACHABLE:
+            # User have not initialize a chat with bot yet
+            recipient_directory.mark_unreachable(chat_id)
+            logging.warning("User: %s have not talked to the bot before. Skipping.", chat_id)
+        else:
+            logging.error("Failed to send %s to chat: %s after %s attempts, Error: %s", description, chat_id, result.attempts, result.error)
+
+    logging.info("Info: %s fan-out: %s, Recipient cache: %s", description.capitalize(), report.summary(), recipient_directory.stats())
 
-        return ConversationHandler.END
+    return report
 
-    return PaginationHandler
+
+# Paginating fault lists
+def history_view(status):
+    """
+    Returns the page boundaries of the active or resolved fault history, rebuilt only when faults have changed
+
+    :param status: type: str
+    Status of the faults in the view, ACTIVE or RESOLVED
+
+    :return: type: pagination.PageView or pagination.ChainedPageView
+    Page boundaries of the fault history
+    """
+    # Active faults are never archived, their view does not wait for the index of the archive to be read
+    if status == ACTIVE:
+        return fault_paginator.get_view(f"history:{status}", fault_store.hot.revision(), lambda: ((fault.id, fault_renderer.get(fault)) for fault in fault_store.hot.iter_faults(status)))
+
+    hot_revision, archive_revision = fault_store.revision()
+
+    # Archived faults come first, their pages are only rebuilt when faults are archived
+    archived = fault_paginator.get_view("archive:resolved", archive_revision, lambda: ((fault.id, fault_renderer.get(fault)) for fault in fault_store.archive.iter_faults()))
+    recent = fault_paginator.get_view("hot:resolved", hot_revision, lambda: ((fault.id, fault_renderer.get(fault)) for fault in fault_store.hot.iter_faults(status)))
+    return ChainedPageView(f"history:{status}", [archived, recent])
+
+
+def search_view(key):
+    """
+    Returns the page boundaries of the results of a search, rebuilt only when faults have changed
+
+    :param key: type: str
+    Key the search was remembered under, see remember_search
+
+    :return: type: pagination.PageView or None
+    Page boundaries of the search results, None if the search is no longer remembered
+    """
+    with search_queries_lock:
+        search_query = search_queries.get(key)
+    if search_query is None:
+        return None
+
+    def build():
+        fault_ids = fault_store.search_faults(search_query["terms"], status=search_query["status"], since=search_query["since"], until=search_query["until"])
+        return ((fault.id, fault_renderer.get(fault)) for fault in fault_store.get_faults(fault_ids))
+
+    # Only the hot store is searched, see fault_archive
+    return fault_paginator.get_view(f"search:{key}", fault_store.hot.revision(), build)
+
+
+def get_view(name):
+    """
+    Returns the page boundaries of a view by its name, as found in the callback data of the Prev/Next buttons
+
+    :param name: type: str
+    Name of the view, history:{status} or search:{key}
+
+    :return: type: pagination.PageView or None
+    Page boundaries of the view, None if the view cannot be rebuilt anymore
+    """
+    kind, _, argument = name.partition(":")
+    if kind == "history":
+        return history_view(argument)
+    return search_view(argument)
+
+
+def page_markup(view, page):
+    """
+    Returns the inline keyboard for browsing the pages of a view
+
+    :param view: type: pagination.PageView
+    Page boundaries of the view
+
+    :param page: type: int
+    Index of the page currently shown
+
+    :return: type: telegram.InlineKeyboardMarkup or None
+    Prev/Next buttons, None if the view fits on a single page
+    """
+    import telegram
+
+    if len(view) <= 1:
+        return None
+
+    buttons = []
+    if page > 0:
+        buttons.append(telegram.InlineKeyboardButton("Prev", callback_data=f"{view.name}:{page - 1}"))
+    buttons.append(telegram.InlineKeyboardButton(f"{page + 1}/{len(view)}", callback_data=f"{view.name}:{page}"))
+    if page < len(view) - 1:
+        buttons.append(telegram.InlineKeyboardButton("Next", callback_data=f"{view.name}:{page + 1}"))
+
+    return telegram.InlineKeyboardMarkup([buttons])
+
+
+def render_page(view, page):
+    """
+    Renders a single page of a view
+
+    :param view: type: pagination.PageView
+    Page boundaries of the view
+
+    :param page: type: int
+    Index of the page
+
+    :return: type: str
+    Faults on the page in MarkdownV2
+    """
+    return fault_paginator.render_page(view, page, lambda fault_ids: [fault_renderer.get(fault) for fault in fault_store.get_faults(fault_ids)])
 
 
 # Commands
@@ -218,7 +673,9 @@ def history(update, context):
     :return: type: int
     The id of the next state defined in conversation handler
     """
-    logging.info(f'{get_user_details(update)}, Action: /history')
+    import telegram
+
+    logging.info('%s, Action: /history', get_user_details(update), extra={"action": "/history"})
 
     # Define keyboard choices
     choices = [
@@ -229,18 +686,16 @@ def history(update, context):
     keyboard_markup = telegram.ReplyKeyboardMarkup(choices, one_time_keyboard=True)
 
     # Prompt user for active or resolved fault history
-    update.message.reply_text(f"Choose *active* or *resolved* fault history", reply_markup=keyboard_markup, parse_mode="MarkdownV2")
+    update.message.reply_text("Choose *active* or *resolved* fault history", reply_markup=keyboard_markup, parse_mode="MarkdownV2")
 
     return 100
 
 
-history_handler = CommandHandler('history', history, Filters.user(user_id=set(int(user_id) for user_id in recipient_list)))
-
-
-@PaginationHandlerMeta
 def get_history_version(update, context):
     """
-    Handles the user input, only accepts 'active' or 'resolved' and returns the respective dict
+    Handles the user input, only accepts 'active' or 'resolved' and sends the first page of the respective fault history
+
+    Further pages are sent on demand through the Prev/Next buttons, see browse_page
 
     :param update: type: telegram.update.Update
     Object represents an incoming update.
@@ -248,35 +703,189 @@ def get_history_version(update, context):
     :param context: type: telegram.ext.callbackcontext.CallbackContext
     This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
 
-    :return: type: str or dict
-    Returns str if there is no fault history, else returns dict if there is at least 1 fault saved
+    :return: type: int
+    The id of the next state defined in conversation handler
     """
+    from telegram.ext import ConversationHandler
+
     # Standardise user input
     history_version = update.message.text.lower()
 
     # Logging
-    logging.info(f'{get_user_details(update)}, Input: {history_version}')
+    logging.info('%s, Input: %s', get_user_details(update), history_version)
+
+    status = ACTIVE if history_version == "active" else RESOLVED
+    view = history_view(status)
+    if len(view):
+        update.message.reply_text(parse_mode="MarkdownV2", text=render_page(view, 0), reply_markup=page_markup(view, 0))
+        logging.info('%s, Info: Returned %s history record, page 1/%s', get_user_details(update), status, len(view))
+    elif status == ACTIVE:
+        update.message.reply_text("No active faults, go ahead and submit a new fault and it will show up here")
+        logging.info('%s, Info: Returned no active faults in record', get_user_details(update))
+    else:
+        update.message.reply_text("No resolved faults, go ahead and mark an active fault as resolved and it will show up here")
+        logging.info('%s, Info: Returned no resolved faults in record', get_user_details(update))
+
+    return ConversationHandler.END
+
+
+def browse_page(update, context):
+    """
+    Handles the Prev/Next buttons of a fault history or search results message, replaces the message with the requested page
+
+    :param update: type: telegram.update.Update
+    Object represents an incoming update.
 
-    if history_version == "active":
-        if context.bot_data["active_history"]:
-            logging.info(f'{get_user_details(update)}, Info: Returned active history record')
-            return context.bot_data["active_history"]
+    :param context: type: telegram.ext.callbackcontext.CallbackContext
+    This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
+    """
+    import telegram
+
+    query = update.callback_query
+
+    # Only recipients can browse the fault history
+    if update.effective_user.id not in recipient_ids:
+        query.answer()
+        return
+
+    name, _, page = query.data.rpartition(":")
+    view = get_view(name)
+    if view is None:
+        query.answer(text="Search expired, please search again")
+        return
+    if not len(view):
+        query.answer(text="No faults found")
+        return
+
+    # Faults may have changed since the message was sent
+    page = view.clamp(int(page))
+    logging.info('%s, Info: Returned %s, page %s/%s', get_user_details(update), name, page + 1, len(view))
+
+    query.answer()
+    try:
+        query.edit_message_text(parse_mode="MarkdownV2", text=render_page(view, page), reply_markup=page_markup(view, page))
+    except telegram.error.BadRequest as error:
+        # Same page requested again without any change
+        if "not modified" not in str(error).lower():
+            raise
+
+
+# Search command
+def parse_search_query(text):
+    """
+    Splits the input of the search command into search terms & filters
+
+    Filters:
+        1. status:active or status:resolved
+        2. from:DD/MM/YYYY - Faults created on or after the date
+        3. to:DD/MM/YYYY - Faults created on or before the date
+
+    :param text: type: str
+    Input of the search command
+
+    :return: type: dict
+    Search terms, status & created_at range (since, until) as POSIX timestamps
+
+    :raises ValueError: if a filter is invalid
+    """
+    search_query = {"terms": [], "status": None, "since": None, "until": None}
+    for word in text.split():
+        name, _, value = word.partition(":")
+        name = name.lower()
+        if name == "status" and value:
+            if value.lower() not in (ACTIVE, RESOLVED):
+                raise ValueError(f"Unknown status: {value}, use status:active or status:resolved")
+            search_query["status"] = value.lower()
+        elif name in ("from", "to") and value:
+            try:
+                date = tz.localize(datetime.datetime.strptime(value, "%d/%m/%Y"))
+            except ValueError:
+                raise ValueError(f"Invalid date: {value}, use DD/MM/YYYY")
+            if name == "from":
+                search_query["since"] = date.timestamp()
+            else:
+                search_query["until"] = (date + datetime.timedelta(days=1)).timestamp()
         else:
-            logging.info(f'{get_user_details(update)}, Info: Returned no active faults in record')
-            return "No active faults, go ahead and submit a new fault and it will show up here"
+            search_query["terms"].append(word)
+
+    search_query["terms"] = " ".join(search_query["terms"])
+    return search_query
+
+
+def remember_search(search_query):
+    """
+    Remembers a search so that its results can be rebuilt when the Prev/Next buttons are used
+
+    :param search_query: type: dict
+    Search terms & filters returned by parse_search_query
+
+    :return: type: str
+    Key the search is remembered under
+    """
+    key = hashlib.sha1(repr(sorted(search_query.items())).lower().encode("utf-8")).hexdigest()[:16]
+    with search_queries_lock:
+        search_queries[key] = search_query
+        search_queries.move_to_end(key)
+        while len(search_queries) > fault_paginator.max_views:
+            search_queries.popitem(last=False)
+    return key
+
+
+def search(update, context):
+    """
+    Searches the type, description & location of all faults
+    /search {terms} command of the bot
+
+    Every term has to match the start of a word, the most recent results are ranked by relevance and sent a page at a time like /history
+    Results can be filtered with status:active|resolved, from:DD/MM/YYYY & to:DD/MM/YYYY
+    Archived faults are not searched, the user is told so when resolved faults may be archived
+
+    :param update: type: telegram.update.Update
+    Object represents an incoming update.
+
+    :param context: type: telegram.ext.callbackcontext.CallbackContext
+    This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
+    """
+    logging.info('%s, Action: /search, Input: %s', get_user_details(update), context.args, extra={"action": "/search"})
+
+    try:
+        search_query = parse_search_query(" ".join(context.args))
+    except ValueError as error:
+        logging.info('%s, Error: %s', get_user_details(update), error)
+        update.message.reply_text(str(error))
+        return
+
+    if not search_query["terms"]:
+        logging.info('%s, Error: No search terms provided', get_user_details(update))
+        update.message.reply_text("No search terms provided, please provide at least 1 search term")
+        return
+
+    if not fault_store.searchable:
+        update.message.reply_text("Search is unavailable")
+        return
+
+    start = time.perf_counter()
+    view = search_view(remember_search(search_query))
+    if len(view):
+        update.message.reply_text(parse_mode="MarkdownV2", text=render_page(view, 0), reply_markup=page_markup(view, 0))
+        logging.info('%s, Info: Returned search results, %s faults found in %.3fs', get_user_details(update), len(view.keys), time.perf_counter() - start)
     else:
-        # Resolved history
-        if context.bot_data["resolved_history"]:
-            logging.info(f'{get_user_details(update)}, Info: Returned resolved history record')
-            return context.bot_data["resolved_history"]
-        else:
-            logging.info(f'{get_user_details(update)}, Info: Returned no resolved faults in record')
-            return "No resolved faults, go ahead and mark an active fault as resolved and it will show up here"
+        update.message.reply_text("No faults found")
+        logging.info('%s, Info: Returned no search results', get_user_details(update))
 
+    # Only the hot store is searched, the archive is not read just to tell whether it is empty
+    if search_query["status"] != ACTIVE and (not fault_store.archive.loaded or len(fault_store.archive)):
+        update.message.reply_text(ARCHIVED_SEARCH_NOTE)
 
-def mark_resolve_active_fault(update, context):
+
+# Export command
+def export(update, context):
     """
-    Mark an active fault as resolved
+    Sends the fault history as a CSV or JSON Lines file
+    /export [csv|jsonl] command of the bot
+
+    Faults can be filtered with status:active|resolved, from:DD/MM/YYYY & to:DD/MM/YYYY like /search
+    Faults are streamed into a temporary file, bigger exports are made with fault_export.py instead
 
     :param update: type: telegram.update.Update
     Object represents an incoming update.
@@ -284,51 +893,168 @@ def mark_resolve_active_fault(update, context):
     :param context: type: telegram.ext.callbackcontext.CallbackContext
     This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
     """
-    # Handle user input
-    fault_id = context.args
+    from fault_export import export_faults
+
+    logging.info('%s, Action: /export, Input: %s', get_user_details(update), context.args, extra={"action": "/export"})
+
+    try:
+        export_query = parse_search_query(" ".join(context.args))
+    except ValueError as error:
+        logging.info('%s, Error: %s', get_user_details(update), error)
+        update.message.reply_text(str(error))
+        return
+
+    export_format = export_query["terms"].lower() or "csv"
+    if export_format not in ("csv", "jsonl"):
+        logging.info('%s, Error: Unknown export format: %s', get_user_details(update), export_format)
+        update.message.reply_text(f"Unknown format: {export_format}, use csv or jsonl")
+        return
+
+    start = time.perf_counter()
+    with tempfile.TemporaryFile() as file:
+        count = export_faults(fault_store, file, export_format, status=export_query["status"],
+                              since=export_query["since"], until=export_query["until"], tz=tz)
+        # Bots can only upload files up to 50 MB
+        if file.tell() > 50 * 1024 * 1024:
+            logging.info('%s, Error: Export of %s faults is too large to be sent', get_user_details(update), count)
+            update.message.reply_text(f"Export of {count} faults is too large to be sent, narrow it down with status:, from: or to:")
+            return
+
+        file.seek(0)
+        update.message.reply_document(document=file, filename=f"faults_{datetime.datetime.now(tz).strftime('%Y%m%d_%H%M%S')}.{export_format}",
+                                      caption=f"{count} faults")
+    logging.info('%s, Info: Exported %s faults in %.3fs', get_user_details(update), count, time.perf_counter() - start)
+
+
+def parse_fault_ids(args):
+    """
+    Parses the fault ids of the resolved command, single ids & ranges separated by spaces or commas, e.g. 12 15 20-45
+
+    :param args: type: list
+    Arguments of the command
+
+    :return: type: list
+    (first, last) fault ids of every range in the order given, both inclusive, a single id being a range of its own
+
+    :raises ValueError: if an argument is not a fault id or range, or too many fault ids are given
+    """
+    id_ranges = []
+    for word in ",".join(args).split(","):
+        if not word:
+            continue
+        first, separator, last = word.partition("-")
+        if not first.isdigit() or (separator and not last.isdigit()):
+            raise ValueError(f"Invalid fault id: {word}, please provide fault ids like 12 or ranges like 20-45")
+        first, last = int(first), int(last) if separator else int(first)
+        if first > last:
+            raise ValueError(f"Invalid range: {word}, the first fault id has to be the lower one")
+        id_ranges.append((first, last))
+
+    if sum(last - first + 1 for first, last in id_ranges) > MAX_RESOLVED_FAULTS:
+        raise ValueError(f"More than {MAX_RESOLVED_FAULTS} fault ids provided, please resolve them in smaller batches")
+    return id_ranges
+
+
+def format_fault_ids(fault_ids):
+    """
+    Returns sorted fault ids as text, consecutive ids being joined into ranges, e.g. [12, 15, 20, 21, 22] as 12, 15, 20-22
+    """
+    parts = []
+    fault_ids = sorted(fault_ids)
+    start = 0
+    for index, fault_id in enumerate(fault_ids):
+        if index + 1 == len(fault_ids) or fault_ids[index + 1] != fault_id + 1:
+            parts.append(str(fault_id) if index == start else f"{fault_ids[start]}-{fault_id}")
+            start = index + 1
+    return ", ".join(parts)
+
+
+def resolved_notification(fault_ids):
+    """
+    Returns the messages notifying a recipient that faults have been resolved, a single message unless the ids do not fit
+
+    :return: type: list
+    Keyword arguments for telegram.Bot.send_message (excluding chat_id) of every message
+    """
+    if len(fault_ids) == 1:
+        return [dict(text=f"Fault id: {fault_ids[0]} has been marked as resolved")]
+
+    header = f"{len(fault_ids)} faults have been marked as resolved, fault ids: "
+    parts = format_fault_ids(fault_ids).split(", ")
+    # Leave room for the header on every page
+    bounds = paginate((len(part) for part in parts), max_length=MAX_MESSAGE_LENGTH - len(header), separator_length=2)
+    return [dict(text=header + ", ".join(parts[start:end])) for start, end in bounds]
+
+
+def mark_resolve_active_fault(update, context):
+    """
+    Mark active faults as resolved
+    /resolved {fault_id} [{fault_id} | {first}-{last} ...] command of the bot
 
-    # Check if valid fault id was provided
-    if not fault_id:
+    All faults given are resolved in a single transaction, every recipient is sent a single notification listing the
+    faults routed to them rather than one per fault
+
+    :param update: type: telegram.update.Update
+    Object represents an incoming update.
+
+    :param context: type: telegram.ext.callbackcontext.CallbackContext
+    This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
+    """
+    # Check if valid fault ids were provided
+    if not context.args:
         # No arguments provided
-        logging.info(f'{get_user_details(update)}, Error: No arguments provided')
+        logging.info('%s, Error: No arguments provided', get_user_details(update))
         # Empty list
         update.message.reply_text("No arguments provided, please provide a valid fault id")
-    elif len(fault_id) > 1:
-        # More than 1 arguments provided
-        update.message.reply_text("More than 1 argument provided, please provide a valid fault id")
-        logging.info(f'{get_user_details(update)}, Error: More than 1 argument provided')
-    elif fault_id[0].isdigit():
-        # Integer provided
-        logging.info(f'{get_user_details(update)}, Input: {fault_id}')
-
-        # Process integer validity
-        fault_id = str(fault_id[0])
-        # Move fault from active dict to resolved dict
-        try:
-            context.bot_data["resolved_history"][fault_id] = context.bot_data["active_history"].pop(fault_id)
-            logging.info(f'{get_user_details(update)}, Fault id: {fault_id} marked as resolved')
-        except KeyError:
-            # Key not found in active history dict
-            update.message.reply_text("No such active fault id")
-            logging.info(f'{get_user_details(update)}, Error: Non integer argument provided')
+        return
 
-        else:
-            # Update everyone in the recipient list
-            for chat_id in recipient_list:
-                try:
-                    # Send message
-                    updater.bot.send_message(chat_id=chat_id, text=f"Fault id: {fault_id} has been marked as resolved")
-                    logging.info(f"Sent resolved fault notification to: {context.bot.get_chat(chat_id)['first_name']}")
-                except telegram.error.BadRequest:
-                    # User have not initialize a chat with bot yet
-                    logging.warning(f"User: {chat_id} have not talked to the bot before. Skipping.")
-    else:
+    logging.info('%s, Input: %s', get_user_details(update), context.args)
+    try:
+        id_ranges = parse_fault_ids(context.args)
+    except ValueError as error:
         # Other data type passed, error
-        update.message.reply_text("Unexpected arguments type provided, please provide a valid fault id")
-        logging.info(f'{get_user_details(update)}, Error: Invalid arguments type provided')
-
-
-mark_resolve_active_fault_handler = CommandHandler('resolved', mark_resolve_active_fault, Filters.user(user_id=set(int(user_id) for user_id in recipient_list)))
+        update.message.reply_text(str(error))
+        logging.info('%s, Error: %s', get_user_details(update), error)
+        return
+
+    # Mark faults in the fault store as resolved, together with the notification to the recipients of the faults
+    with fault_store.transaction() as connection:
+        fault_ids = fault_store.resolve_faults(id_ranges, resolved_at=update.message.date.timestamp())
+
+        # Faults resolved, keyed by recipient
+        recipient_faults = {}
+        for fault in fault_store.get_faults(fault_ids):
+            for chat_id in recipient_router.route(fault.type, fault.location):
+                recipient_faults.setdefault(chat_id, []).append(fault.id)
+
+        # Recipients of the same faults share a notification
+        notifications = {}
+        for chat_id, recipient_fault_ids in recipient_faults.items():
+            notifications.setdefault(tuple(recipient_fault_ids), []).append(chat_id)
+        for recipient_fault_ids, recipients in notifications.items():
+            notify_recipients(connection, resolved_notification(recipient_fault_ids), description="resolved fault notification",
+                              fault_id=recipient_fault_ids[0] if len(recipient_fault_ids) == 1 else None, recipients=recipients)
+
+    if escalations is not None:
+        escalations.cancel(fault_ids)
+    duplicate_index.remove(fault_ids)
+
+    # Single fault ids given that were not resolved
+    not_found = sorted({first for first, last in id_ranges if first == last} - set(fault_ids))
+    if not fault_ids:
+        # Fault ids not found among active faults
+        update.message.reply_text("No such active fault id")
+        logging.info('%s, Error: No such active fault id', get_user_details(update))
+        return
+    if not_found:
+        update.message.reply_text(f"No such active fault id: {format_fault_ids(not_found)}")
+        logging.info('%s, Error: No such active fault id: %s', get_user_details(update), format_fault_ids(not_found))
+
+    for fault_id in fault_ids:
+        logging.info('%s, Fault id: %s marked as resolved', get_user_details(update), fault_id, extra={"action": "resolved", "fault_id": fault_id})
+    if len(fault_ids) > 1:
+        logging.info('%s, Info: Resolved %s faults, %s notifications to %s recipients', get_user_details(update), len(fault_ids),
+                     len(notifications), len(recipient_faults))
 
 
 # Start command
@@ -347,7 +1073,11 @@ def start(update, context):
     :return: type: int
     The id of the next state defined in conversation handler
     """
-    logging.info(f'{get_user_details(update)}, Action: /start')
+    logging.info('%s, Action: /start', get_user_details(update), extra={"action": "/start"})
+
+    # Start a new draft, dropping any earlier one
+    context.user_data.pop(DRAFT_KEY, None)
+    get_draft(context.user_data)
 
     # Prompt user
     update.message.reply_text("Type of fault?")
@@ -355,9 +1085,6 @@ def start(update, context):
     return 5
 
 
-new_fault_handler = CommandHandler('start', start)
-
-
 def get_type_of_fault(update, context):
     """
     Handles the user input for the type of fault, only accepts text with character limit between 4> and 500<
@@ -373,9 +1100,9 @@ def get_type_of_fault(update, context):
     """
     # Save user input
     type_of_fault = update.message.text
-    context.user_data["type_of_fault"] = type_of_fault
+    get_draft(context.user_data).update(type=type_of_fault)
 
-    logging.info(f'{get_user_details(update)}, Input: {type_of_fault}')
+    logging.info('%s, Input: %s', get_user_details(update), type_of_fault)
 
     # Prompt user
     update.message.reply_text("Description of fault?")
@@ -398,9 +1125,9 @@ def get_description_of_fault(update, context):
     """
     # Save user input
     description_of_fault = update.message.text
-    context.user_data["description_of_fault"] = description_of_fault
+    get_draft(context.user_data).update(description=description_of_fault)
 
-    logging.info(f'{get_user_details(update)}, Input: {description_of_fault}')
+    logging.info('%s, Input: %s', get_user_details(update), description_of_fault)
 
     # Prompt user
     update.message.reply_text("Location of fault? (Blk no, level, room no etc)")
@@ -413,6 +1140,7 @@ def get_location_of_fault(update, context):
     Handles the user input for the location of fault, only accepts text with character limit between 4> and 500<
 
     After that, constructs a fault summary message to allow the user to confirm all their inputs before sending to the respective personnel
+    Active faults likely to be the same fault are shown along with it, the user can add their report to one of them instead
 
     :param update: type: telegram.update.Update
     Object represents an incoming update.
@@ -423,17 +1151,20 @@ def get_location_of_fault(update, context):
     :return: type: int
     The id of the next state defined in conversation handler
     """
+    import telegram
+    from telegram.utils.helpers import escape_markdown
+
     # Save user input
     location_of_fault = update.message.text
-    context.user_data["location_of_fault"] = location_of_fault
+    draft = get_draft(context.user_data)
 
-    logging.info(f'{get_user_details(update)}, Input: {location_of_fault}')
+    logging.info('%s, Input: %s', get_user_details(update), location_of_fault)
 
     # Generating fault summary message
     # Let user check entered details before sending
-    response = f'*Type of fault:* {escape_markdown(text=context.user_data["type_of_fault"], version=2)}\n'\
-               f'*Description:* {escape_markdown(text=context.user_data["description_of_fault"], version=2)}\n'\
-               f'*Location:* {escape_markdown(text=context.user_data["location_of_fault"], version=2)}'
+    response = f'*Type of fault:* {escape_markdown(text=draft.type, version=2)}\n'\
+               f'*Description:* {escape_markdown(text=draft.description, version=2)}\n'\
+               f'*Location:* {escape_markdown(text=location_of_fault, version=2)}'
     message = update.message.reply_text(text=response, parse_mode="MarkdownV2")
 
     # Define keyboard choices
@@ -441,19 +1172,225 @@ def get_location_of_fault(update, context):
         [telegram.KeyboardButton("Yes")],
         [telegram.KeyboardButton("No")]
     ]
+    prompt = "Is this correct? (y/n)"
+
+    # Show active faults likely to be the same fault, without the details of their reporters
+    duplicates = duplicate_index.find(draft.type, draft.description, location_of_fault)
+    if duplicates:
+        response = '*Similar faults already reported:*\n\n' + '\n\n'.join(
+            f'*Fault ID:* {fault.id}\n'
+            f'*Datetime:* {escape_markdown(text=datetime.datetime.fromtimestamp(fault.created_at, tz).strftime("%d/%m/%Y, %H:%M:%S"), version=2)}\n'
+            f'*Type of fault:* {escape_markdown(text=fault.type, version=2)}\n'
+            f'*Description:* {escape_markdown(text=fault.description, version=2)}\n'
+            f'*Location:* {escape_markdown(text=fault.location, version=2)}' for fault, _ in duplicates)
+        update.message.reply_text(text=response, parse_mode="MarkdownV2")
+        choices.extend([telegram.KeyboardButton(f"Same as fault {fault.id}")] for fault, _ in duplicates)
+        prompt += "\nIf it is one of the faults above, choose Same as fault to add your report to it instead"
+        logging.info('%s, Info: Likely duplicates of fault: %s', get_user_details(update),
+                     ", ".join(f"{fault.id} ({similarity:.2f})" for fault, similarity in duplicates))
 
     keyboard_markup = telegram.ReplyKeyboardMarkup(choices, one_time_keyboard=True)
 
     # Prompt user
-    update.message.reply_text("Is this correct? (y/n)", reply_markup=keyboard_markup)
+    update.message.reply_text(prompt + "\nSend photos or documents of the fault before answering to attach them",
+                              reply_markup=keyboard_markup)
 
-    # Save message object for later use
-    context.user_data["fault_summary"] = message
-    logging.info(f'Info: Saved fault summary into temp user_data')
+    # Save the time of the summary as the time the fault was created, rather than the whole message object
+    draft.update(location=location_of_fault, summarized_at=message.date.timestamp(), duplicate_ids=tuple(fault.id for fault, _ in duplicates))
+    logging.info('Info: Saved fault summary into the draft')
 
     return 0
 
 
+def get_attachment_of_fault(update, context):
+    """
+    Handles a photo or document sent by the user while confirming the fault summary, attaching it to the fault
+
+    The file is downloaded into the attachment store off the dispatcher thread, recipients are later sent it by its Telegram file_id
+
+    :param update: type: telegram.update.Update
+    Object represents an incoming update.
+
+    :param context: type: telegram.ext.callbackcontext.CallbackContext
+    This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
+
+    :return: type: int
+    The id of the next state defined in conversation handler
+    """
+    from attachments import PHOTO, DOCUMENT
+
+    draft = get_draft(context.user_data)
+    user_id = update.effective_user.id
+    with attachments_in_progress_lock:
+        if len(draft.attachments) + attachments_in_progress.get(user_id, 0) >= MAX_ATTACHMENTS:
+            update.message.reply_text(f"At most {MAX_ATTACHMENTS} attachments can be sent, is this correct? (y/n)")
+            return 0
+
+    # Largest size of a photo, or the document as it was sent
+    if update.message.photo:
+        kind, media, file_name = PHOTO, update.message.photo[-1], None
+    else:
+        kind, media, file_name = DOCUMENT, update.message.document, update.message.document.file_name
+    logging.info('%s, Input: %s of %s bytes', get_user_details(update), kind, media.file_size)
+
+    if media.file_size and media.file_size > attachment_store.max_size:
+        update.message.reply_text(f"Attachment is larger than {attachment_store.max_size // (1024 * 1024)} MB, please send a smaller one")
+        logging.info('%s, Error: Attachment too large', get_user_details(update))
+        return 0
+
+    # Downloads of up to max_size would otherwise hold up the updates of every other user
+    with attachments_in_progress_lock:
+        attachments_in_progress[user_id] = attachments_in_progress.get(user_id, 0) + 1
+    context.dispatcher.run_async(save_attachment_of_fault, update, context, draft, kind, media, file_name, update=update)
+
+    return 0
+
+
+def save_attachment_of_fault(update, context, draft, kind, media, file_name):
+    """
+    Downloads an attachment sent by get_attachment_of_fault into the attachment store & adds it to the draft it was sent for
+
+    The attachment is dropped if the draft was submitted, cancelled or expired while it was downloaded
+
+    :param update: type: telegram.update.Update
+    Object represents an incoming update.
+
+    :param context: type: telegram.ext.callbackcontext.CallbackContext
+    This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
+
+    :param draft: type: fault_draft.FaultDraft
+    Draft of the fault the attachment was sent for
+
+    :param kind: type: str
+    PHOTO or DOCUMENT
+
+    :param media: type: telegram.PhotoSize or telegram.Document
+    File sent by the user
+
+    :param file_name: type: str
+    Name of the document as it was sent, None for photos
+    """
+    import telegram
+    from attachments import AttachmentTooLarge
+
+    user_id = update.effective_user.id
+    start = time.perf_counter()
+    try:
+        try:
+            attachment = attachment_store.save(lambda: context.bot.get_file(media.file_id).file_path, kind, media.file_id,
+                                               media.file_unique_id, file_name=file_name)
+        except AttachmentTooLarge as error:
+            update.message.reply_text(f"{error}, please send a smaller one")
+            logging.info('%s, Error: %s', get_user_details(update), error)
+            return
+        except (OSError, telegram.error.TelegramError) as error:
+            update.message.reply_text("Unable to save the attachment, please send it again")
+            logging.error('%s, Error: Unable to save the attachment, Error: %s', get_user_details(update), error)
+            return
+
+        with attachments_in_progress_lock:
+            current = context.user_data.get(DRAFT_KEY) is draft
+            if current:
+                draft.update(attachments=draft.attachments + (attachment,))
+                attached = len(draft.attachments)
+    finally:
+        with attachments_in_progress_lock:
+            attachments_in_progress[user_id] -= 1
+            if not attachments_in_progress[user_id]:
+                del attachments_in_progress[user_id]
+
+    if not current:
+        logging.info('%s, Info: Dropped %s %s, the fault was no longer being confirmed', get_user_details(update), kind, attachment.digest[:12])
+        return
+    logging.info('%s, Info: Saved %s %s of %s bytes in %.3fs', get_user_details(update), kind, attachment.digest[:12], attachment.size, time.perf_counter() - start)
+
+    update.message.reply_text(f"{attached} attached, send another or confirm, is this correct? (y/n)")
+
+
+def attachments_pending(update):
+    """
+    Checks if attachments sent by the user are still being downloaded, replying that the fault cannot be confirmed yet
+
+    :param update: type: telegram.update.Update
+    Object represents an incoming update.
+
+    :return: type: bool
+    True if the user has to wait for the attachments before confirming
+    """
+    with attachments_in_progress_lock:
+        pending = attachments_in_progress.get(update.effective_user.id, 0)
+    if pending:
+        update.message.reply_text(f"Still saving {pending} attachment(s), please confirm again once they are attached")
+        logging.info('%s, Info: Confirmed while saving %s attachment(s)', get_user_details(update), pending)
+    return bool(pending)
+
+
+def attach_to_existing_fault(update, context):
+    """
+    Handles the user choosing one of the likely duplicates shown with the fault summary, adding their report to it rather than submitting a new fault
+
+    The report is saved with the existing fault, the recipients of the fault are only sent the attachments of the report, if any
+
+    :param update: type: telegram.update.Update
+    Object represents an incoming update.
+
+    :param context: type: telegram.ext.callbackcontext.CallbackContext
+    This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
+
+    :return: type: int
+    The id of the next state defined in conversation handler
+    """
+    from telegram.ext import ConversationHandler
+
+    fault_id = int(context.matches[0].group(1))
+    logging.info('%s, Input: %s', get_user_details(update), update.message.text)
+    if attachments_pending(update):
+        return 0
+    draft = get_draft(context.user_data)
+
+    # Only the likely duplicates shown with the summary can be chosen, not any fault id typed in
+    if fault_id not in draft.duplicate_ids:
+        update.message.reply_text(f"Fault id: {fault_id} was not shown as a similar fault, is this correct? (y/n)")
+        logging.info('%s, Error: Fault id: %s was not shown as a likely duplicate', get_user_details(update), fault_id)
+        return 0
+
+    # Save the report with the existing fault, together with the attachments sent to its recipients
+    with fault_store.transaction() as connection:
+        fault = fault_store.get_fault(fault_id)
+        if fault is not None and fault.status == ACTIVE:
+            duplicate_index.add_report(connection, fault_id,
+                                       reporter_id=update.effective_user.id,
+                                       reporter_first_name=update.effective_user.first_name,
+                                       reporter_last_name=update.effective_user.last_name,
+                                       reporter_username=update.effective_user.username,
+                                       type_of_fault=draft.type,
+                                       description=draft.description,
+                                       location=draft.location,
+                                       created_at=draft.summarized_at)
+            attachment_store.attach(connection, fault_id, draft.attachments)
+            if draft.attachments:
+                messages = [{attachment.kind: attachment.file_id, "caption": f"Fault id: {fault_id}, sent by another reporter"}
+                            for attachment in draft.attachments]
+                notify_recipients(connection, messages, description="fault attachments", fault_id=fault_id,
+                                  recipients=recipient_router.route(fault.type, fault.location), urgent=is_urgent(fault.type))
+
+    if fault is None or fault.status != ACTIVE:
+        # Resolved since it was shown
+        update.message.reply_text(f"No such active fault id: {fault_id}, is this correct? (y/n)")
+        logging.info('%s, Error: No such active fault id: %s', get_user_details(update), fault_id)
+        return 0
+
+    logging.info('%s, Added report to fault id: %s', get_user_details(update), fault_id, extra={"action": "duplicate", "fault_id": fault_id})
+    update.message.reply_text(f"Added to fault id: {fault_id}, reported by {duplicate_index.count_reports(fault_id) + 1} people, we will attend to you shortly")
+    update.message.reply_text("Type /start to submit another fault")
+
+    # Clear userdata
+    context.user_data.clear()
+    logging.info('Info: Cleared temp user_data')
+
+    return ConversationHandler.END
+
+
 # Sending user information & damage details to Maintenance personnel
 def send_details_to_maintenance_clerks(update, context):
     """
@@ -470,37 +1407,52 @@ def send_details_to_maintenance_clerks(update, context):
     :return: type: int
     The id of the next state defined in conversation handler
     """
+    from telegram.ext import ConversationHandler
+
     # Standardise user input
     confirmation = update.message.text.lower()
 
-    logging.info(f'{get_user_details(update)}, Input: {confirmation}')
+    logging.info('%s, Input: %s', get_user_details(update), confirmation)
 
     # Check if user input yes
     if confirmation in ["y", "yes"]:
+        if attachments_pending(update):
+            return 0
+        draft = get_draft(context.user_data)
+
         # Get running number for fault id
-        # Combine len for both resolved & active fault records to find id
         fault_id = get_fault_index(context)
 
-        # Construct message
-        response = f'*Fault ID:* {fault_id}\n'\
-                   f'*Datetime:* {context.user_data["fault_summary"].date.astimezone(tz).strftime("%d/%m/%Y, %H:%M:%S")}\n'\
-                   f'{display_user_details(update)}\n'\
-                   f'{context.user_data["fault_summary"].text_markdown_v2}'
-
-        # Save message into history
-        context.bot_data['active_history'][fault_id] = response
-        logging.info(f'Saved new fault under id: {fault_id} into bot_data')
-
-        # Send information to specific people(s)
-        for chat_id in recipient_list:
-            try:
-                # Send message
-                updater.bot.send_message(chat_id=chat_id, text=f"New fault has been submitted!")
-                updater.bot.send_message(chat_id=chat_id, text=response, parse_mode="MarkdownV2")
-                logging.info(f"Sent fault details to User: {context.bot.get_chat(chat_id)['first_name']}")
-            except telegram.error.BadRequest:
-                # User have not initialize a chat with bot yet
-                logging.warning(f"User: {chat_id} have not talked to the bot before. Skipping.")
+        # Only the groups of recipients handling this type of fault & location are notified
+        recipients = recipient_router.route(draft.type, draft.location)
+
+        # Save fault into the fault store, together with the notification to specific people(s)
+        with fault_store.transaction() as connection:
+            fault_store.add_fault(fault_id=int(fault_id),
+                                  type_of_fault=draft.type,
+                                  description=draft.description,
+                                  location=draft.location,
+                                  reporter_id=update.effective_user.id,
+                                  reporter_first_name=update.effective_user.first_name,
+                                  reporter_last_name=update.effective_user.last_name,
+                                  reporter_username=update.effective_user.username,
+                                  created_at=draft.summarized_at)
+
+            attachment_store.attach(connection, int(fault_id), draft.attachments)
+
+            # Construct message
+            response = fault_renderer.get(fault_store.get_fault(int(fault_id)))
+
+            # Attachments are sent by their Telegram file_id, they are not uploaded again
+            messages = [dict(text="New fault has been submitted!"), dict(text=response, parse_mode="MarkdownV2")]
+            messages.extend({attachment.kind: attachment.file_id, "caption": f"Fault id: {fault_id}"} for attachment in draft.attachments)
+            notify_recipients(connection, messages, description="fault details", fault_id=int(fault_id), recipients=recipients,
+                              urgent=is_urgent(draft.type))
+        logging.info('%s, Saved new fault under id: %s into fault store', get_user_details(update), fault_id, extra={"action": "submitted", "fault_id": int(fault_id)})
+        logging.info('Info: Routed fault id: %s to %s of %s recipients', fault_id, len(recipients), len(recipient_list))
+        if escalations is not None:
+            escalations.add(fault_id, draft.summarized_at)
+        duplicate_index.add(fault_id, draft.type, draft.description, draft.location)
 
         update.message.reply_text("Fault submitted, we will attend to you shortly")
         update.message.reply_text("Type /start to submit another fault")
@@ -511,7 +1463,7 @@ def send_details_to_maintenance_clerks(update, context):
 
     # Clear userdata
     context.user_data.clear()
-    logging.info(f'Info: Cleared temp user_data')
+    logging.info('Info: Cleared temp user_data')
 
     return ConversationHandler.END
 
@@ -528,14 +1480,11 @@ def error_command_general(update, context):
     :param context: type: telegram.ext.callbackcontext.CallbackContext
     This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
     """
-    logging.info(f'{get_user_details(update)}, Error: Invalid command (General)')
+    logging.info('%s, Error: Invalid command (General)', get_user_details(update))
     update.message.reply_text("Invalid. Please provide a valid command")
     update.message.reply_text("Type /start to get started")
 
 
-error_command_general_handler = MessageHandler(Filters.all, error_command_general)
-
-
 # User cancelled conversation
 def error_user_cancelled(update, context):
     """
@@ -547,7 +1496,9 @@ def error_user_cancelled(update, context):
     :param context: type: telegram.ext.callbackcontext.CallbackContext
     This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
     """
-    logging.info(f'{get_user_details(update)}, Action: /exit')
+    from telegram.ext import ConversationHandler
+
+    logging.info('%s, Action: /exit', get_user_details(update), extra={"action": "/exit"})
 
     # Exit conversation
     update.message.reply_text("Cancelled")
@@ -559,10 +1510,42 @@ def error_user_cancelled(update, context):
     return ConversationHandler.END
 
 
+# Reporter stopped replying
+def expire_draft(update, context):
+    """
+    Drops the draft of a reporter who has not replied for draft_ttl seconds, called when the conversation times out
+
+    :param update: type: telegram.update.Update
+    Last update of the conversation.
+
+    :param context: type: telegram.ext.callbackcontext.CallbackContext
+    This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
+    """
+    if context.user_data.pop(DRAFT_KEY, None) is None:
+        return
+
+    logging.info('%s, Info: Fault report expired', get_user_details(update), extra={"action": "expired"})
+    update.effective_chat.send_message("Your fault report has expired")
+    update.effective_chat.send_message("Type /start to submit a new fault")
+
+
+def expire_abandoned_drafts(context):
+    """
+    Drops drafts left without changes for draft_ttl seconds, e.g. those of conversations interrupted by a restart
+    Runs periodically on the job queue
+
+    :param context: type: telegram.ext.callbackcontext.CallbackContext
+    Context of the job
+    """
+    expired = expire_drafts(dispatcher.user_data, draft_ttl)
+    if expired:
+        logging.info('Info: Dropped %s expired fault drafts', expired)
+
+
 # User insufficient input
 def error_insufficient_input(update, context):
     """
-    Error message for when the user input lesser than 4 characters
+    Error message for when the user input is shorter than the limit of the field, see input_validation
 
     :param update: type: telegram.update.Update
     Object represents an incoming update.
@@ -570,14 +1553,14 @@ def error_insufficient_input(update, context):
     :param context: type: telegram.ext.callbackcontext.CallbackContext
     This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
     """
-    logging.info(f'{get_user_details(update)}, Error: Insufficient information provided')
+    logging.info('%s, Error: Insufficient information provided', get_user_details(update))
     update.message.reply_text("Invalid. Please provide more information")
     update.message.reply_text("Type /exit to cancel this conversation")
 
 
 def error_max_limit_input(update, context):
     """
-    Error message for when the user input more than 500 characters
+    Error message for when the user input is longer than the limit of the field, see input_validation
 
     :param update: type: telegram.update.Update
     Object represents an incoming update.
@@ -585,8 +1568,9 @@ def error_max_limit_input(update, context):
     :param context: type: telegram.ext.callbackcontext.CallbackContext
     This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
     """
-    logging.info(f'{get_user_details(update)}, Error: Too many characters per message, must be <1k')
-    update.message.reply_text("Exceeded character limit. Please the fault below 500 characters")
+    max_length = context.input_limits[0].max_length
+    logging.info('%s, Error: Too many characters per message, must be <=%s', get_user_details(update), max_length)
+    update.message.reply_text(f"Exceeded character limit. Please the fault below {max_length + 1} characters")
     update.message.reply_text("Type /exit to cancel this conversation")
 
 
@@ -601,20 +1585,76 @@ def error_command_input(update, context):
     :param context: type: telegram.ext.callbackcontext.CallbackContext
     This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
     """
-    logging.info(f'{get_user_details(update)}, Error: Invalid command (Conversational)')
+    logging.info('%s, Error: Invalid command (Conversational)', get_user_details(update))
     update.message.reply_text("Invalid. Please provide a valid command")
     update.message.reply_text("Type /exit to cancel this conversation")
 
 
-def main():
+# Latency tracking
+def log_update_latency(update, context):
     """
-    Main function of the bot
+    Logs the time between a message being sent and the bot being done handling it, in both polling and webhook mode
+    Runs after all other handlers, handlers running asynchronously are only counted until they were started
 
-    Does the following:
-        1. Initialize the conversation handler and its states
-        2. Adds all message/command handlers
-        3. Starts the bot and keeps it running
+    :param update: type: telegram.update.Update
+    Object represents an incoming update.
+
+    :param context: type: telegram.ext.callbackcontext.CallbackContext
+    This is a context object passed to the callback called by telegram.ext.Handler or by the telegram.ext.Dispatcher in an error handler added by telegram.ext.Dispatcher.add_error_handler or to the callback of a telegram.ext.Job
     """
+    if update.message:
+        # Message dates only have a resolution of seconds
+        logging.info('%s, Info: Update handled in %.3fs (%s)', get_user_details(update), time.time() - update.message.date.timestamp(), mode)
+
+
+# Archiving
+def archive_resolved_faults(context):
+    """
+    Moves faults resolved longer than archive_after_days ago out of the fault store into the archive
+    Runs periodically on the job queue
+
+    :param context: type: telegram.ext.callbackcontext.CallbackContext
+    Context of the job, holding the archive age in days as job context
+    """
+    # Only the leader archives when running as several processes
+    if cluster is not None and not cluster.is_leader:
+        return
+
+    start = time.perf_counter()
+    archived = fault_store.archive_resolved(time.time() - context.job.context * 24 * 60 * 60)
+    if archived:
+        logging.info('Info: Archived %s resolved faults in %.3fs, %s faults archived in total', archived, time.perf_counter() - start, len(fault_store.archive))
+
+
+def add_handlers():
+    """
+    Initialize the conversation handler and its states, then adds all message/command handlers to the dispatcher
+    Call after create_app
+    """
+    import telegram
+    from telegram.ext import CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, Filters, ConversationHandler
+    from input_validation import InputLimits, InputLength, TOO_SHORT, TOO_LONG
+
+    # Commands only available to the recipients
+    recipients_only = Filters.user(user_id=recipient_ids)
+    history_handler = CommandHandler('history', history, recipients_only)
+    browse_page_handler = CallbackQueryHandler(browse_page, pattern=r'^(history:(active|resolved)|search:[0-9a-f]+):\d+$', run_async=True)
+    search_handler = CommandHandler('search', search, recipients_only, run_async=True)
+    export_handler = CommandHandler('export', export, recipients_only, run_async=True)
+    mark_resolve_active_fault_handler = CommandHandler('resolved', mark_resolve_active_fault, recipients_only, run_async=True)
+    new_fault_handler = CommandHandler('start', start)
+    error_command_general_handler = MessageHandler(Filters.all, error_command_general, run_async=True)
+    update_latency_handler = TypeHandler(telegram.Update, log_update_latency)
+
+    # Text of every field is classified by its length once, see input_validation
+    text_input = Filters.text & ~Filters.command
+
+    def field_handlers(field, callback):
+        limits = input_limits[field]
+        return [MessageHandler(text_input & InputLength(limits), callback),
+                MessageHandler(text_input & InputLength(limits, TOO_SHORT), error_insufficient_input),
+                MessageHandler(text_input & InputLength(limits, TOO_LONG), error_max_limit_input)]
+
     # Define conversation handler
     conv_handler = ConversationHandler(
         entry_points=[
@@ -623,38 +1663,139 @@ def main():
         ],
         states={
             # Gathering user information states
-            0: [MessageHandler((Filters.text & ~Filters.command & Filters.regex(re.compile(r'^(Yes|Y|No|N)$', re.IGNORECASE))), send_details_to_maintenance_clerks)],
+            0: [MessageHandler((Filters.text & ~Filters.command & Filters.regex(re.compile(r'^(Yes|Y|No|N)$', re.IGNORECASE))), send_details_to_maintenance_clerks),
+                # Likely duplicate chosen instead
+                MessageHandler(Filters.text & ~Filters.command & Filters.regex(re.compile(r'^Same as fault (\d+)$', re.IGNORECASE)), attach_to_existing_fault),
+                # Photos & documents of the fault
+                MessageHandler(Filters.photo | Filters.document, get_attachment_of_fault)],
             # Type of fault
-            5: [MessageHandler((Filters.text & ~Filters.command & ~Filters.regex(r'^.{1,4}$') & ~Filters.regex(r'^.{500,}$')), get_type_of_fault)],
+            5: field_handlers("type", get_type_of_fault),
             # Description of fault
-            6: [MessageHandler((Filters.text & ~Filters.command & ~Filters.regex(r'^.{1,4}$') & ~Filters.regex(r'^.{500,}$')), get_description_of_fault)],
+            6: field_handlers("description", get_description_of_fault),
             # Location of fault
-            7: [MessageHandler((Filters.text & ~Filters.command & ~Filters.regex(r'^.{1,4}$') & ~Filters.regex(r'^.{500,}$')), get_location_of_fault)],
+            7: field_handlers("location", get_location_of_fault),
             # Selecting history version
-            100: [MessageHandler(Filters.text & ~Filters.command & Filters.regex(re.compile(r'^(Active|Resolved)$', re.IGNORECASE)), get_history_version)]
+            100: [MessageHandler(Filters.text & ~Filters.command & Filters.regex(re.compile(r'^(Active|Resolved)$', re.IGNORECASE)), get_history_version)],
+            # Reporter stopped replying
+            ConversationHandler.TIMEOUT: [TypeHandler(telegram.Update, expire_draft)]
         },
         fallbacks=[
             # User cancelled command
             MessageHandler((Filters.command & Filters.regex(re.compile(r'^(/exit)$', re.IGNORECASE))), error_user_cancelled),
-            # Regex to match any character below 4 character count
-            MessageHandler(Filters.regex(r'^.{1,4}$'), error_insufficient_input),
-            # Regex to match any character above 500 character count
-            MessageHandler(Filters.regex(r'^.{500,}$'), error_max_limit_input),
+            # Input below 5 characters outside of the fault fields
+            MessageHandler(text_input & InputLength(InputLimits(), TOO_SHORT), error_insufficient_input),
+            # Input above 499 characters outside of the fault fields
+            MessageHandler(text_input & InputLength(InputLimits(), TOO_LONG), error_max_limit_input),
             # Match other commands
             MessageHandler((Filters.command & ~Filters.regex(re.compile(r'^(/exit)$', re.IGNORECASE))), error_command_input)
-        ]
+        ],
+        conversation_timeout=draft_ttl
     )
 
     # Add handlers
     dispatcher.add_handler(conv_handler)
     dispatcher.add_handler(history_handler)
+    dispatcher.add_handler(browse_page_handler)
+    dispatcher.add_handler(search_handler)
+    dispatcher.add_handler(export_handler)
     dispatcher.add_handler(mark_resolve_active_fault_handler)
     dispatcher.add_handler(error_command_general_handler)
+    dispatcher.add_handler(update_latency_handler, group=1)
+
+    # Time every handler
+    bot_metrics.instrument_dispatcher(dispatcher)
+
+
+def main():
+    """
+    Main function of the bot
+
+    Does the following:
+        1. Creates the bot from the environment variables
+        2. Initialize the conversation handler and its states
+        3. Adds all message/command handlers
+        4. Starts the bot in polling or webhook mode and keeps it running, the archive is loaded in the background
+    """
+    global mode, cluster
+
+    parser = argparse.ArgumentParser(description="Runs the infrastructure fault reporting bot on Telegram")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling", help="How updates are received from Telegram")
+    mode = parser.parse_args().mode
+
+    create_app()
+    add_handlers()
+
+    # Drop abandoned fault drafts every hour
+    updater.job_queue.run_repeating(expire_abandoned_drafts, interval=60 * 60, first=60)
+
+    # Archive old resolved faults every hour
+    if os.getenv("archive_after_days"):
+        updater.job_queue.run_repeating(archive_resolved_faults, interval=60 * 60, first=60, context=float(os.getenv("archive_after_days")))
+
+    # Escalate faults left active for too long, the first check schedules the active faults
+    if escalations is not None:
+        updater.job_queue.run_repeating(escalate_active_faults, interval=float(os.getenv("escalation_interval", "60")), first=1)
+
+    # Serve metrics locally
+    if os.getenv("metrics_port"):
+        bot_metrics.serve(int(os.getenv("metrics_port")) + shard_index)
+
+    # Send notifications saved in the outbox, including those left pending by an earlier run
+    outbox.start()
 
     # Start bot, stop when interrupted
-    updater.start_polling()
+    webhook_server = None
+    if mode == "webhook":
+        if shard_count > 1:
+            logging.critical("Error: webhook mode runs as a single process, shard_count must be 1")
+            raise EnvironmentVariableError("webhook mode runs as a single process, shard_count must be 1")
+        if not os.getenv("webhook_url"):
+            logging.critical("Error: webhook_url is required in webhook mode")
+            raise EnvironmentVariableError("webhook_url is required in webhook mode")
+        if not os.getenv("webhook_secret"):
+            logging.critical("Error: webhook_secret is required in webhook mode")
+            raise EnvironmentVariableError("webhook_secret is required in webhook mode")
+
+        from webhook import WebhookServer, start_webhook
+
+        webhook_server = WebhookServer(updater.bot, dispatcher.update_queue,
+                                       secret_token=os.getenv("webhook_secret"),
+                                       listen=os.getenv("webhook_listen", "0.0.0.0"),
+                                       port=int(os.getenv("webhook_port", "8443")),
+                                       url_path=urllib.parse.urlsplit(os.getenv("webhook_url")).path or "/")
+        start_webhook(updater, webhook_server, os.getenv("webhook_url"), secret_token=os.getenv("webhook_secret"))
+    elif shard_count > 1:
+        from cluster import ShardedRuntime, start_sharded
+
+        cluster = ShardedRuntime(fault_store.hot, updater.bot, dispatcher.update_queue, shard_index, shard_count,
+                                 lease_ttl=float(os.getenv("leader_lease_ttl", "15")))
+        start_sharded(updater, cluster)
+    else:
+        updater.start_polling()
+
+    # Updates are handled while the archive index is read & the active faults are indexed
+    threading.Thread(target=load_archive, name="archive_loader", daemon=True).start()
+    threading.Thread(target=load_duplicate_index, name="duplicate_indexer", daemon=True).start()
     updater.idle()
 
+    # Hand over the leader lease when running as several processes
+    if cluster:
+        cluster.stop()
+
+    # Stop draining the outbox, pending deliveries are replayed on the next start
+    outbox.stop()
+
+    # Stop receiving updates in webhook mode
+    if webhook_server:
+        webhook_server.stop()
+
+    # Release metrics server, fan-out workers, recipient directory, persistence journal & fault store
+    bot_metrics.shutdown()
+    fan_out.shutdown()
+    recipient_directory.shutdown()
+    persistence.close()
+    fault_store.close()
+
 
 if __name__ == '__main__':
     main()
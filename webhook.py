@@ -0,0 +1,217 @@
+"""
+    Webhook server receiving updates from Telegram, an alternative to long polling
+
+    Telegram pushes every update as a JSON POST request to the webhook. The server runs an asyncio event loop in its own
+    thread, verifies the secret token Telegram sends along (X-Telegram-Bot-Api-Secret-Token), decodes the update and
+    puts it on the dispatcher's update queue without waiting for it to be handled, so the accept loop is never blocked
+    by the handlers.
+
+    Updates recorded as JSON can be replayed locally by POSTing them to the server, see benchmarks/webhook_replay.py
+"""
+
+# Import statements
+import hmac
+import json
+import asyncio
+import logging
+import threading
+import telegram
+
+# Header carrying the secret token set through setWebhook
+SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"
+
+# Reason phrases of the statuses sent by the server
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large"}
+
+
+class WebhookServer:
+    """
+    Minimal HTTP/1.1 server accepting Telegram updates on a single path
+    """
+    def __init__(self, bot, update_queue, secret_token, listen="0.0.0.0", port=8443, url_path="/", max_body_size=1 << 20):
+        """
+        :param bot: type: telegram.Bot
+        Bot the decoded updates are bound to
+
+        :param update_queue: type: queue.Queue
+        Update queue of the dispatcher
+
+        :param secret_token: type: str
+        Secret token every request has to carry, requests without it are rejected
+
+        :param listen: type: str
+        Address to listen on
+
+        :param port: type: int
+        Port to listen on
+
+        :param url_path: type: str
+        Path updates are posted to
+
+        :param max_body_size: type: int
+        Max bytes accepted in a request body
+        """
+        if not secret_token:
+            raise ValueError("Missing secret token, requests to the webhook could not be verified")
+
+        self.bot = bot
+        self.update_queue = update_queue
+        self.secret_token = secret_token
+        self.listen = listen
+        self.port = port
+        self.url_path = url_path if url_path.startswith("/") else f"/{url_path}"
+        self.max_body_size = max_body_size
+        self.received = 0
+        self.rejected = 0
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def start(self):
+        """
+        Starts the event loop in a background thread and waits until the server is listening
+        """
+        self._thread = threading.Thread(target=self._run, name="webhook", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._server is None:
+            raise RuntimeError(f"Unable to start webhook server on {self.listen}:{self.port}")
+        logging.info("Info: Webhook server listening on %s:%s%s", self.listen, self.port, self.url_path)
+
+    def stop(self):
+        """
+        Stops accepting updates and waits for the event loop to finish
+        """
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle_connection, self.listen, self.port))
+        except OSError as error:
+            logging.critical("Error: Unable to start webhook server, Error: %s", error)
+            self._ready.set()
+            return
+
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Serves the requests of a single connection, Telegram keeps connections alive between updates
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                status, body_read = await self._handle_request(request_line.decode("latin-1").split(), headers, reader)
+                # The body of a rejected request is left unread, the next request cannot be found on this connection
+                keep_alive = body_read and headers.get("connection", "").lower() != "close"
+
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Length: 0\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1"))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, request_line, headers, reader):
+        """
+        Validates a single request and queues the update it carries
+
+        :return: type: tuple
+        (HTTP status to answer with, True if the request body was read)
+        """
+        if len(request_line) < 2 or request_line[0] != "POST":
+            return 405, False
+        if request_line[1] != self.url_path:
+            return 404, False
+
+        try:
+            content_length = int(headers.get("content-length", "0"))
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            self.rejected += 1
+            logging.warning("Webhook: Rejected update with an invalid Content-Length: %s", headers.get("content-length"))
+            return 400, False
+        if content_length > self.max_body_size:
+            self.rejected += 1
+            return 413, False
+        if not hmac.compare_digest(headers.get(SECRET_TOKEN_HEADER, ""), self.secret_token):
+            self.rejected += 1
+            logging.warning("Webhook: Rejected update with an invalid secret token")
+            return 403, False
+        body = await reader.readexactly(content_length)
+
+        try:
+            update = telegram.Update.de_json(json.loads(body), self.bot)
+        except (ValueError, TypeError, KeyError) as error:
+            self.rejected += 1
+            logging.warning("Webhook: Unable to decode update, Error: %s", error)
+            return 400, True
+
+        # Handed over to the dispatcher thread, the queue is unbounded so this never blocks
+        self.update_queue.put(update)
+        self.received += 1
+        return 200, True
+
+
+def start_webhook(updater, server, webhook_url, secret_token, drop_pending_updates=False):
+    """
+    Starts the job queue, the dispatcher & the webhook server, then points the bot's webhook at the server
+
+    Mirrors telegram.ext.Updater.start_webhook so that updater.idle() & updater.stop() work the same as in polling mode
+
+    :param updater: type: telegram.ext.Updater
+    Updater of the bot
+
+    :param server: type: WebhookServer
+    Server receiving the updates
+
+    :param webhook_url: type: str
+    Public URL Telegram posts the updates to
+
+    :param secret_token: type: str
+    Secret token Telegram sends along with every update
+
+    :param drop_pending_updates: type: bool
+    Drop the updates that arrived while the bot was not running
+    """
+    updater.running = True
+    updater.job_queue.start()
+
+    dispatcher_ready = threading.Event()
+    threading.Thread(target=updater.dispatcher.start, args=(dispatcher_ready,), name="dispatcher", daemon=True).start()
+    dispatcher_ready.wait()
+
+    server.start()
+
+    # setWebhook's secret_token is newer than this version of python-telegram-bot, pass it through as is
+    updater.bot.set_webhook(url=webhook_url, drop_pending_updates=drop_pending_updates,
+                            api_kwargs={"secret_token": secret_token})
+    logging.info("Info: Webhook set to %s", webhook_url)